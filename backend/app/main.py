@@ -2,7 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes.extract import router as extract_router
 from app.routes.report import router as report_router
+from app.routes.jobs import router as jobs_router
 from app.auth.middleware import auth_logging_middleware
+from app.services.claude import close_async_client, get_circuit_breaker
+from app.services.jobs import get_job_manager
+from app.services.pdf_parser import shutdown_process_pool
+from app.services.upload_spool import UploadSizeLimitMiddleware, UPLOAD_MAX_BYTES, UPLOAD_FORM_OVERHEAD_BYTES
+from app.services.batch import BATCH_MAX_FILES
 import os
 
 app = FastAPI(
@@ -34,6 +40,16 @@ if os.getenv("ENVIRONMENT") == "production":
     production_origins = os.getenv("PRODUCTION_ORIGINS", "").split(",")
     origins.extend([origin.strip() for origin in production_origins if origin.strip()])
 
+# Refuse oversized upload bodies while they are still arriving (inside CORS,
+# so browsers can read the 413)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        "/api/upload/": UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES,
+        "/api/upload/batch/": BATCH_MAX_FILES * UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES
+    }
+)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -48,6 +64,20 @@ app.middleware("http")(auth_logging_middleware)
 
 app.include_router(extract_router, prefix="/api")
 app.include_router(report_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    # Release pooled connections held by the shared Claude client
+    await close_async_client()
+
+@app.on_event("shutdown")
+async def shutdown_job_workers():
+    await get_job_manager().shutdown()
+
+@app.on_event("shutdown")
+def shutdown_pdf_workers():
+    shutdown_process_pool()
 
 @app.get("/")
 def read_root():
@@ -55,4 +85,10 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    # The API stays healthy while Claude is unavailable; the breaker state
+    # tells clients (and dashboards) that extraction is currently failing fast
+    breaker = get_circuit_breaker()
+    return {
+        "status": "healthy",
+        "claude_circuit_breaker": breaker.snapshot() if breaker else {"state": "disabled"}
+    }
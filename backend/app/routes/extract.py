@@ -1,13 +1,15 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from app.services.pdf_parser import pdf_to_text
-from app.services.claude import extract_transactions_chunked
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.services.statement_pipeline import process_statement_upload
+from app.services.jobs import get_job_manager, JobQueueFullError
+from app.services.batch import expand_uploads, process_statement_batch, BatchUploadError
+from app.services.progress import ProgressChannel, sse_events, SSE_HEADERS
 from app.services.csv_export import CSVExportService
+from app.services.upload_spool import spool_upload, UploadRejectedError
 from app.auth.middleware import get_current_user
-from typing import Dict, Any
+from typing import Dict, Any, List
+import asyncio
 import logging
-import os
-import tempfile
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,147 +21,114 @@ router = APIRouter()
 async def upload_statement(
     file: UploadFile = File(...),
     password: str = Form(None),
+    mode: str = Form("sync"),
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
     Enhanced bank statement upload and analysis with validation and CSV export
+    
+    mode="job" queues the statement for background processing and returns a
+    job id immediately; poll GET /api/jobs/{job_id} for progress and results.
+    mode="stream" responds with server-sent progress events ending in a
+    "result" event that carries the usual response. In every mode, identical
+    uploads that arrive while one is processing share its run (and its
+    progress events).
     """
     logger.info(f"Received file: {file.filename}, size: {file.size} bytes from user: {current_user.get('username', current_user.get('user_id'))}")
     
-    # Validate file size (max 50MB)
-    if file.size > 50 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="File size too large. Maximum allowed size is 50MB.")
+    # Spooled in blocks (max 50MB, must be a PDF) rather than read into memory at once
+    try:
+        content = await spool_upload(file)
+    except UploadRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-        content = await file.read()
-        temp_file.write(content)
-        filepath = temp_file.name
+    if mode == "job":
+        return submit_statement_job(content, file.filename, password, current_user)
     
-    logger.info(f"File saved to: {filepath}, written bytes: {len(content)}")
+    if mode == "stream":
+        return stream_statement_processing(content, file.filename, password)
     
+    status_code, response = await process_statement_upload(content, file.filename, password)
+    return JSONResponse(status_code=status_code, content=response)
+
+def submit_statement_job(content, filename, password, current_user):
+    """
+    Queue an uploaded statement for background processing
+    """
     try:
-        # Step 1: Extract text from PDF
-        try:
-            text = pdf_to_text(filepath, password)
-            logger.info(f"PDF parsing successful. Extracted text length: {len(text)} characters")
-            logger.info(f"First 200 characters of extracted text: {text[:200]}...")
-        except Exception as e:
-            logger.error(f"PDF parsing failed: {str(e)}")
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": f"PDF parsing failed: {str(e)}",
-                    "error_type": "pdf_parsing_error",
-                    "suggestions": [
-                        "Ensure the PDF is not corrupted",
-                        "Check if the correct password was provided for protected PDFs",
-                        "Try downloading the statement again from your bank"
-                    ]
-                }
-            )
-        
-        # Step 2: Validate that this is a bank statement
+        job = get_job_manager().submit(
+            lambda progress: process_statement_upload(content, filename, password, progress),
+            owner=current_user.get("user_id"),
+            filename=filename
+        )
+    except JobQueueFullError as e:
+        logger.warning(f"Rejected job for {filename}: {str(e)}")
+        return JSONResponse(
+            status_code=503,
+            content={
+                "error": "Too many statements are being processed. Please try again shortly.",
+                "error_type": "job_queue_full",
+                "retry_after": 30
+            },
+            headers={"Retry-After": "30"}
+        )
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"/api/jobs/{job['id']}"
+        }
+    )
+
+def stream_statement_processing(content, filename, password):
+    """
+    Run the pipeline in the background and stream its progress as SSE;
+    processing continues even if the client disconnects
+    """
+    channel = ProgressChannel()
+    
+    async def run():
         try:
-            # Import here to avoid circular imports
-            from app.services.validators import validate_bank_statement_pdf
-            validation_result = validate_bank_statement_pdf(filepath, file.filename, text)
-            
-            if not validation_result["is_valid"]:
-                logger.warning(f"Bank statement validation failed: {validation_result['error']}")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "error": validation_result["error"],
-                        "error_type": "invalid_bank_statement",
-                        "confidence": validation_result.get("confidence", 0),
-                        "analysis": validation_result.get("analysis", {}),
-                        "suggestions": validation_result.get("suggestions", [])
-                    }
-                )
-            
-            logger.info(f"Bank statement validation passed with confidence: {validation_result['confidence']}")
-        
+            status_code, response = await process_statement_upload(content, filename, password, channel)
         except Exception as e:
-            logger.warning(f"Validation service error: {str(e)} - proceeding with extraction")
+            logger.error(f"Streamed processing failed: {str(e)}")
+            status_code, response = 500, {"error": f"Processing failed: {str(e)}", "error_type": "processing_error"}
         
-        # Step 3: Extract transactions using Claude AI
-        try:
-            logger.info("Starting transaction extraction with Claude API (chunked processing)...")
-            data = extract_transactions_chunked(text)
-            
-            # Check if the extraction returned an error
-            if isinstance(data, dict) and "error" in data:
-                logger.error(f"Transaction extraction returned error: {data['error']}")
-                return JSONResponse(
-                    status_code=500,
-                    content={
-                        "error": f"AI analysis failed: {data['error']}",
-                        "error_type": "ai_analysis_error",
-                        "suggestions": [
-                            "The document may contain unusual formatting",
-                            "Try a different bank statement format",
-                            "Contact support if the issue persists"
-                        ]
-                    }
-                )
-            
-            # Log summary of extracted data
-            if isinstance(data, dict) and "transactions" in data:
-                income_count = len(data["transactions"].get("income", []))
-                expense_count = len(data["transactions"].get("expenses", []))
-                logger.info(f"Transaction extraction successful! Found {income_count} income and {expense_count} expense transactions")
-                
-                # Validate data structure
-                validated_data = validate_extraction_data(data)
-                
-                # Step 4: Generate CSV exports
-                try:
-                    csv_service = CSVExportService()
-                    csv_data = csv_service.export_all_data(validated_data)
-                    logger.info("CSV export generation successful")
-                except Exception as e:
-                    logger.warning(f"CSV export failed: {str(e)} - continuing without CSV data")
-                    csv_data = {}
-                
-                return JSONResponse(
-                    content={
-                        "success": True,
-                        "extracted": validated_data,
-                        "csv_exports": csv_data,
-                        "metadata": {
-                            "total_transactions": income_count + expense_count,
-                            "income_transactions": income_count,
-                            "expense_transactions": expense_count,
-                            "processing_time": "Complete",
-                            "confidence": validation_result.get("confidence", 1.0) if 'validation_result' in locals() else 1.0
-                        }
-                    }
-                )
-            
-            return JSONResponse(content={"extracted": data})
-            
-        except Exception as e:
-            logger.error(f"Transaction extraction exception: {str(e)}")
-            return JSONResponse(
-                status_code=500,
-                content={
-                    "error": f"AI analysis failed: {str(e)}",
-                    "error_type": "ai_processing_error",
-                    "suggestions": [
-                        "The document may be too complex for automatic processing",
-                        "Ensure the PDF contains clear, readable text",
-                        "Try uploading a simpler bank statement format"
-                    ]
-                }
-            )
+        channel.publish({"stage": "result", "status": "completed" if status_code < 400 else "failed", "status_code": status_code, "result": response})
+        channel.close()
+    
+    # Keep a reference so the task isn't garbage collected mid-run
+    channel.task = asyncio.create_task(run())
+    return StreamingResponse(sse_events(channel), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/upload/batch/")
+async def upload_statement_batch(
+    files: List[UploadFile] = File(...),
+    password: str = Form(None),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Upload and analyze many bank statements at once (PDFs and/or ZIP
+    archives of PDFs). Returns per-file results and a merged, de-duplicated
+    transaction timeline.
+    """
+    logger.info(f"Received batch of {len(files)} files from user: {current_user.get('username', current_user.get('user_id'))}")
     
-    finally:
-        # Clean up temporary file
+    uploads = []
+    for upload in files:
         try:
-            os.unlink(filepath)
-        except Exception as e:
-            logger.warning(f"Failed to clean up temporary file: {e}")
+            uploads.append((upload.filename, await spool_upload(upload, allow_zip=True)))
+        except UploadRejectedError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    try:
+        statements = expand_uploads(uploads)
+    except BatchUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return await process_statement_batch(statements, password)
 
 @router.post("/export-csv/")
 async def export_csv(
@@ -217,47 +186,3 @@ async def export_csv(
             status_code=500,
             content={"error": f"CSV export failed: {str(e)}"}
         )
-
-def validate_extraction_data(data):
-    """
-    Validate and ensure the extracted data has the correct structure
-    """
-    validated = {
-        "account_details": {
-            "name": data.get("account_details", {}).get("name", "Unknown"),
-            "account_number": data.get("account_details", {}).get("account_number", "Unknown"),
-            "currency": data.get("account_details", {}).get("currency", "LKR"),
-            "statement_date": data.get("account_details", {}).get("statement_date", "Unknown")
-        },
-        "final_balance": float(data.get("final_balance", 0)),
-        "transactions": {
-            "income": [],
-            "expenses": []
-        }
-    }
-    
-    # Validate income transactions
-    for transaction in data.get("transactions", {}).get("income", []):
-        if validate_transaction(transaction):
-            validated["transactions"]["income"].append(transaction)
-    
-    # Validate expense transactions
-    for transaction in data.get("transactions", {}).get("expenses", []):
-        if validate_transaction(transaction):
-            validated["transactions"]["expenses"].append(transaction)
-    
-    return validated
-
-def validate_transaction(transaction):
-    """
-    Validate individual transaction structure
-    """
-    return (
-        isinstance(transaction, dict) and
-        "date" in transaction and
-        "description" in transaction and
-        "amount" in transaction and
-        isinstance(transaction["amount"], (int, float)) and
-        transaction["amount"] > 0
-    )
-
@@ -0,0 +1,47 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from app.services.jobs import get_job_manager, JobManager
+from app.services.progress import sse_events, SSE_HEADERS
+from app.auth.middleware import get_current_user
+from typing import Dict, Any
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Status, per-stage progress and (once finished) the result of a
+    statement processing job submitted with mode="job"
+    """
+    return JobManager.public_view(find_user_job(job_id, current_user))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Server-sent event stream of a job's progress: "progress" events for
+    each stage (pages parsed, validation confidence, chunk i/N started and
+    finished with token counts and transactions so far, each transaction as
+    Claude extracts it), then a single
+    "result" event. Events already emitted are replayed first, so clients
+    can reconnect at any point.
+    """
+    job = find_user_job(job_id, current_user)
+    return StreamingResponse(sse_events(job["events"]), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def find_user_job(job_id, current_user):
+    job = get_job_manager().get(job_id)
+    
+    # Jobs belonging to other users are reported as missing
+    if job is None or job["owner"] != current_user.get("user_id"):
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    return job
@@ -0,0 +1,149 @@
+"""
+Bulk processing of many bank statements in one request
+
+Files are processed in parallel; their Claude chunks all go through one
+shared scheduler, so a year of statements takes time proportional to the
+total chunk count divided by the concurrency limit, not to the file count.
+"""
+import io
+import os
+import asyncio
+import logging
+import zipfile
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Optional
+from collections import Counter
+
+from app.services.claude import shared_chunk_concurrency, transaction_key
+from app.services.line_parser import normalize_date
+from app.services.statement_pipeline import process_statement_bytes
+from app.services.upload_spool import has_zip_header
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "36"))
+BATCH_CHUNK_CONCURRENCY = int(os.getenv("BATCH_CHUNK_CONCURRENCY", "8"))  # Max Claude calls in flight per batch
+MAX_STATEMENT_BYTES = 50 * 1024 * 1024
+
+class BatchUploadError(ValueError):
+    """Raised when a batch upload can't be accepted"""
+    pass
+
+def expand_uploads(uploads: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    """
+    Turn uploaded (filename, content) pairs into the list of PDFs to process,
+    unpacking ZIP archives (PDF entries only, macOS metadata skipped)
+    """
+    statements = []
+
+    for filename, content in uploads:
+        if not (filename or "").lower().endswith(".zip") and not has_zip_header(content):
+            statements.append((filename, content))
+            continue
+
+        try:
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or not name.lower().endswith(".pdf") or name.startswith("__MACOSX/"):
+                        continue
+                    if info.file_size > MAX_STATEMENT_BYTES:
+                        raise BatchUploadError(f"{name} in {filename} is larger than 50MB")
+                    statements.append((os.path.basename(name), archive.read(info)))
+        except zipfile.BadZipFile:
+            raise BatchUploadError(f"{filename} is not a valid ZIP archive")
+
+    if not statements:
+        raise BatchUploadError("No PDF statements found in the upload")
+    if len(statements) > BATCH_MAX_FILES:
+        raise BatchUploadError(f"Too many statements ({len(statements)}). Maximum allowed is {BATCH_MAX_FILES} per batch.")
+
+    return statements
+
+async def process_statement_batch(statements: List[Tuple[str, bytes]], password: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Process (filename, content) pairs concurrently and merge their results
+
+    Returns per-file results (in upload order) plus a merged,
+    de-duplicated transaction timeline across all statements.
+    """
+    logger.info(f"Processing batch of {len(statements)} statements, chunk concurrency {BATCH_CHUNK_CONCURRENCY}")
+
+    async def process(filename, content):
+        try:
+            return await process_statement_bytes(content, filename, password)
+        except Exception as e:
+            logger.error(f"Batch processing of {filename} failed: {str(e)}")
+            return 500, {"error": f"Processing failed: {str(e)}", "error_type": "processing_error"}
+
+    with shared_chunk_concurrency(BATCH_CHUNK_CONCURRENCY):
+        outcomes = await asyncio.gather(*(process(filename, content) for filename, content in statements))
+
+    files = [
+        {"filename": filename, "status_code": status_code, "result": content}
+        for (filename, _), (status_code, content) in zip(statements, outcomes)
+    ]
+    merged = merge_statement_timeline(files)
+    succeeded = sum(1 for f in files if f["status_code"] < 400)
+
+    return {
+        "success": succeeded > 0,
+        "files": files,
+        "merged": merged,
+        "metadata": {
+            "files": len(files),
+            "succeeded": succeeded,
+            "failed": len(files) - succeeded,
+            "total_transactions": len(merged["timeline"]),
+            "duplicates_removed": merged["duplicates_removed"]
+        }
+    }
+
+def _timeline_date(transaction: Dict[str, Any]) -> datetime:
+    normalized = normalize_date(str(transaction.get("date", ""))) or str(transaction.get("date", ""))
+    try:
+        return datetime.strptime(normalized, "%d%b%Y")
+    except ValueError:
+        return datetime.max  # Unparseable dates go to the end
+
+def merge_statement_timeline(files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge the transactions of successfully processed statements
+
+    Consecutive statements often repeat transactions around the period
+    boundary. A transaction (by date, description and amount) is kept as
+    many times as it appears in the statement that lists it most often, so
+    overlaps are dropped but genuine repeats within a statement survive.
+    """
+    kept = {"income": Counter(), "expenses": Counter()}
+    entries = []
+    total = 0
+
+    for file_index, f in enumerate(files):
+        extracted = f["result"].get("extracted") if f["status_code"] < 400 else None
+        if not extracted:
+            continue
+        for kind in ("income", "expenses"):
+            transactions = extracted.get("transactions", {}).get(kind, [])
+            seen_here = Counter()
+            total += len(transactions)
+            for position, transaction in enumerate(transactions):
+                key = transaction_key(transaction)
+                seen_here[key] += 1
+                if seen_here[key] > kept[kind][key]:
+                    kept[kind][key] = seen_here[key]
+                    entries.append((_timeline_date(transaction), file_index, position, kind, transaction, f["filename"]))
+
+    entries.sort(key=lambda entry: entry[:3])
+
+    merged = {"income": [], "expenses": []}
+    timeline = []
+    for _, _, _, kind, transaction, filename in entries:
+        merged[kind].append(transaction)
+        timeline.append(dict(transaction, type=kind, source=filename))
+
+    return {
+        "transactions": merged,
+        "timeline": timeline,
+        "duplicates_removed": total - len(timeline)
+    }
@@ -0,0 +1,234 @@
+"""
+Page- and line-aware chunking of extracted bank statement text
+"""
+import os
+import re
+import logging
+from typing import List, Dict, Any, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Token budgets per chunk sent to Claude
+CHUNK_INPUT_TOKEN_BUDGET = int(os.getenv("CLAUDE_CHUNK_INPUT_TOKENS", "8000"))
+MAX_OUTPUT_TOKENS = int(os.getenv("CLAUDE_MAX_OUTPUT_TOKENS", "8192"))  # Model output limit
+MIN_OUTPUT_TOKENS = 1024
+
+# Claude output format: "json" (default) or "rows" (compact pipe-delimited rows)
+OUTPUT_FORMAT = os.getenv("CLAUDE_OUTPUT_FORMAT", "json").lower()
+
+# Local token estimation (statement text is number-heavy, so be conservative)
+CHARS_PER_TOKEN = 3.0
+OUTPUT_TOKENS_BASE = 250  # Account details and JSON scaffolding
+OUTPUT_TOKENS_PER_TRANSACTION = 20 if OUTPUT_FORMAT == "rows" else 50
+OUTPUT_SAFETY_FACTOR = 1.25
+
+# Page markers emitted by pdf_to_text, e.g. "--- PAGE 3 ---" (older texts also mark "--- PAGE 3 (FALLBACK) ---")
+PAGE_MARKER_PATTERN = re.compile(r'^--- PAGE (\d+)(?: \(FALLBACK\))? ---$')
+
+# A line that starts with a date begins a new transaction; lines without one
+# continue the previous transaction (multi-line descriptions) and stay with it
+TRANSACTION_START_PATTERN = re.compile(
+    r'^\s*(?:'
+    r'\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}'   # DD/MM/YYYY
+    r'|\d{1,2}\s+[A-Za-z]{3}\s+\d{2,4}'      # DD MMM YYYY
+    r'|\d{2}[A-Za-z]{3}\d{4}'                # DDMMMYYYY
+    r'|\d{4}-\d{2}-\d{2}'                    # YYYY-MM-DD
+    r')\b'
+)
+
+# Lines carrying a monetary amount; used to estimate how many transactions Claude will return
+AMOUNT_PATTERN = re.compile(r'[\d,]+\.\d{2}')
+
+def estimate_tokens(text: str) -> int:
+    """Rough local estimate of the number of tokens in text"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def count_transaction_lines(text: str) -> int:
+    """Number of lines that look like they carry a transaction amount"""
+    return sum(1 for line in text.split('\n') if AMOUNT_PATTERN.search(line))
+
+def estimate_max_tokens(text: str) -> int:
+    """
+    Output token budget for extracting text: enough for every candidate
+    transaction line plus headroom, capped at the model limit
+    """
+    estimate = (OUTPUT_TOKENS_BASE + count_transaction_lines(text) * OUTPUT_TOKENS_PER_TRANSACTION) * OUTPUT_SAFETY_FACTOR
+    return max(MIN_OUTPUT_TOKENS, min(int(estimate), MAX_OUTPUT_TOKENS))
+
+# Most transaction lines a single chunk may hold without risking truncated output
+MAX_TRANSACTIONS_PER_CHUNK = max(1, int((MAX_OUTPUT_TOKENS / OUTPUT_SAFETY_FACTOR - OUTPUT_TOKENS_BASE) / OUTPUT_TOKENS_PER_TRANSACTION))
+
+def split_text_into_chunks(text: str, max_input_tokens: int = CHUNK_INPUT_TOKEN_BUDGET,
+                          max_transactions: int = MAX_TRANSACTIONS_PER_CHUNK) -> List[Dict[str, Any]]:
+    """
+    Split statement text into as few chunks as the token budgets allow, without overlap
+
+    A chunk holds at most max_input_tokens of (estimated) input and at most
+    max_transactions candidate transaction lines, so its output fits in the
+    model's max_tokens. Chunks break on page markers where possible and
+    otherwise between transactions, so every line lands in exactly one
+    chunk. Each chunk is a dict with its text, the [start_line, end_line)
+    range it covers in the original text, the page numbers it spans and the
+    max_tokens to request for it.
+    """
+    builder = ChunkBuilder(max_input_tokens, max_transactions)
+    chunks = builder.feed(text) + builder.finish()
+
+    logger.info(f"Split {len(builder.lines)} lines into {len(chunks)} chunks "
+                f"(budget {max_input_tokens} input tokens, {max_transactions} transaction lines)")
+    return chunks
+
+class ChunkBuilder:
+    """
+    Incremental split_text_into_chunks for text that arrives piece by piece
+    (e.g. page by page while a PDF is still being parsed)
+
+    feed() returns the chunks completed by the new text; finish() returns
+    the rest. A page is packed once the next page marker arrives, so
+    chunks are emitted as early as possible and are the same as
+    split_text_into_chunks produces for the whole text.
+    """
+
+    def __init__(self, max_input_tokens: int = CHUNK_INPUT_TOKEN_BUDGET,
+                 max_transactions: int = MAX_TRANSACTIONS_PER_CHUNK):
+        self.max_input_tokens = max_input_tokens
+        self.max_transactions = max_transactions
+        self.lines: List[str] = []
+        self.partial_line = ""  # Text after the last newline fed so far
+        self.page_start = 0  # First line of the page not packed yet
+        self.current: List[Tuple[int, int]] = []  # Line ranges (start, end) packed into the chunk being built
+        self.current_tokens = 0
+        self.current_transactions = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        pieces = (self.partial_line + text).split('\n')
+        self.partial_line = pieces.pop()
+
+        chunks = []
+        for line in pieces:
+            if PAGE_MARKER_PATTERN.match(line.strip()) and len(self.lines) > self.page_start:
+                chunks.extend(self._add_page(self.page_start, len(self.lines)))
+                self.page_start = len(self.lines)
+            self.lines.append(line)
+        return chunks
+
+    def finish(self) -> List[Dict[str, Any]]:
+        line = self.partial_line
+        self.partial_line = ""
+        chunks = self.feed(line + '\n')
+        # The newline fed above only completed the last line
+        self.partial_line = ""
+        chunks.extend(self._add_page(self.page_start, len(self.lines)))
+        self.page_start = len(self.lines)
+        chunks.extend(self._flush())
+        return chunks
+
+    def _fits(self, tokens: int, transactions: int) -> bool:
+        return (self.current_tokens + tokens <= self.max_input_tokens and
+                self.current_transactions + transactions <= self.max_transactions)
+
+    def _flush(self) -> List[Dict[str, Any]]:
+        chunks = []
+        if self.current:
+            chunks.append(_make_chunk(self.lines, self.current[0][0], self.current[-1][1]))
+        self.current = []
+        self.current_tokens = 0
+        self.current_transactions = 0
+        return chunks
+
+    def _add(self, start: int, end: int, tokens: int, transactions: int) -> None:
+        self.current.append((start, end))
+        self.current_tokens += tokens
+        self.current_transactions += transactions
+
+    def _add_page(self, page_start: int, page_end: int) -> List[Dict[str, Any]]:
+        if page_end <= page_start:
+            return []
+        lines = self.lines
+        page_tokens, page_transactions = _range_cost(lines, page_start, page_end)
+
+        # Whole pages are packed together while they fit
+        if self._fits(page_tokens, page_transactions):
+            self._add(page_start, page_end, page_tokens, page_transactions)
+            return []
+
+        if page_tokens <= self.max_input_tokens and page_transactions <= self.max_transactions:
+            chunks = self._flush()
+            self._add(page_start, page_end, page_tokens, page_transactions)
+            return chunks
+
+        # Oversized page: pack its transactions, splitting only between them
+        chunks = []
+        for unit_start, unit_end in _transaction_ranges(lines, page_start, page_end, self.max_input_tokens):
+            unit_tokens, unit_transactions = _range_cost(lines, unit_start, unit_end)
+            if self.current and not self._fits(unit_tokens, unit_transactions):
+                chunks.extend(self._flush())
+            self._add(unit_start, unit_end, unit_tokens, unit_transactions)
+        return chunks
+
+def _make_chunk(lines: List[str], start: int, end: int) -> Dict[str, Any]:
+    pages = []
+    for line in lines[start:end]:
+        match = PAGE_MARKER_PATTERN.match(line.strip())
+        if match:
+            pages.append(int(match.group(1)))
+
+    chunk_text = '\n'.join(lines[start:end])
+    return {
+        "text": chunk_text,
+        "start_line": start,
+        "end_line": end,
+        "pages": pages,
+        "max_tokens": estimate_max_tokens(chunk_text)
+    }
+
+def _range_cost(lines: List[str], start: int, end: int) -> Tuple[int, int]:
+    """Estimated input tokens and candidate transaction lines in [start, end)"""
+    # Characters include the newline that joins each line
+    chars = sum(len(line) + 1 for line in lines[start:end])
+    transactions = sum(1 for line in lines[start:end] if AMOUNT_PATTERN.search(line))
+    return int(chars / CHARS_PER_TOKEN) + 1, transactions
+
+def _transaction_ranges(lines: List[str], start: int, end: int, max_input_tokens: int) -> List[Tuple[int, int]]:
+    """
+    Line ranges for each transaction within [start, end); a range that is
+    still too large on its own is split line by line
+    """
+    starts = [i for i in range(start, end) if TRANSACTION_START_PATTERN.match(lines[i])]
+    if not starts or starts[0] != start:
+        starts.insert(0, start)
+
+    ranges = []
+    for unit_start, unit_end in zip(starts, starts[1:] + [end]):
+        if _range_cost(lines, unit_start, unit_end)[0] <= max_input_tokens:
+            ranges.append((unit_start, unit_end))
+        else:
+            ranges.extend((i, i + 1) for i in range(unit_start, unit_end))
+    return ranges
+
+def bisect_text(text: str) -> Optional[Tuple[str, str]]:
+    """
+    Split text into two halves of about equal length at a line boundary,
+    preferring the transaction start nearest the middle so multi-line
+    transactions stay whole. Returns None for text that is a single line.
+    """
+    lines = text.split('\n')
+    if len(lines) < 2:
+        return None
+
+    # Offset of the start of every line, to measure how close a split is to the middle
+    offsets = [0]
+    for line in lines[:-1]:
+        offsets.append(offsets[-1] + len(line) + 1)
+    middle = len(text) / 2
+
+    # Only transaction starts in the middle half count, so the halves stay balanced
+    candidates = [
+        i for i in range(1, len(lines))
+        if TRANSACTION_START_PATTERN.match(lines[i]) and abs(offsets[i] - middle) <= len(text) / 4
+    ]
+    if not candidates:
+        candidates = range(1, len(lines))
+    split = min(candidates, key=lambda i: abs(offsets[i] - middle))
+
+    return '\n'.join(lines[:split]), '\n'.join(lines[split:])
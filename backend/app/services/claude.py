@@ -1,4 +1,6 @@
 import httpx, os
+import asyncio
+import contextvars
 import json
 import re
 from dotenv import load_dotenv
@@ -6,6 +8,14 @@ import logging
 from datetime import datetime
 import time
 import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+from app.services.extraction_cache import get_chunk_cache, ExtractionCache
+from app.services.json_stream import TransactionStreamParser
+from app.services.chunker import split_text_into_chunks, bisect_text, estimate_max_tokens, CHUNK_INPUT_TOKEN_BUDGET, CHARS_PER_TOKEN, OUTPUT_FORMAT
+from app.services.compact_format import parse_compact_rows, CompactRowStreamParser
+from app.services.rate_limiter import get_rate_limiter, request_costs, retry_after_seconds, RATE_LIMIT_MAX_WAIT_SECONDS
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -13,26 +23,197 @@ logger = logging.getLogger(__name__)
 # Claude 3.5 Sonnet pricing (as of 2024)
 CLAUDE_INPUT_COST_PER_TOKEN = 0.000003  # $3 per million input tokens
 CLAUDE_OUTPUT_COST_PER_TOKEN = 0.000015  # $15 per million output tokens
+CLAUDE_CACHE_WRITE_COST_PER_TOKEN = 0.00000375  # $3.75 per million tokens written to the prompt cache
+CLAUDE_CACHE_READ_COST_PER_TOKEN = 0.0000003  # $0.30 per million tokens read from the prompt cache
+CLAUDE_BATCH_PRICE_MULTIPLIER = 0.5  # Message Batches API requests are billed at 50% of standard prices
 
-# Retry configuration
+# Model and prompt identity (part of the extraction cache key; bump the
+# prompt version whenever the extraction prompt changes)
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+EXTRACTION_PROMPT_VERSION = f"4-{OUTPUT_FORMAT}"
+
+# Retry configuration (for timeouts and connection errors; 429/529 responses
+# are retried until CLAUDE_RATE_LIMIT_MAX_WAIT_SECONDS of waiting is used up)
 MAX_RETRIES = 3
 BASE_DELAY = 1  # Base delay in seconds
 MAX_DELAY = 10  # Maximum delay in seconds
 
-def calculate_api_cost(input_tokens, output_tokens):
+# Shared async HTTP client configuration
+HTTP_MAX_CONNECTIONS = int(os.getenv("CLAUDE_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CLAUDE_HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("CLAUDE_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("CLAUDE_HTTP2", "true").lower() == "true"
+
+# Overridable so the client can run against a local mock of the API
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+ANTHROPIC_MESSAGES_URL = f"{ANTHROPIC_BASE_URL}/v1/messages"
+
+# Process-wide async client, created lazily on first use
+_async_client = None
+
+# Circuit breaker configuration
+BREAKER_ENABLED = os.getenv("CLAUDE_BREAKER_ENABLED", "true").lower() == "true"
+BREAKER_WINDOW_SECONDS = float(os.getenv("CLAUDE_BREAKER_WINDOW_SECONDS", "60"))  # Outcomes considered when deciding to open
+BREAKER_MIN_CALLS = int(os.getenv("CLAUDE_BREAKER_MIN_CALLS", "5"))  # Calls needed in the window before rates count
+BREAKER_ERROR_RATE = float(os.getenv("CLAUDE_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("CLAUDE_BREAKER_SLOW_CALL_SECONDS", "60"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("CLAUDE_BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("CLAUDE_BREAKER_OPEN_SECONDS", "30"))  # Fast-fail period before probing
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("CLAUDE_BREAKER_HALF_OPEN_PROBES", "1"))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"Claude API circuit breaker is open; retry in {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
     """
-    Calculate the cost of API usage based on token counts
+    Circuit breaker for Messages API calls
+    
+    closed: calls go through; outcomes are recorded over a sliding time
+    window, and the breaker opens when the error rate (overloads, 5xx,
+    timeouts, connection resets and other transport errors) or the slow-call rate crosses its threshold.
+    open: calls fail immediately with CircuitOpenError for open_seconds.
+    half_open: up to half_open_probes calls are let through as probes; a
+    successful probe closes the breaker, a failed one opens it again.
     """
-    input_cost = input_tokens * CLAUDE_INPUT_COST_PER_TOKEN
-    output_cost = output_tokens * CLAUDE_OUTPUT_COST_PER_TOKEN
-    total_cost = input_cost + output_cost
+    
+    def __init__(self, window_seconds=BREAKER_WINDOW_SECONDS, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate=BREAKER_SLOW_CALL_RATE, open_seconds=BREAKER_OPEN_SECONDS,
+                 half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        
+        self.state = "closed"
+        self.opened_at = None
+        self.probes_in_flight = 0
+        self.outcomes = deque()  # (timestamp, failed, slow)
+        self.times_opened = 0
+        self.lock = threading.Lock()  # One breaker is shared by every extraction in the process
+    
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError; returns True if the call is a half-open probe"""
+        with self.lock:
+            if self.state == "open":
+                remaining = self.opened_at + self.open_seconds - time.time()
+                if remaining > 0:
+                    raise CircuitOpenError(remaining)
+                self.state = "half_open"
+                self.probes_in_flight = 0
+                logger.info("Claude circuit breaker half-open, probing the API")
+            
+            if self.state == "half_open":
+                if self.probes_in_flight >= self.half_open_probes:
+                    raise CircuitOpenError(self.open_seconds)
+                self.probes_in_flight += 1
+                return True
+            return False
+    
+    def record(self, failed, latency, probe=False):
+        """Record the outcome of an admitted call"""
+        now = time.time()
+        with self.lock:
+            if probe:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            
+            if self.state == "half_open":
+                if failed:
+                    self._open(now, "probe failed")
+                elif probe:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                    logger.info("Claude circuit breaker closed, API recovered")
+                return
+            
+            self.outcomes.append((now, failed, latency >= self.slow_call_seconds))
+            while self.outcomes and self.outcomes[0][0] < now - self.window_seconds:
+                self.outcomes.popleft()
+            
+            if self.state == "closed" and len(self.outcomes) >= self.min_calls:
+                failures = sum(1 for _, f, _ in self.outcomes if f)
+                slow = sum(1 for _, _, s in self.outcomes if s)
+                if failures / len(self.outcomes) >= self.error_rate:
+                    self._open(now, f"{failures}/{len(self.outcomes)} calls failed")
+                elif slow / len(self.outcomes) >= self.slow_call_rate:
+                    self._open(now, f"{slow}/{len(self.outcomes)} calls slower than {self.slow_call_seconds:.0f}s")
+    
+    def release(self, probe):
+        """Forget an admitted call that ended without a verdict (e.g. a 429)"""
+        if probe:
+            with self.lock:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+    
+    def _open(self, now, reason):
+        self.state = "open"
+        self.opened_at = now
+        self.outcomes.clear()
+        self.times_opened += 1
+        logger.warning(f"Claude circuit breaker opened ({reason}); failing fast for {self.open_seconds:.0f}s")
+    
+    def snapshot(self):
+        """Breaker state for the health endpoint"""
+        with self.lock:
+            now = time.time()
+            recent = [o for o in self.outcomes if o[0] >= now - self.window_seconds]
+            return {
+                "state": self.state,
+                "retry_in_seconds": round(max(0, self.opened_at + self.open_seconds - now), 1) if self.state == "open" else 0,
+                "recent_calls": len(recent),
+                "recent_failures": sum(1 for _, f, _ in recent if f),
+                "recent_slow_calls": sum(1 for _, _, s in recent if s),
+                "times_opened": self.times_opened
+            }
+
+_circuit_breaker = CircuitBreaker() if BREAKER_ENABLED else None
+
+def get_circuit_breaker():
+    """Return the process-wide circuit breaker, or None when it is disabled"""
+    return _circuit_breaker
+
+def is_service_failure(status_code):
+    # Overloads and server errors count against the breaker; client errors and 429s don't
+    return status_code == 529 or status_code >= 500
+
+def service_overloaded_error(detail, retry_after=60):
+    return {
+        "error": f"Claude AI service is temporarily overloaded. Please try again in a few minutes. (Error: {detail})",
+        "error_type": "service_overloaded",
+        "retry_after": retry_after
+    }
+
+def calculate_api_cost(input_tokens, output_tokens, cache_creation_input_tokens=0, cache_read_input_tokens=0, batch=False):
+    """
+    Calculate the cost of API usage based on token counts.
+    input_tokens excludes prompt-cache tokens, which the API reports
+    separately and bills at their own rates. batch=True applies Message
+    Batches API pricing.
+    """
+    multiplier = CLAUDE_BATCH_PRICE_MULTIPLIER if batch else 1
+    input_cost = input_tokens * CLAUDE_INPUT_COST_PER_TOKEN * multiplier
+    cache_write_cost = cache_creation_input_tokens * CLAUDE_CACHE_WRITE_COST_PER_TOKEN * multiplier
+    cache_read_cost = cache_read_input_tokens * CLAUDE_CACHE_READ_COST_PER_TOKEN * multiplier
+    output_cost = output_tokens * CLAUDE_OUTPUT_COST_PER_TOKEN * multiplier
+    total_cost = input_cost + cache_write_cost + cache_read_cost + output_cost
     
     return {
         "input_tokens": input_tokens,
         "output_tokens": output_tokens,
+        "cache_creation_input_tokens": cache_creation_input_tokens,
+        "cache_read_input_tokens": cache_read_input_tokens,
         "input_cost_usd": round(input_cost, 6),
+        "cache_write_cost_usd": round(cache_write_cost, 6),
+        "cache_read_cost_usd": round(cache_read_cost, 6),
         "output_cost_usd": round(output_cost, 6),
         "total_cost_usd": round(total_cost, 6),
+        "pricing": "batch" if batch else "standard",
         "timestamp": datetime.utcnow().isoformat()
     }
 
@@ -68,87 +249,188 @@ def preprocess_bank_statement_text(text):
     
     return '\n'.join(processed_lines)
 
-def make_api_request_with_retry(headers, data, timeout):
+async def acquire_or_release(limiter, costs, breaker, probe):
+    """Wait for rate limit budget; a call cancelled while queued gives its half-open probe slot back"""
+    try:
+        await limiter.acquire(costs)
+    except BaseException:
+        if breaker:
+            breaker.release(probe)
+        raise
+
+def end_failed_attempt(breaker, probe, limiter, costs, error, latency):
     """
-    Make API request with exponential backoff retry logic
+    Close out an API call that raised instead of returning a response:
+    transport errors (timeouts, connection resets, protocol errors) count
+    as breaker failures, anything else (e.g. cancellation) only releases a
+    half-open probe; the rate limiter gets its token reservation back
     """
-    for attempt in range(MAX_RETRIES):
+    if breaker:
+        if isinstance(error, httpx.TransportError):
+            breaker.record(True, latency, probe)
+        else:
+            breaker.release(probe)
+    settle_rate_limit(limiter, costs, {})
+
+def record_breaker_outcome(breaker, probe, status_code, latency):
+    """Report a completed API call to the circuit breaker (if enabled)"""
+    if not breaker:
+        return
+    if status_code == 429:
+        breaker.release(probe)
+    else:
+        breaker.record(is_service_failure(status_code), latency, probe)
+
+def estimate_request_tokens(data):
+    """
+    Rough (input, output) token counts of a Messages API request, used to
+    reserve rate limiter budget before the call
+    """
+    prompt = json.dumps(data.get("system", "")) + json.dumps(data.get("messages", []))
+    return int(len(prompt) / CHARS_PER_TOKEN), data.get("max_tokens", 0)
+
+def response_usage(response):
+    try:
+        return response.json().get("usage", {})
+    except Exception:
+        return {}
+
+def settle_rate_limit(limiter, costs, usage):
+    """
+    Correct a rate limiter reservation with the tokens a call really used
+    (an empty usage returns the whole token reservation, e.g. after a 429)
+    """
+    if not limiter:
+        return
+    actual_input = sum(usage.get(key) or 0 for key in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"))
+    try:
+        limiter.adjust({
+            "input_tokens": costs["input_tokens"] - actual_input,
+            "output_tokens": costs["output_tokens"] - usage.get("output_tokens", 0)
+        })
+    except Exception as e:
+        logger.warning(f"Rate limiter update failed: {str(e)}")
+
+def throttle_delay(hint, throttled):
+    """
+    Wait before retrying a 429/529: the server's retry-after hint when
+    given, otherwise exponential backoff with jitter
+    """
+    if hint is not None:
+        return hint + random.uniform(0, 0.5)
+    return min(BASE_DELAY * (2 ** throttled) + random.uniform(0, 1), MAX_DELAY)
+
+def get_async_client():
+    """
+    Return the process-wide async HTTP client, creating it on first use.
+    The client keeps connections alive (and multiplexes them over HTTP/2)
+    so concurrent extractions don't pay a TLS handshake per request.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        _async_client = httpx.AsyncClient(limits=limits, http2=HTTP2_ENABLED)
+        logger.info(f"Created shared async HTTP client (max_connections={HTTP_MAX_CONNECTIONS}, http2={HTTP2_ENABLED})")
+    return _async_client
+
+async def close_async_client():
+    """
+    Close the process-wide async HTTP client (called on application shutdown)
+    """
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+        logger.info("Closed shared async HTTP client")
+
+async def make_api_request_with_retry_async(headers, data, timeout, url=None):
+    """
+    Make an API request with the shared client and exponential backoff retry
+    logic. Calls wait for the shared rate limiter first; rate limit (429)
+    and overload (529) responses are retried, honoring retry-after, until
+    CLAUDE_RATE_LIMIT_MAX_WAIT_SECONDS of waiting is used up. Raises
+    CircuitOpenError without calling the API while the breaker is open.
+    Waits (for the rate limiter and between retries) with asyncio.sleep so
+    the event loop stays free. Posts to the Messages endpoint unless
+    another url is given; other endpoints bypass the rate limiter and the
+    circuit breaker.
+    """
+    client = get_async_client()
+    limiter = get_rate_limiter() if url is None else None
+    breaker = get_circuit_breaker() if url is None else None
+    costs = request_costs(*estimate_request_tokens(data))
+    failures = 0
+    throttled = 0
+    throttled_wait = 0.0
+    
+    while True:
+        # The breaker is asked first so fast-fails neither queue for nor hold rate limit budget
+        probe = breaker.before_call() if breaker else False
+        if limiter:
+            await acquire_or_release(limiter, costs, breaker, probe)
+        started = time.time()
         try:
-            logger.info(f"API request attempt {attempt + 1}/{MAX_RETRIES}")
+            logger.info(f"API request attempt {failures + throttled + 1}")
             
-            with httpx.Client(timeout=timeout) as client:
-                response = client.post("https://api.anthropic.com/v1/messages", headers=headers, json=data)
-            
-            # Check if the request was successful
-            if response.status_code == 200:
-                logger.info(f"API request successful on attempt {attempt + 1}")
-                return response
-            elif response.status_code == 529:  # Overloaded
-                if attempt < MAX_RETRIES - 1:  # Don't retry on last attempt
-                    delay = min(BASE_DELAY * (2 ** attempt) + random.uniform(0, 1), MAX_DELAY)
-                    logger.warning(f"API overloaded (529), retrying in {delay:.2f} seconds...")
-                    time.sleep(delay)
-                    continue
-                else:
-                    logger.error(f"API still overloaded after {MAX_RETRIES} attempts")
-                    return response
-            elif response.status_code == 429:  # Rate limited
-                if attempt < MAX_RETRIES - 1:
-                    delay = min(BASE_DELAY * (2 ** attempt) + random.uniform(0, 1), MAX_DELAY)
-                    logger.warning(f"Rate limited (429), retrying in {delay:.2f} seconds...")
-                    time.sleep(delay)
-                    continue
-                else:
-                    logger.error(f"Rate limited after {MAX_RETRIES} attempts")
-                    return response
-            else:
-                # For other status codes, don't retry
-                logger.error(f"API request failed with status {response.status_code}")
-                return response
-                
-        except httpx.TimeoutException as e:
-            if attempt < MAX_RETRIES - 1:
-                delay = min(BASE_DELAY * (2 ** attempt), MAX_DELAY)
-                logger.warning(f"Request timeout on attempt {attempt + 1}, retrying in {delay:.2f} seconds...")
-                time.sleep(delay)
+            request = client.build_request("POST", url or ANTHROPIC_MESSAGES_URL, headers=headers, json=data, timeout=timeout)
+            response = await client.send(request, stream=True)
+            # Latency to the response headers, as for streams; reading a large body takes longer without being slow
+            latency = time.time() - started
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+        except BaseException as e:
+            # Every admitted call (even a cancelled one) ends with exactly one breaker verdict or release
+            end_failed_attempt(breaker, probe, limiter, costs, e, time.time() - started)
+            if not isinstance(e, Exception):
+                raise
+            failures += 1
+            if failures < MAX_RETRIES and isinstance(e, httpx.TransportError):
+                delay = min(BASE_DELAY * (2 ** (failures - 1)), MAX_DELAY)
+                logger.warning(f"{type(e).__name__} on attempt {failures}, retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
                 continue
-            else:
-                logger.error(f"Request timed out after {MAX_RETRIES} attempts")
-                raise e
-        except httpx.ConnectError as e:
-            if attempt < MAX_RETRIES - 1:
-                delay = min(BASE_DELAY * (2 ** attempt), MAX_DELAY)
-                logger.warning(f"Connection error on attempt {attempt + 1}, retrying in {delay:.2f} seconds...")
-                time.sleep(delay)
+            if failures < MAX_RETRIES:
+                logger.error(f"Unexpected error on attempt {failures}: {str(e)}")
                 continue
+            logger.error(f"Request failed after {MAX_RETRIES} attempts: {type(e).__name__}")
+            raise e
+        record_breaker_outcome(breaker, probe, response.status_code, latency)
+        
+        if response.status_code == 200:
+            logger.info(f"API request successful on attempt {failures + throttled + 1}")
+            if limiter:
+                await asyncio.to_thread(settle_rate_limit, limiter, costs, response_usage(response))
+            return response
+        
+        if limiter:
+            await asyncio.to_thread(settle_rate_limit, limiter, costs, {})
+        if response.status_code in (429, 529):  # Rate limited / Overloaded
+            hint = retry_after_seconds(response.headers)
+            delay = throttle_delay(hint, throttled)
+            if throttled_wait + delay > RATE_LIMIT_MAX_WAIT_SECONDS:
+                logger.error(f"API returned {response.status_code} after waiting {throttled_wait:.0f} seconds")
+                return response
+            throttled += 1
+            throttled_wait += delay
+            logger.warning(f"API returned {response.status_code}, retrying in {delay:.2f} seconds...")
+            if limiter and hint is not None:
+                # Hold back every caller, not just this one, until the hint has passed
+                await asyncio.to_thread(limiter.pause, delay)
             else:
-                logger.error(f"Connection failed after {MAX_RETRIES} attempts")
-                raise e
-        except Exception as e:
-            logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                raise e
-            
-    return None  # Should never reach here
+                await asyncio.sleep(delay)
+            continue
+        
+        logger.error(f"API request failed with status {response.status_code}")
+        return response
 
-def extract_transactions(text):
-    headers = {
-        "x-api-key": os.getenv("ANTHROPIC_API_KEY"),
-        "anthropic-version": "2023-06-01",
-        "Content-Type": "application/json"
-    }
-    
-    # Increase text limit and improve preprocessing
-    max_text_length = 30000  # Increased from 25000
-    processed_text = preprocess_bank_statement_text(text[:max_text_length])
-    
-    data = {
-        "model": "claude-3-5-sonnet-20241022",  # Using more powerful model
-        "max_tokens": 4000,  # Increased token limit
-        "temperature": 0,
-        "messages": [{
-            "role": "user",
-            "content": f"""You are an expert financial data analyst specializing in bank statement analysis. Your task is to extract ALL transactions from the provided bank statement text with maximum accuracy and completeness.
+# Fixed extraction instructions, sent as a cached system prompt prefix
+EXTRACTION_RULES = """You are an expert financial data analyst specializing in bank statement analysis. Your task is to extract ALL transactions from the provided bank statement text with maximum accuracy and completeness.
 
 CRITICAL ANALYSIS REQUIREMENTS:
 1. COMPREHENSIVE EXTRACTION: Find every single transaction - credits, debits, transfers, fees, charges, and automated payments
@@ -165,35 +447,61 @@ ENHANCED EXTRACTION RULES:
 - Preserve original transaction descriptions without modification
 - Handle multi-line transaction descriptions by combining them
 - Extract reference numbers when available
+"""
 
-STRICT JSON OUTPUT FORMAT:
-{{
-  "account_details": {{
+STATEMENT_READING_GUIDE = """READING STATEMENT LAYOUTS:
+- Statements are converted from PDF, so columns arrive as space-separated text. A row usually reads: date, description, then one or two amounts, then the running balance.
+- When a row has separate Debit and Credit columns, only one of them is filled. Decide which from the column headings, or from the running balance: a balance that goes up means income, a balance that goes down means an expense.
+- Amounts marked "DR", "Dr", shown with a leading minus sign or in parentheses are debits (expenses); amounts marked "CR" or "Cr" are credits (income). Always report the amount itself as a positive number.
+- The last number on a row is normally the running balance, not the transaction amount. Never report a running balance as a transaction.
+- Description lines without a date or amount directly below a row continue that row's description; append them with a single space.
+- Lines such as "Balance Brought Forward", "Opening Balance", "Balance Carried Forward", "Closing Balance", "Total Debits", "Total Credits" and page subtotals are not transactions. Use the closing balance (or the last running balance) as final_balance.
+- Page headers, column headings, footers ("Page 2 of 5", "This is a computer generated statement"), bank addresses and legal notices repeat on every page and are never transactions.
+- Reversals and refunds ("REV", "REVERSAL", "REFUND") are income when they are credited back; fee reversals likewise. Fees, taxes, stamp duty, SMS alert charges and service charges are expenses even when the amount is small.
+- Transfers between the holder's own accounts are still transactions: "TRANSFER FROM" or "CEFT IN" is income, "TRANSFER TO" or "CEFT OUT" is an expense.
+- Cheque deposits and returned cheques: a deposit is income; a returned (dishonoured) cheque debit is an expense.
+- Foreign currency purchases may show the original amount and the converted amount; report the amount in the account currency.
+
+DATES:
+- Convert every date to DDMMMYYYY with a three-letter upper-case month, e.g. 03/07/2024 becomes 03JUL2024 and 3 Jul 24 becomes 03JUL2024.
+- Dates are day-first unless the statement clearly uses month-first dates (for example a day value above 12 in the second position).
+- When a row omits the year, take it from the statement period; a period spanning December and January puts December rows in the earlier year.
+- When a row shows both a transaction date and a value date, use the transaction date.
+
+ACCOUNT DETAILS:
+- The holder name, account number, currency and statement period usually appear on the first page only. Copy the account number exactly as printed, including any masking characters.
+- If the currency is not stated, infer it from amount prefixes such as "Rs.", "LKR", "$" or "USD"; use "Unknown" when there is no indication.
+- When text contains only part of a statement, report the account details that are visible and leave the others as empty strings.
+"""
+
+JSON_OUTPUT_INSTRUCTIONS = """STRICT JSON OUTPUT FORMAT:
+{
+  "account_details": {
     "name": "Complete account holder name",
     "account_number": "Full account number",
     "currency": "Primary currency (e.g., LKR, USD, EUR)",
     "statement_date": "Complete statement period"
-  }},
+  },
   "final_balance": 0.00,
-  "transactions": {{
+  "transactions": {
     "income": [
-      {{
+      {
         "date": "DDMMMYYYY format (e.g., 15JUN2024)",
         "description": "Complete transaction description",
         "amount": 0.00,
         "reference": "Transaction reference if available"
-      }}
+      }
     ],
     "expenses": [
-      {{
+      {
         "date": "DDMMMYYYY format (e.g., 15JUN2024)", 
         "description": "Complete transaction description",
         "amount": 0.00,
         "reference": "Transaction reference if available"
-      }}
+      }
     ]
-  }}
-}}
+  }
+}
 
 QUALITY ASSURANCE:
 - Verify all amounts are positive numbers
@@ -201,47 +509,354 @@ QUALITY ASSURANCE:
 - Check that income and expense classifications are accurate
 - Confirm no transactions are missed or duplicated
 
-Bank Statement Content:
+EXAMPLE:
+Statement text:
+SAMPLE BANK PLC Account No: 0012345678 Currency: LKR
+Statement Period: 01/06/2024 - 30/06/2024
+Date Description Debit Credit Balance
+01/06/2024 Balance Brought Forward 25000.00
+03/06/2024 ATM WDL COLOMBO 07 5000.00 20000.00
+05/06/2024 SALARY ACME LTD 85000.00 105000.00
+MONTHLY SALARY JUNE
+12/06/2024 CEFT OUT J PERERA REF 88213 12500.00 92500.00
+Page 1 of 1
+
+Output:
+{"account_details": {"name": "", "account_number": "0012345678", "currency": "LKR", "statement_date": "01/06/2024 - 30/06/2024"}, "final_balance": 92500.00, "transactions": {"income": [{"date": "05JUN2024", "description": "SALARY ACME LTD MONTHLY SALARY JUNE", "amount": 85000.00, "reference": ""}], "expenses": [{"date": "03JUN2024", "description": "ATM WDL COLOMBO 07", "amount": 5000.00, "reference": ""}, {"date": "12JUN2024", "description": "CEFT OUT J PERERA", "amount": 12500.00, "reference": "88213"}]}}
+"""
+
+COMPACT_OUTPUT_INSTRUCTIONS = """STRICT ROW OUTPUT FORMAT (one record per line, fields separated by |, no header row):
+ACCOUNT|account holder name|account number|currency|statement period
+BALANCE|final balance
+I|date|description|amount|reference
+E|date|description|amount|reference
+
+- Use I for income (credits/deposits) and E for expenses (debits/withdrawals)
+- Dates in DDMMMYYYY format (e.g., 15JUN2024); no currency symbols or thousands separators in amounts
+- Transaction amounts are always positive; BALANCE keeps its sign (negative when the account is overdrawn)
+- Leave reference empty when unavailable; replace any | inside descriptions with /
+- Output ACCOUNT and BALANCE once, then one line per transaction
+- Confirm no transactions are missed or duplicated
+
+EXAMPLE:
+Statement text:
+SAMPLE BANK PLC Account No: 0012345678 Currency: LKR
+Statement Period: 01/06/2024 - 30/06/2024
+Date Description Debit Credit Balance
+01/06/2024 Balance Brought Forward 25000.00
+03/06/2024 ATM WDL COLOMBO 07 5000.00 20000.00
+05/06/2024 SALARY ACME LTD 85000.00 105000.00
+MONTHLY SALARY JUNE
+12/06/2024 CEFT OUT J PERERA REF 88213 12500.00 92500.00
+Page 1 of 1
+
+Output:
+ACCOUNT||0012345678|LKR|01/06/2024 - 30/06/2024
+BALANCE|92500.00
+I|05JUN2024|SALARY ACME LTD MONTHLY SALARY JUNE|85000.00|
+E|03JUN2024|ATM WDL COLOMBO 07|5000.00|
+E|12JUN2024|CEFT OUT J PERERA|12500.00|88213
+"""
+
+if OUTPUT_FORMAT == "rows":
+    EXTRACTION_SYSTEM_PROMPT = EXTRACTION_RULES + "\n" + STATEMENT_READING_GUIDE + "\n" + COMPACT_OUTPUT_INSTRUCTIONS
+    OUTPUT_REMINDER = "IMPORTANT: Return ONLY the rows. No additional text, explanations, or formatting."
+else:
+    EXTRACTION_SYSTEM_PROMPT = EXTRACTION_RULES + "\n" + STATEMENT_READING_GUIDE + "\n" + JSON_OUTPUT_INSTRUCTIONS
+    OUTPUT_REMINDER = "IMPORTANT: Return ONLY the JSON response. No additional text, explanations, or formatting."
+
+# Sonnet does not cache prompt prefixes shorter than 1024 tokens; such a
+# prefix is billed as normal input, so cache_control is only sent when the
+# instructions are long enough (estimated at a conservative 4 chars per token)
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_ENABLED = len(EXTRACTION_SYSTEM_PROMPT) / 4 >= PROMPT_CACHE_MIN_TOKENS
+if not PROMPT_CACHE_ENABLED:
+    logger.warning(f"Extraction system prompt is below the {PROMPT_CACHE_MIN_TOKENS}-token caching minimum; it will not be cached")
+
+def build_extraction_request(text, max_tokens=None):
+    """
+    Build the Messages API headers and payload for a piece of statement text.
+    When max_tokens isn't given it is sized from the estimated number of
+    transaction lines in the text.
+    """
+    headers = {
+        "x-api-key": os.getenv("ANTHROPIC_API_KEY"),
+        "anthropic-version": "2023-06-01",
+        "Content-Type": "application/json"
+    }
+    
+    # Safety limit well above the chunk input budget
+    max_text_length = int(CHUNK_INPUT_TOKEN_BUDGET * CHARS_PER_TOKEN * 1.25)
+    processed_text = preprocess_bank_statement_text(text[:max_text_length])
+    
+    if max_tokens is None:
+        max_tokens = estimate_max_tokens(processed_text)
+    
+    # Static instructions form a cacheable prefix shared by every chunk and upload
+    system_block = {"type": "text", "text": EXTRACTION_SYSTEM_PROMPT}
+    if PROMPT_CACHE_ENABLED:
+        system_block["cache_control"] = {"type": "ephemeral"}
+    
+    data = {
+        "model": CLAUDE_MODEL,
+        "max_tokens": max_tokens,
+        "temperature": 0,
+        "system": [system_block],
+        "messages": [{
+            "role": "user",
+            "content": f"""Bank Statement Content:
 {processed_text}
 
-IMPORTANT: Return ONLY the JSON response. No additional text, explanations, or formatting."""
+{OUTPUT_REMINDER}"""
         }]
     }
     
-    # Configure timeout
-    timeout = httpx.Timeout(connect=30.0, read=90.0, write=30.0, pool=30.0)
+    return headers, data, processed_text
+
+# Request timeout for extraction calls; streamed responses send events
+# throughout, so the read timeout only bounds the gaps between them
+EXTRACTION_TIMEOUT = httpx.Timeout(connect=30.0, read=90.0, write=30.0, pool=30.0)
+OUTPUT_TOKENS_PER_SECOND = 40  # Conservative generation speed for sizing buffered read timeouts
+
+def extraction_timeout(max_tokens):
+    """
+    Timeout for a buffered (non-streamed) call: its response only arrives
+    once all output is generated, so the read timeout grows with max_tokens
+    (about 235 seconds at 8192 tokens) instead of cutting off large responses
+    """
+    read = max(EXTRACTION_TIMEOUT.read, 30.0 + max_tokens / OUTPUT_TOKENS_PER_SECOND)
+    return httpx.Timeout(connect=30.0, read=read, write=30.0, pool=30.0)
+
+async def extract_transactions_async(text, max_tokens=None):
+    """
+    Extract transactions from one chunk of statement text with a buffered
+    (non-streamed) call; results are served from and stored in the chunk cache
+    """
+    headers, data, processed_text = build_extraction_request(text, max_tokens)
+    
+    cache = get_chunk_cache()
+    cache_key = ExtractionCache.make_key(processed_text, CLAUDE_MODEL, EXTRACTION_PROMPT_VERSION)
+    if cache:
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            return with_chunk_cache_stats(cached, hit=True)
     
     try:
-        logger.info(f"Making API request to Anthropic with processed text length: {len(processed_text)} characters")
+        logger.info(f"Making async API request to Anthropic with processed text length: {len(processed_text)} characters")
         
-        # Use retry mechanism
-        response = make_api_request_with_retry(headers, data, timeout)
+        timeout = extraction_timeout(data["max_tokens"])
+        response = await make_api_request_with_retry_async(headers, data, timeout)
         
-        if response is None:
-            return {"error": "Failed to get response from API after multiple retries"}
-        
-        logger.info(f"API response received with status: {response.status_code}")
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping API call: {e}")
+        return service_overloaded_error(str(e), round(e.retry_after))
+    except httpx.TimeoutException as e:
+        logger.error(f"API request timed out: {e}")
+        return {"error": f"API request timed out after {timeout.read:.0f} seconds: {str(e)}"}
+    except httpx.ConnectError as e:
+        logger.error(f"Failed to connect to API: {e}")
+        return {"error": f"Failed to connect to Anthropic API: {str(e)}"}
+    except Exception as e:
+        logger.error(f"Unexpected error during API call: {e}")
+        return {"error": f"Unexpected error: {str(e)}"}
+    
+    result = parse_extraction_response(response)
+    if cache and "error" not in result:
+        await asyncio.to_thread(cache.set, cache_key, strip_api_cost(result))
+    return with_chunk_cache_stats(result, hit=False)
+
+async def extract_transactions_stream(text, max_tokens=None):
+    """
+    Streaming version of extract_transactions_async, as an async generator.
+    
+    Yields {"type": "transaction", "kind": "income" | "expenses", "transaction": {...}}
+    as soon as each transaction object closes in Claude's streamed output,
+    then a final {"type": "result", "result": {...}} with the complete
+    extraction result (or error) exactly as extract_transactions_async returns it.
+    
+    Failed attempts are retried like make_api_request_with_retry_async does.
+    When an attempt fails after transactions were yielded, {"type": "restart"}
+    is yielded before the retry: the transactions so far are to be dropped.
+    """
+    headers, data, processed_text = build_extraction_request(text, max_tokens)
+    
+    cache = get_chunk_cache()
+    cache_key = ExtractionCache.make_key(processed_text, CLAUDE_MODEL, EXTRACTION_PROMPT_VERSION)
+    if cache:
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            for kind in ("income", "expenses"):
+                for transaction in cached.get("transactions", {}).get(kind, []):
+                    yield {"type": "transaction", "kind": kind, "transaction": transaction}
+            yield {"type": "result", "result": with_chunk_cache_stats(cached, hit=True)}
+            return
+    
+    data = dict(data, stream=True)
+    client = get_async_client()
+    
+    try:
+        logger.info(f"Making streaming API request to Anthropic with processed text length: {len(processed_text)} characters")
         
+        limiter = get_rate_limiter()
+        costs = request_costs(*estimate_request_tokens(data))
+        failures = 0
+        throttled = 0
+        throttled_wait = 0.0
+        breaker = get_circuit_breaker()
+        while True:
+            parser = CompactRowStreamParser() if OUTPUT_FORMAT == "rows" else TransactionStreamParser()
+            text_parts = []
+            usage = {}
+            stop_reason = None
+            error = None
+            
+            # The breaker is asked first so fast-fails neither queue for nor hold rate limit budget
+            probe = breaker.before_call() if breaker else False
+            if limiter:
+                await acquire_or_release(limiter, costs, breaker, probe)
+            started = time.time()
+            reserved = bool(limiter)  # Limiter budget still to be settled for this attempt
+            try:
+                logger.info(f"Streaming API request attempt {failures + throttled + 1}")
+                async with client.stream("POST", ANTHROPIC_MESSAGES_URL, headers=headers, json=data, timeout=EXTRACTION_TIMEOUT) as response:
+                    # Latency to the response headers; a stream's total duration reflects output size
+                    record_breaker_outcome(breaker, probe, response.status_code, time.time() - started)
+                    probe = None
+                    if response.status_code != 200:
+                        await response.aread()
+                        if reserved:
+                            reserved = False
+                            await asyncio.to_thread(settle_rate_limit, limiter, costs, {})
+                        # Overload and rate limits fail before any output, so they can be retried
+                        if response.status_code in (429, 529):
+                            hint = retry_after_seconds(response.headers)
+                            delay = throttle_delay(hint, throttled)
+                            if throttled_wait + delay <= RATE_LIMIT_MAX_WAIT_SECONDS:
+                                throttled += 1
+                                throttled_wait += delay
+                                logger.warning(f"API returned {response.status_code}, retrying stream in {delay:.2f} seconds...")
+                                if limiter and hint is not None:
+                                    await asyncio.to_thread(limiter.pause, delay)
+                                else:
+                                    await asyncio.sleep(delay)
+                                continue
+                        yield {"type": "result", "result": parse_extraction_response(response)}
+                        return
+                
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        event = json.loads(line[5:])
+                        event_type = event.get("type")
+                    
+                        if event_type == "message_start":
+                            usage.update(event.get("message", {}).get("usage", {}))
+                        elif event_type == "content_block_delta" and event.get("delta", {}).get("type") == "text_delta":
+                            fragment = event["delta"]["text"]
+                            text_parts.append(fragment)
+                            for kind, transaction in parser.feed(fragment):
+                                yield {"type": "transaction", "kind": kind, "transaction": transaction}
+                        elif event_type == "message_delta":
+                            usage.update(event.get("usage", {}))
+                            stop_reason = event.get("delta", {}).get("stop_reason") or stop_reason
+                        elif event_type == "error":
+                            api_error = event.get("error", {})
+                            yield {"type": "result", "result": {
+                                "error": f"AI service error during streaming: {api_error.get('message', 'Unknown error occurred')}",
+                                "error_type": api_error.get("type", "api_error")
+                            }}
+                            return
+            except BaseException as e:
+                # probe is None once the breaker has the response status
+                if probe is not None:
+                    end_failed_attempt(breaker, probe, None, costs, e, time.time() - started)
+                if not isinstance(e, Exception):
+                    raise
+                error = e
+            finally:
+                # Also runs when the stream fails or its consumer stops early
+                if reserved:
+                    reserved = False
+                    await asyncio.to_thread(settle_rate_limit, limiter, costs, usage)
+            
+            if error is None:
+                break
+            failures += 1
+            if failures >= MAX_RETRIES:
+                logger.error(f"Streaming request failed after {MAX_RETRIES} attempts: {type(error).__name__}")
+                raise error
+            if text_parts:
+                yield {"type": "restart"}
+            if isinstance(error, httpx.TransportError):
+                delay = min(BASE_DELAY * (2 ** (failures - 1)), MAX_DELAY)
+                logger.warning(f"{type(error).__name__} on streaming attempt {failures}, retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"Unexpected error on streaming attempt {failures}: {str(error)}")
+    
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping API call: {e}")
+        yield {"type": "result", "result": service_overloaded_error(str(e), round(e.retry_after))}
+        return
+    except httpx.TimeoutException as e:
+        logger.error(f"API request timed out: {e}")
+        yield {"type": "result", "result": {"error": f"API request timed out after {EXTRACTION_TIMEOUT.read:.0f} seconds between streamed events: {str(e)}"}}
+        return
+    except httpx.ConnectError as e:
+        logger.error(f"Failed to connect to API: {e}")
+        yield {"type": "result", "result": {"error": f"Failed to connect to Anthropic API: {str(e)}"}}
+        return
+    except Exception as e:
+        logger.error(f"Unexpected error during streaming API call: {e}")
+        yield {"type": "result", "result": {"error": f"Unexpected error: {str(e)}"}}
+        return
+    
+    for kind, transaction in parser.flush():
+        yield {"type": "transaction", "kind": kind, "transaction": transaction}
+    
+    cost_data = cost_from_usage(usage) if usage else None
+    if stop_reason == "max_tokens":
+        logger.warning("Streamed response hit max_tokens; output is incomplete")
+        yield {"type": "result", "result": output_truncated_error(cost_data)}
+        return
+    result = parse_extraction_text("".join(text_parts), cost_data)
+    if cache and "error" not in result:
+        await asyncio.to_thread(cache.set, cache_key, strip_api_cost(result))
+    yield {"type": "result", "result": with_chunk_cache_stats(result, hit=False)}
+
+def strip_api_cost(result):
+    """
+    Copy of an extraction result without its per-call cost block (cached chunks cost nothing)
+    """
+    return {key: value for key, value in result.items() if key not in ("api_cost", "chunk_cache")}
+
+def with_chunk_cache_stats(result, hit):
+    """
+    Attach per-request chunk cache hit/miss counts to a single-chunk result
+    """
+    if "error" not in result:
+        result["chunk_cache"] = {"hits": 1 if hit else 0, "misses": 0 if hit else 1}
+    return result
+
+def parse_extraction_response(response):
+    """
+    Turn a Messages API response into the extraction result dictionary
+    """
+    if response is None:
+        return {"error": "Failed to get response from API after multiple retries"}
+    
+    logger.info(f"API response received with status: {response.status_code}")
+    
+    try:
         # Extract usage data for cost calculation
         response_data = response.json()
         
         # Calculate API costs
         cost_data = None
         if "usage" in response_data:
-            usage = response_data["usage"]
-            input_tokens = usage.get("input_tokens", 0)
-            output_tokens = usage.get("output_tokens", 0)
-            cost_data = calculate_api_cost(input_tokens, output_tokens)
-            logger.info(f"API Usage - Input: {input_tokens} tokens, Output: {output_tokens} tokens, Cost: ${cost_data['total_cost_usd']}")
-        
-    except httpx.TimeoutException as e:
-        logger.error(f"API request timed out: {e}")
-        return {"error": f"API request timed out after 90 seconds: {str(e)}"}
-    except httpx.ConnectError as e:
-        logger.error(f"Failed to connect to API: {e}")
-        return {"error": f"Failed to connect to Anthropic API: {str(e)}"}
+            cost_data = cost_from_usage(response_data["usage"])
     except Exception as e:
-        logger.error(f"Unexpected error during API call: {e}")
+        logger.error(f"Unexpected error reading API response: {e}")
         return {"error": f"Unexpected error: {str(e)}"}
     
     # Check if request was successful
@@ -251,11 +866,7 @@ IMPORTANT: Return ONLY the JSON response. No additional text, explanations, or f
         error_message = error_data.get("error", {}).get("message", "Unknown error occurred")
         
         if response.status_code == 529:
-            return {
-                "error": f"Claude AI service is temporarily overloaded. Please try again in a few minutes. (Error: {error_message})",
-                "error_type": "service_overloaded",
-                "retry_after": 60  # Suggest retrying after 60 seconds
-            }
+            return service_overloaded_error(error_message)
         elif response.status_code == 429:
             return {
                 "error": f"Rate limit exceeded. Please wait a moment before trying again. (Error: {error_message})",
@@ -290,8 +901,55 @@ IMPORTANT: Return ONLY the JSON response. No additional text, explanations, or f
         return {"error": f"No text in API response content: {response_data['content'][0]}"}
     
     raw_text = response_data["content"][0]["text"]
+    if response_data.get("stop_reason") == "max_tokens":
+        logger.warning(f"Response hit max_tokens after {len(raw_text)} characters; output is incomplete")
+        return output_truncated_error(cost_data)
+    return parse_extraction_text(raw_text, cost_data)
+
+def output_truncated_error(cost_data=None):
+    """
+    Error result for a response cut off at max_tokens. Its partial JSON (or
+    rows) would silently lose transactions, so the chunk is re-extracted in
+    smaller pieces instead; the cost of the wasted call is kept.
+    """
+    error = {
+        "error": "AI output reached max_tokens before all transactions were extracted",
+        "error_type": "output_truncated"
+    }
+    if cost_data:
+        error["api_cost"] = cost_data
+    return error
+
+def is_output_truncated(result):
+    return isinstance(result, dict) and result.get("error_type") == "output_truncated"
+
+def cost_from_usage(usage, batch=False):
+    """
+    Cost breakdown for a Messages API usage block
+    """
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    cache_creation_tokens = usage.get("cache_creation_input_tokens") or 0
+    cache_read_tokens = usage.get("cache_read_input_tokens") or 0
+    cost_data = calculate_api_cost(input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens, batch)
+    logger.info(f"API Usage - Input: {input_tokens} tokens, Cache write: {cache_creation_tokens}, Cache read: {cache_read_tokens}, Output: {output_tokens} tokens, Cost: ${cost_data['total_cost_usd']}")
+    return cost_data
+
+def parse_extraction_text(raw_text, cost_data=None):
+    """
+    Parse Claude's text output into the extraction result dictionary
+    """
     logger.info(f"Raw response from Claude: {raw_text[:200]}...")
     
+    if OUTPUT_FORMAT == "rows":
+        parsed_rows = parse_compact_rows(raw_text)
+        if parsed_rows is not None:
+            logger.info("Successfully parsed compact row response")
+            if cost_data:
+                parsed_rows["api_cost"] = cost_data
+            return parsed_rows
+        logger.warning("Compact row parsing found no rows, trying JSON fallbacks")
+    
     # Try to extract JSON from the response
     try:
         # First, try to parse the response directly as JSON
@@ -346,87 +1004,413 @@ IMPORTANT: Return ONLY the JSON response. No additional text, explanations, or f
         logger.error(f"Unexpected error parsing JSON: {e}")
         return {"error": f"Unexpected error parsing response: {str(e)}"}
 
-def extract_transactions_chunked(text):
+# Chunking configuration for large statements
+CHUNK_CONCURRENCY = int(os.getenv("CLAUDE_CHUNK_CONCURRENCY", "4"))  # Max Claude calls in flight per statement (bisected halves included)
+BISECT_MAX_DEPTH = int(os.getenv("CLAUDE_BISECT_MAX_DEPTH", "4"))  # Times a truncated chunk may be halved (up to 16 pieces)
+
+# Semaphore shared by every statement extracted in the current context (e.g.
+# all files of a batch upload); unset means one semaphore per statement
+_shared_chunk_semaphore = contextvars.ContextVar("shared_chunk_semaphore", default=None)
+
+@contextmanager
+def shared_chunk_concurrency(limit):
     """
-    Handle very large bank statements by processing in chunks and combining results
+    Run all chunked extractions started inside the block (including tasks
+    created from it) through one scheduler with at most limit Claude calls in flight
     """
-    max_chunk_size = 25000
-    
-    if len(text) <= max_chunk_size:
-        return extract_transactions(text)
-    
-    logger.info(f"Text too large ({len(text)} chars), processing in chunks")
-    
-    # Split text into overlapping chunks to avoid missing transactions at boundaries
-    chunks = []
-    overlap = 2000  # Overlap to catch transactions split across chunks
-    
-    for i in range(0, len(text), max_chunk_size - overlap):
-        chunk = text[i:i + max_chunk_size]
-        chunks.append(chunk)
+    token = _shared_chunk_semaphore.set(asyncio.Semaphore(limit))
+    try:
+        yield
+    finally:
+        _shared_chunk_semaphore.reset(token)
+
+def largest_first(chunks):
+    """
+    Return chunk indexes ordered by size (largest first) so the slowest
+    calls start early and don't end up as the tail of the batch
+    """
+    return sorted(range(len(chunks)), key=lambda i: len(chunks[i]["text"]), reverse=True)
+
+def describe_chunk(chunk):
+    """
+    Short provenance description of a chunk for logging
+    """
+    pages = f", pages {chunk['pages'][0]}-{chunk['pages'][-1]}" if chunk["pages"] else ""
+    return f"lines {chunk['start_line']}-{chunk['end_line']}{pages}, {len(chunk['text'])} chars, max_tokens {chunk['max_tokens']}"
+
+def all_failed(results):
+    """
+    True when no chunk produced a result, so the first error (e.g.
+    service_overloaded) is reported instead of an empty extraction
+    """
+    return all(not isinstance(result, dict) or "error" in result for result in results)
+
+def merge_chunk_results(results):
+    """
+    Combine per-chunk extraction results (in chunk order) into a single result
     
+    Chunks that failed contribute no transactions; they are counted in
+    "failed_chunks" (with their errors in "chunk_errors") so callers can
+    tell the result is incomplete and avoid caching it.
+    """
     all_income = []
     all_expenses = []
     account_details = None
     final_balance = 0
-    total_cost = 0
-    total_input_tokens = 0
-    total_output_tokens = 0
+    cost_totals = {}
+    pricing = set()
+    chunk_cache = {"hits": 0, "misses": 0}
+    failed_chunks = 0
+    chunk_errors = []
     
-    for i, chunk in enumerate(chunks):
-        logger.info(f"Processing chunk {i+1}/{len(chunks)}")
-        result = extract_transactions(chunk)
+    for result in results:
+        if not isinstance(result, dict) or "error" in result:
+            failed_chunks += 1
+            chunk_errors.append(result.get("error") if isinstance(result, dict) else "No response")
+            continue
         
-        if isinstance(result, dict) and "error" not in result:
-            # Collect transactions from this chunk
-            if "transactions" in result:
-                if "income" in result["transactions"]:
-                    all_income.extend(result["transactions"]["income"])
-                if "expenses" in result["transactions"]:
-                    all_expenses.extend(result["transactions"]["expenses"])
-            
-            # Use account details from first successful chunk
-            if account_details is None and "account_details" in result:
-                account_details = result["account_details"]
-            
-            # Use the highest balance found (likely the final balance)
-            if "final_balance" in result and result["final_balance"] > final_balance:
-                final_balance = result["final_balance"]
-            
-            # Aggregate cost data
-            if "api_cost" in result:
-                cost = result["api_cost"]
-                total_cost += cost.get("total_cost_usd", 0)
-                total_input_tokens += cost.get("input_tokens", 0)
-                total_output_tokens += cost.get("output_tokens", 0)
+        # A bisected chunk's halves may have failed in turn
+        failed_chunks += result.get("failed_chunks", 0)
+        chunk_errors.extend(result.get("chunk_errors", []))
+        
+        # Collect transactions from this chunk
+        if "transactions" in result:
+            if "income" in result["transactions"]:
+                all_income.extend(result["transactions"]["income"])
+            if "expenses" in result["transactions"]:
+                all_expenses.extend(result["transactions"]["expenses"])
+        
+        # Use account details from first successful chunk
+        if account_details is None and "account_details" in result:
+            account_details = result["account_details"]
+        
+        # Use the highest balance found (likely the final balance)
+        if "final_balance" in result and result["final_balance"] > final_balance:
+            final_balance = result["final_balance"]
+        
+        # Aggregate cost data (token counts and USD amounts)
+        if "api_cost" in result:
+            for key, value in result["api_cost"].items():
+                if key.endswith("_tokens") or key.endswith("_usd"):
+                    cost_totals[key] = cost_totals.get(key, 0) + value
+            pricing.add(result["api_cost"].get("pricing", "standard"))
+        
+        if "chunk_cache" in result:
+            chunk_cache["hits"] += result["chunk_cache"].get("hits", 0)
+            chunk_cache["misses"] += result["chunk_cache"].get("misses", 0)
     
-    # Remove duplicates based on date and amount
-    all_income = remove_duplicate_transactions(all_income)
-    all_expenses = remove_duplicate_transactions(all_expenses)
+    # Chunks don't overlap, so every transaction appears exactly once and no
+    # de-duplication is needed (identical same-day transactions are kept)
     
     # Prepare final result with aggregated costs
-    result = {
+    merged = {
         "account_details": account_details or {},
         "final_balance": final_balance,
         "transactions": {
             "income": all_income,
             "expenses": all_expenses
-        }
+        },
+        "chunk_cache": chunk_cache,
+        "failed_chunks": failed_chunks
     }
+    if chunk_errors:
+        logger.warning(f"{failed_chunks} of the merged chunks failed; the result is incomplete")
+        merged["chunk_errors"] = chunk_errors
     
     # Add aggregated cost data
-    if total_cost > 0:
-        result["api_cost"] = {
-            "input_tokens": total_input_tokens,
-            "output_tokens": total_output_tokens,
-            "input_cost_usd": round(total_input_tokens * CLAUDE_INPUT_COST_PER_TOKEN, 6),
-            "output_cost_usd": round(total_output_tokens * CLAUDE_OUTPUT_COST_PER_TOKEN, 6),
-            "total_cost_usd": round(total_cost, 6),
-            "chunks_processed": len(chunks),
-            "timestamp": datetime.utcnow().isoformat()
+    if cost_totals.get("total_cost_usd", 0) > 0:
+        merged["api_cost"] = {
+            key: round(value, 6) if key.endswith("_usd") else value
+            for key, value in cost_totals.items()
         }
+        merged["api_cost"]["chunks_processed"] = len(results)
+        merged["api_cost"]["pricing"] = merge_pricing(pricing)
+        merged["api_cost"]["timestamp"] = datetime.utcnow().isoformat()
     
-    return result
+    return merged
+
+def merge_pricing(pricing):
+    """Pricing label for combined costs: "batch", "standard", or "mixed" when both were billed"""
+    return pricing.pop() if len(pricing) == 1 else "mixed"
+
+async def extract_transactions_chunked_async(text, progress=None):
+    """
+    Handle very large bank statements by processing in chunks and combining results
+    
+    progress, if given, is called as progress("extraction", "chunk_started" /
+    "chunk_finished", ...) for every chunk; see chunk_progress_details.
+    """
+    chunks = split_text_into_chunks(text)
+    if len(chunks) > 1:
+        logger.info(f"Text too large ({len(text)} chars), processing in chunks")
+    
+    results = await run_chunks_concurrently(
+        chunks, lambda i, chunk, limit: extract_with_bisection(chunk["text"], chunk["max_tokens"], limit(chunk_extractor(i + 1, progress))), progress
+    )
+    
+    if len(chunks) == 1 or all_failed(results):
+        return results[0]
+    return merge_chunk_results(results)
+
+async def extract_transactions_incremental_async(chunks, progress=None):
+    """
+    extract_transactions_chunked_async for chunks that are still being
+    produced: chunks is an async iterable (e.g. fed by the PDF parser) and
+    each chunk is dispatched as soon as it arrives, with at most
+    CHUNK_CONCURRENCY API calls in flight (or the shared_chunk_concurrency
+    limit)
+    
+    The number of chunks is only known once chunks is exhausted: progress
+    events carry chunks=None until then, a chunks_counted event reports the
+    total, and later events carry it. Results are merged in chunk order.
+    """
+    semaphore = _shared_chunk_semaphore.get() or asyncio.Semaphore(CHUNK_CONCURRENCY)
+    tasks = []
+    total = None
+    transactions_so_far = 0
+    
+    async def run_chunk(i, chunk):
+        nonlocal transactions_so_far
+        def started():
+            logger.info(f"Processing chunk {i+1} ({describe_chunk(chunk)})")
+            if progress is not None:
+                progress("extraction", "chunk_started", chunk=i + 1, chunks=total)
+        
+        extract = limited_extractor(chunk_extractor(i + 1, progress), semaphore, started)
+        result = await extract_with_bisection(chunk["text"], chunk["max_tokens"], extract)
+        if progress is not None:
+            details = chunk_progress_details(result)
+            transactions_so_far += details.get("transaction_count", 0)
+            progress("extraction", "chunk_finished", chunk=i + 1, chunks=total, transactions_so_far=transactions_so_far, **details)
+        return result
+    
+    try:
+        async for chunk in chunks:
+            tasks.append(asyncio.create_task(run_chunk(len(tasks), chunk)))
+        total = len(tasks)
+        if progress is not None:
+            progress("extraction", "chunks_counted", chunks=total)
+        results = await asyncio.gather(*tasks)
+    finally:
+        # Abandoned (e.g. the statement turned out invalid): stop the calls in flight
+        for task in tasks:
+            task.cancel()
+    
+    logger.info(f"Processed {len(results)} chunks dispatched during parsing")
+    if len(results) == 1 or all_failed(results):
+        return results[0]
+    return merge_chunk_results(results)
+
+def chunk_extractor(chunk_number, progress=None):
+    """
+    extract(text, max_tokens) for a chunk: with a progress listener the call
+    is streamed and every transaction is reported as soon as Claude emits
+    it, otherwise extract_transactions_async
+
+    Streamed transactions are provisional: when the output turns out to be
+    truncated, or the stream fails and is retried, a chunk_restarted event
+    tells listeners to drop what was streamed for the chunk, and its
+    chunk_finished event carries the final transactions either way.
+    """
+    if not progress:
+        return extract_transactions_async
+    
+    async def extract(text, max_tokens):
+        result = None
+        async for event in extract_transactions_stream(text, max_tokens):
+            if event["type"] == "transaction":
+                progress("extraction", "transaction_extracted", chunk=chunk_number, transactions={event["kind"]: [event["transaction"]]})
+            elif event["type"] == "restart":
+                progress("extraction", "chunk_restarted", chunk=chunk_number)
+            else:
+                result = event["result"]
+        if is_output_truncated(result):
+            progress("extraction", "chunk_restarted", chunk=chunk_number)
+        return result
+    
+    return extract
+
+def merge_bisected_results(truncated, halves):
+    """
+    Merge the results of a bisected chunk's halves, adding the cost of the
+    truncated call that triggered the split
+    """
+    if all_failed(halves):
+        return halves[0]
+    merged = merge_chunk_results(halves)
+    wasted = truncated.get("api_cost")
+    if wasted and "api_cost" in merged:
+        for key, value in wasted.items():
+            if key.endswith("_tokens") or key.endswith("_usd"):
+                total = merged["api_cost"].get(key, 0) + value
+                merged["api_cost"][key] = round(total, 6) if key.endswith("_usd") else total
+        merged["api_cost"]["pricing"] = merge_pricing({merged["api_cost"]["pricing"], wasted.get("pricing", "standard")})
+    return merged
+
+async def extract_with_bisection(text, max_tokens, extract, depth=0, result=None):
+    """
+    Await extract(text, max_tokens); when the output is cut off at
+    max_tokens, split text at a line boundary and re-extract both halves in
+    parallel (recursively, at most BISECT_MAX_DEPTH times) so the merged
+    result is complete without re-running the other chunks
+
+    result, if given, is an extraction of text that already finished (e.g.
+    in a message batch) and is used instead of the first call.
+    """
+    if result is None:
+        result = await extract(text, max_tokens)
+    if not is_output_truncated(result) or depth >= BISECT_MAX_DEPTH:
+        return result
+    
+    halves = bisect_text(text)
+    if halves is None:
+        return result
+    
+    logger.warning(f"Output truncated for {len(text)} chars, re-extracting as halves of {len(halves[0])} and {len(halves[1])} chars (depth {depth + 1})")
+    results = await asyncio.gather(*(extract_with_bisection(half, max_tokens, extract, depth + 1) for half in halves))
+    return merge_bisected_results(result, results)
+
+def limited_extractor(extract, semaphore, started=None):
+    """
+    Wrap extract(text, max_tokens) so that every call holds a semaphore slot
+    while it runs: the halves of a bisected chunk then queue for slots like
+    any other call instead of sharing their chunk's. started() is called
+    once, when the first call gets its slot.
+    """
+    first_call = True
+    
+    async def extract_in_slot(text, max_tokens):
+        nonlocal first_call
+        async with semaphore:
+            if first_call:
+                first_call = False
+                if started:
+                    started()
+            return await extract(text, max_tokens)
+    
+    return extract_in_slot
+
+async def run_chunks_concurrently(chunks, extract, progress=None):
+    """
+    Await extract(index, chunk, limit) for every chunk, largest chunks first;
+    results are returned in chunk order
+
+    limit(call) wraps an extract(text, max_tokens) (see limited_extractor):
+    extract must send its API calls through it, so that at most
+    CHUNK_CONCURRENCY calls (or the shared_chunk_concurrency limit) are in
+    flight, bisected halves included.
+    """
+    logger.info(f"Processing {len(chunks)} chunks")
+    
+    semaphore = _shared_chunk_semaphore.get() or asyncio.Semaphore(CHUNK_CONCURRENCY)
+    results = [None] * len(chunks)
+    transactions_so_far = 0
+    
+    async def run_chunk(i):
+        nonlocal transactions_so_far
+        def started():
+            logger.info(f"Processing chunk {i+1}/{len(chunks)} ({describe_chunk(chunks[i])})")
+            if progress is not None:
+                progress("extraction", "chunk_started", chunk=i + 1, chunks=len(chunks))
+        
+        results[i] = await extract(i, chunks[i], lambda call: limited_extractor(call, semaphore, started))
+        if progress is not None:
+            details = chunk_progress_details(results[i])
+            transactions_so_far += details.get("transaction_count", 0)
+            progress("extraction", "chunk_finished", chunk=i + 1, chunks=len(chunks), transactions_so_far=transactions_so_far, **details)
+    
+    # Calls acquire the semaphore in creation order, so largest chunks start first
+    await asyncio.gather(*(run_chunk(i) for i in largest_first(chunks)))
+    
+    return results
+
+def chunk_progress_details(result):
+    """
+    Token usage and transactions of a finished chunk, for chunk_finished
+    progress events (the transactions let clients render partial results)
+    """
+    if not isinstance(result, dict) or "error" in result:
+        return {"error": result.get("error") if isinstance(result, dict) else "No response"}
+    
+    api_cost = result.get("api_cost", {})
+    income = result.get("transactions", {}).get("income", [])
+    expenses = result.get("transactions", {}).get("expenses", [])
+    return {
+        "input_tokens": api_cost.get("input_tokens", 0),
+        "output_tokens": api_cost.get("output_tokens", 0),
+        "transaction_count": len(income) + len(expenses),
+        "transactions": {"income": income, "expenses": expenses}
+    }
+
+def build_line_items_request(header_text, lines_text, max_tokens):
+    """
+    Build a compact extraction request for the statement lines a local
+    parser couldn't classify. Lines are numbered "L<n>:" so results can be
+    merged back in document order.
+    """
+    headers = {
+        "x-api-key": os.getenv("ANTHROPIC_API_KEY"),
+        "anthropic-version": "2023-06-01",
+        "Content-Type": "application/json"
+    }
+    
+    data = {
+        "model": CLAUDE_MODEL,
+        "max_tokens": max_tokens,
+        "temperature": 0,
+        "messages": [{
+            "role": "user",
+            "content": f"""Extract bank statement transactions. Below are the statement header and numbered lines ("L<n>: ...") that a local parser could not classify; all other lines are already handled.
+
+Return ONLY this JSON:
+{{"account_details": {{"name": "", "account_number": "", "currency": "", "statement_date": ""}}, "final_balance": 0.00, "transactions": {{"income": [{{"line": 0, "date": "DDMMMYYYY", "description": "", "amount": 0.00, "reference": ""}}], "expenses": []}}}}
+
+Rules: "line" is the L number where the transaction starts; combine multi-line descriptions; amounts are positive; income = credits/deposits/refunds, expenses = debits/withdrawals/fees; skip balance and summary lines; take account details from the header, "" if absent.
+
+Statement header:
+{header_text}
+
+Lines:
+{lines_text}"""
+        }]
+    }
+    
+    return headers, data
+
+async def extract_line_items_async(header_text, lines_text, max_tokens):
+    """
+    Extract transactions from ambiguous numbered statement lines with the compact prompt
+    """
+    headers, data = build_line_items_request(header_text, lines_text, max_tokens)
+    
+    try:
+        logger.info(f"Making line-item API request for {len(lines_text)} characters of ambiguous lines")
+        timeout = extraction_timeout(max_tokens)
+        response = await make_api_request_with_retry_async(headers, data, timeout)
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping API call: {e}")
+        return service_overloaded_error(str(e), round(e.retry_after))
+    except httpx.TimeoutException as e:
+        logger.error(f"API request timed out: {e}")
+        return {"error": f"API request timed out after {timeout.read:.0f} seconds: {str(e)}"}
+    except httpx.ConnectError as e:
+        logger.error(f"Failed to connect to API: {e}")
+        return {"error": f"Failed to connect to Anthropic API: {str(e)}"}
+    except Exception as e:
+        logger.error(f"Unexpected error during API call: {e}")
+        return {"error": f"Unexpected error: {str(e)}"}
+    
+    return parse_extraction_response(response)
+
+def transaction_key(transaction):
+    """
+    Identity of a transaction for duplicate detection: date, description and amount
+    """
+    return (
+        transaction.get("date", ""),
+        transaction.get("description", "").strip().lower(),
+        transaction.get("amount", 0)
+    )
 
 def remove_duplicate_transactions(transactions):
     """
@@ -436,12 +1420,7 @@ def remove_duplicate_transactions(transactions):
     unique_transactions = []
     
     for transaction in transactions:
-        # Create a key based on date, description, and amount
-        key = (
-            transaction.get("date", ""),
-            transaction.get("description", "").strip().lower(),
-            transaction.get("amount", 0)
-        )
+        key = transaction_key(transaction)
         
         if key not in seen:
             seen.add(key)
@@ -0,0 +1,105 @@
+"""
+Compact row-oriented output format for Claude extraction responses
+
+Instead of JSON, Claude returns one pipe-delimited line per record:
+
+    ACCOUNT|name|account number|currency|statement period
+    BALANCE|final balance
+    I|date|description|amount|reference
+    E|date|description|amount|reference
+
+This avoids repeating the JSON keys for every transaction, which cuts
+output tokens (the most expensive part of a call) substantially.
+"""
+import re
+import logging
+from typing import List, Tuple, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+ROW_KINDS = {"I": "income", "E": "expenses"}
+AMOUNT_CLEANUP = re.compile(r'[^\d.\-]')
+
+def _parse_amount(value: str) -> Optional[float]:
+    """Signed amount with currency symbols and separators removed, or None"""
+    try:
+        return float(AMOUNT_CLEANUP.sub('', value))
+    except ValueError:
+        return None
+
+def parse_transaction_row(line: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Parse an I|... or E|... line into (kind, transaction), or None"""
+    fields = [field.strip() for field in line.strip().split('|')]
+    if len(fields) < 4 or fields[0] not in ROW_KINDS:
+        return None
+    amount = _parse_amount(fields[3])
+    if amount is None:
+        return None
+    # The row kind carries the direction; transaction amounts are always positive
+    return ROW_KINDS[fields[0]], {
+        "date": fields[1],
+        "description": fields[2],
+        "amount": abs(amount),
+        "reference": fields[4] if len(fields) > 4 else ""
+    }
+
+def parse_compact_rows(raw_text: str) -> Optional[Dict[str, Any]]:
+    """
+    Convert compact row output into the account_details/transactions
+    structure, or None if the text contains no recognisable rows
+    """
+    result = {
+        "account_details": {},
+        "final_balance": 0.0,
+        "transactions": {"income": [], "expenses": []}
+    }
+    found = False
+
+    for line in raw_text.split('\n'):
+        line = line.strip().strip('`')
+        if not line:
+            continue
+
+        row = parse_transaction_row(line)
+        if row:
+            kind, transaction = row
+            result["transactions"][kind].append(transaction)
+            found = True
+            continue
+
+        fields = [field.strip() for field in line.split('|')]
+        if fields[0] == "ACCOUNT" and len(fields) >= 5:
+            result["account_details"] = {
+                "name": fields[1],
+                "account_number": fields[2],
+                "currency": fields[3],
+                "statement_date": fields[4]
+            }
+            found = True
+        elif fields[0] == "BALANCE" and len(fields) >= 2:
+            balance = _parse_amount(fields[1])
+            if balance is not None:
+                result["final_balance"] = balance
+                found = True
+
+    return result if found else None
+
+class CompactRowStreamParser:
+    """
+    Incremental parser for streamed compact rows; emits each transaction
+    as soon as its line is complete (same interface as TransactionStreamParser)
+    """
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        return [row for row in (parse_transaction_row(line) for line in lines) if row]
+
+    def flush(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Parse the final line if the stream didn't end with a newline"""
+        line, self.pending = self.pending, ""
+        row = parse_transaction_row(line)
+        return [row] if row else []
@@ -0,0 +1,183 @@
+"""
+Token-minimizing compaction of statement text before it is sent to Claude
+
+Removes page furniture (headers, column titles, footers, legal text) that is
+repeated on every page, collapses whitespace and strips thousands separators
+and currency symbols from transaction amounts. Page markers are kept so the
+chunker can still split on page boundaries.
+"""
+import os
+import re
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.services.chunker import PAGE_MARKER_PATTERN, TRANSACTION_START_PATTERN, AMOUNT_PATTERN, CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_ENABLED = os.getenv("TEXT_COMPACTION_ENABLED", "true").lower() == "true"
+# A line counts as page furniture when it appears on at least this share of pages (and on two or more)
+COMPACTION_REPEAT_RATIO = float(os.getenv("TEXT_COMPACTION_REPEAT_RATIO", "0.5"))
+# Pages sampled to recognize furniture when text is compacted while the PDF is still being parsed
+COMPACTION_SAMPLE_PAGES = int(os.getenv("TEXT_COMPACTION_SAMPLE_PAGES", "5"))
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+THOUSANDS_SEPARATOR_PATTERN = re.compile(r'(?<=\d),(?=\d{3}(?:\D|$))')
+# Currency symbols or codes directly before or after an amount, e.g. "Rs. 1,200.00" or "45.00 LKR"
+CURRENCY_NOISE_PATTERN = re.compile(
+    r'(?:\b(?:LKR|USD|EUR|GBP|INR|AUD|SGD|Rs\.?)|[$€£₹])\s*(?=-?\d[\d,]*\.\d{2})'
+    r'|(?<=\d\.\d{2})\s*(?:LKR|USD|EUR|GBP|INR|AUD|SGD)\b',
+    re.IGNORECASE
+)
+DIGITS_PATTERN = re.compile(r'\d+')
+DATE_PATTERN = re.compile(r'\b\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}\b')
+
+def compact_statement_text(text: str, repeat_ratio: float = COMPACTION_REPEAT_RATIO) -> Tuple[str, Dict[str, Any]]:
+    """
+    Compact statement text; returns the compacted text and statistics
+    (characters, lines removed and estimated tokens saved)
+
+    A single pass normalizes every line and records on which pages each
+    furniture candidate appears; the kept lines are then filtered in order.
+    Only lines without a date or amount that sit outside a page's block of
+    transactions can be furniture, and the first occurrence of each is
+    kept (page 1 carries the account details).
+    Furniture is compared with digits masked, so "Page 2 of 5" and
+    "Page 3 of 5" are the same line.
+    """
+    compactor = StatementCompactor(repeat_ratio)
+    compacted = compactor.feed(text) + compactor.finish()
+    return compacted, compactor.stats
+
+class StatementCompactor:
+    """
+    compact_statement_text for text that arrives piece by piece
+
+    Lines are passed on a page at a time, once the next page marker shows
+    where the page's transaction block ends. They are then held back until
+    furniture can be told apart: by default
+    until the whole text has been fed, or, with sample_pages, until that
+    many pages have been seen. Furniture is then decided on those pages
+    and later lines are filtered as they arrive. feed() and finish()
+    return the compacted text that became ready; joined, the pieces are
+    the compacted text.
+    """
+
+    def __init__(self, repeat_ratio: float = COMPACTION_REPEAT_RATIO, sample_pages: Optional[int] = None):
+        self.repeat_ratio = repeat_ratio
+        self.sample_pages = sample_pages
+        self.partial_line = ""  # Text after the last newline fed so far
+        self.page_lines: List[Tuple[str, str, bool]] = []  # (normalized line, furniture key or "", dated row) of the current page
+        self.held: List[Tuple[str, str]] = []  # (normalized line, furniture key or "") not yet filtered
+        self.pages_seen: Dict[str, set] = {}
+        self.page = 0
+        self.page_count = 0
+        self.repeated: Optional[set] = None  # Furniture keys, once decided
+        self.emitted: set = set()
+        self.chars_before = 0
+        self.chars_after = 0
+        self.removed = 0
+
+    def feed(self, text: str) -> str:
+        self.chars_before += len(text)
+        pieces = (self.partial_line + text).split('\n')
+        self.partial_line = pieces.pop()
+
+        output = []
+        for raw_line in pieces:
+            self._add_line(raw_line, output)
+        return self._join(output)
+
+    def finish(self) -> str:
+        output = []
+        self._add_line(self.partial_line, output)
+        self.partial_line = ""
+        self._end_page(output)
+        if self.repeated is None:
+            self._decide(self.page_count, output)
+
+        stats = self.stats
+        logger.info(f"Compacted statement text from {stats['chars_before']} to {stats['chars_after']} chars "
+                    f"({self.removed} repeated lines removed, ~{stats['tokens_saved']} tokens saved)")
+        return self._join(output)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        # Same as comparing estimate_tokens of the full texts
+        return {
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "repeated_lines_removed": self.removed,
+            "tokens_saved": max(0, int(self.chars_before / CHARS_PER_TOKEN) - int(self.chars_after / CHARS_PER_TOKEN))
+        }
+
+    def _add_line(self, raw_line: str, output: List[str]) -> None:
+        line = WHITESPACE_PATTERN.sub(' ', raw_line).strip()
+        if not line:
+            return
+
+        key = ""
+        is_row = False
+        marker = PAGE_MARKER_PATTERN.match(line)
+        if marker:
+            self._end_page(output)
+            if self.repeated is None and self.sample_pages is not None and self.page_count >= self.sample_pages:
+                self._decide(self.page_count, output)
+            self.page = int(marker.group(1))
+            self.page_count += 1
+        elif TRANSACTION_START_PATTERN.match(line):
+            # Currency is only noise on transaction rows; header lines keep it for account_details
+            line = CURRENCY_NOISE_PATTERN.sub('', line)
+            line = THOUSANDS_SEPARATOR_PATTERN.sub('', line)
+            is_row = True
+        else:
+            line = THOUSANDS_SEPARATOR_PATTERN.sub('', line)
+            if not (AMOUNT_PATTERN.search(line) or DATE_PATTERN.search(line)):
+                key = DIGITS_PATTERN.sub('#', line.lower())
+
+        self.page_lines.append((line, key, is_row))
+
+    def _end_page(self, output: List[str]) -> None:
+        """
+        Pass on the lines of the page that just ended. Only lines outside
+        the page's transaction block (before its first dated row or after
+        its last) can be furniture, and never a line right below a dated
+        row: those continue a transaction's description ("SALARY CREDIT")
+        and may repeat on every page without being furniture.
+        """
+        rows = [i for i, (_, _, is_row) in enumerate(self.page_lines) if is_row]
+        for i, (line, key, _) in enumerate(self.page_lines):
+            if key and rows and (rows[0] < i < rows[-1] or (i > 0 and self.page_lines[i - 1][2])):
+                key = ""
+            if self.repeated is None:
+                if key:
+                    self.pages_seen.setdefault(key, set()).add(self.page)
+                self.held.append((line, key))
+            else:
+                self._emit(line, key, output)
+        self.page_lines = []
+
+    def _decide(self, page_count: int, output: List[str]) -> None:
+        """Settle which lines are furniture and release the held lines"""
+        min_pages = max(2, self.repeat_ratio * page_count)
+        self.repeated = {key for key, pages in self.pages_seen.items() if len(pages) >= min_pages}
+        for line, key in self.held:
+            self._emit(line, key, output)
+        self.held = []
+        self.pages_seen = {}
+
+    def _emit(self, line: str, key: str, output: List[str]) -> None:
+        if key and key in self.repeated:
+            if key in self.emitted:
+                self.removed += 1
+                return
+            self.emitted.add(key)
+        output.append(line)
+
+    def _join(self, lines: List[str]) -> str:
+        # Lines are separated, not terminated, by newlines, as in '\n'.join(kept)
+        if not lines:
+            return ""
+        text = ('\n' if self.chars_after else '') + '\n'.join(lines)
+        self.chars_after += len(text)
+        return text
@@ -0,0 +1,200 @@
+"""
+Transaction extraction pipeline: local template parsers first, Claude as fallback
+"""
+import os
+import re
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Callable, AsyncIterator, Tuple
+
+from app.services.statement_templates import extract_with_templates, TEMPLATE_REGISTRY, TEMPLATE_HEADER_CHARS
+from app.services.line_parser import parse_statement_lines
+from app.services.chunker import split_text_into_chunks, ChunkBuilder
+from app.services.compaction import compact_statement_text, StatementCompactor, COMPACTION_ENABLED, COMPACTION_SAMPLE_PAGES
+from app.services.pdf_parser import format_page
+from app.services.validators import BankStatementValidator
+from app.services.claude import (
+    extract_transactions_chunked_async,
+    extract_transactions_incremental_async,
+    extract_line_items_async,
+    extract_with_bisection,
+    run_chunks_concurrently,
+    merge_chunk_results,
+    preprocess_bank_statement_text
+)
+
+logger = logging.getLogger(__name__)
+
+# "claude" sends the whole statement to Claude; "hybrid" parses confident rows
+# locally and only sends ambiguous lines
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "claude").lower()
+HYBRID_MIN_PARSED_RATIO = float(os.getenv("HYBRID_MIN_PARSED_RATIO", "0.5"))
+# Start Claude on the first chunks while later pages are still being parsed ("claude" mode only)
+EARLY_DISPATCH_ENABLED = os.getenv("EXTRACTION_EARLY_DISPATCH", "true").lower() == "true"
+
+async def extract_statement(
+    text: str,
+    progress: Optional[Callable[..., None]] = None,
+    early_extraction: Optional[asyncio.Task] = None
+) -> Dict[str, Any]:
+    """
+    Extract transactions from statement text
+
+    The result has the same structure as extract_transactions_chunked_async,
+    plus an "extraction_path" key naming the path that produced it
+    ("template:<name>", "hybrid" or "claude"). Claude paths also report the
+    text compaction statistics under "compaction". progress receives the
+    chunk events of whichever Claude path runs.
+
+    early_extraction is an extract_statement_early task started while the
+    PDF was parsed; its result is used unless a template handles the text,
+    in which case it is cancelled.
+    """
+    template_name, result = extract_with_templates(text)
+    if result is not None:
+        logger.info(f"Extracted statement locally with template '{template_name}'")
+        if early_extraction:
+            early_extraction.cancel()
+        result["extraction_path"] = f"template:{template_name}"
+        return result
+
+    if early_extraction:
+        logger.info("No statement template matched, using the extraction started during parsing")
+        return await early_extraction
+
+    # Only the Claude paths see compacted text; templates match the original layout
+    compaction = None
+    if COMPACTION_ENABLED:
+        text, compaction = compact_statement_text(text)
+        if progress is not None:
+            progress("extraction", "compacted", **compaction)
+
+    if EXTRACTION_MODE == "hybrid":
+        result = await extract_statement_hybrid(text, progress)
+        if result is not None:
+            if "error" not in result:
+                result["extraction_path"] = "hybrid"
+                result["compaction"] = compaction
+            return result
+
+    logger.info("No statement template matched, extracting with Claude")
+    result = await extract_transactions_chunked_async(text, progress)
+    if isinstance(result, dict) and "error" not in result:
+        result["extraction_path"] = "claude"
+        result["compaction"] = compaction
+    return result
+
+def can_dispatch_early(header: str) -> bool:
+    """
+    Whether Claude extraction can start from the statement's first
+    TEMPLATE_HEADER_CHARS characters, before the rest is parsed: only in
+    "claude" mode, when no template recognizes the statement (templates
+    match within that same window, so extract_statement would not have
+    used one either) and the text looks like a bank statement (so invalid
+    uploads don't spend API calls)
+    """
+    if not (EARLY_DISPATCH_ENABLED and EXTRACTION_MODE == "claude"):
+        return False
+    header = header[:TEMPLATE_HEADER_CHARS]
+    if any(template.matches(header) for template in TEMPLATE_REGISTRY):
+        return False
+    return BankStatementValidator().analyze_pdf_content(header)["is_bank_statement"]
+
+async def extract_statement_early(
+    pages: AsyncIterator[Tuple[int, str]],
+    progress: Optional[Callable[..., None]] = None
+) -> Dict[str, Any]:
+    """
+    Claude extraction of a statement whose pages are still arriving
+    ((page_number, text) as yielded by iter_pdf_pages)
+
+    Pages are compacted and packed into chunks as they come in, and every
+    chunk is sent as soon as it is complete. Compaction can only look at the
+    first COMPACTION_SAMPLE_PAGES pages to recognize repeated page furniture.
+    """
+    compactor = StatementCompactor(sample_pages=COMPACTION_SAMPLE_PAGES) if COMPACTION_ENABLED else None
+    builder = ChunkBuilder()
+
+    async def chunks():
+        async for page_number, page_text in pages:
+            text = format_page(page_number, page_text)
+            for chunk in builder.feed(compactor.feed(text) if compactor else text):
+                yield chunk
+        for chunk in builder.feed(compactor.finish() if compactor else "") + builder.finish():
+            yield chunk
+
+    result = await extract_transactions_incremental_async(chunks(), progress)
+
+    compaction = compactor.stats if compactor else None
+    if compaction and progress is not None:
+        progress("extraction", "compacted", **compaction)
+    if isinstance(result, dict) and "error" not in result:
+        result["extraction_path"] = "claude"
+        result["compaction"] = compaction
+    return result
+
+async def extract_statement_hybrid(text: str, progress: Optional[Callable[..., None]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Parse confidently structured rows locally and send only the ambiguous
+    lines (plus the statement header) to Claude with a compact prompt
+
+    Returns None when too few rows parse locally for the hybrid path to pay off.
+    """
+    processed_text = preprocess_bank_statement_text(text)
+    lines = parse_statement_lines(processed_text)
+
+    row_count = lines["row_count"]
+    if row_count == 0 or len(lines["parsed"]) / row_count < HYBRID_MIN_PARSED_RATIO:
+        logger.info(f"Hybrid extraction skipped: {len(lines['parsed'])} of {row_count} rows parsed locally")
+        return None
+
+    header_text = '\n'.join(lines["header"])
+    numbered_text = '\n'.join(f"L{number}: {line}" for number, line in lines["ambiguous"])
+
+    # The header goes with the first chunk only; it carries the account details
+    chunks = split_text_into_chunks(numbered_text)
+    def extract_chunk(i, chunk, limit):
+        header = header_text if i == 0 else ""
+        return extract_with_bisection(
+            chunk["text"], chunk["max_tokens"], limit(lambda lines_text, max_tokens: extract_line_items_async(header, lines_text, max_tokens))
+        )
+
+    results = await run_chunks_concurrently(chunks, extract_chunk, progress)
+
+    if all(isinstance(result, dict) and "error" in result for result in results):
+        return results[0]
+
+    merged = merge_chunk_results(results)
+
+    income = [t for t in lines["parsed"] if t["type"] == "income"] + merged["transactions"]["income"]
+    expenses = [t for t in lines["parsed"] if t["type"] == "expenses"] + merged["transactions"]["expenses"]
+
+    result = {
+        "account_details": merged["account_details"],
+        "final_balance": lines["final_balance"] if lines["final_balance"] is not None else merged["final_balance"],
+        "transactions": {
+            "income": _in_document_order(income),
+            "expenses": _in_document_order(expenses)
+        },
+        "hybrid": {
+            "rows": row_count,
+            "parsed_locally": len(lines["parsed"]),
+            "ambiguous_lines": len(lines["ambiguous"])
+        }
+    }
+    if "api_cost" in merged:
+        result["api_cost"] = merged["api_cost"]
+    result["failed_chunks"] = merged["failed_chunks"]
+    if "chunk_errors" in merged:
+        result["chunk_errors"] = merged["chunk_errors"]
+
+    return result
+
+def _line_number(transaction: Dict[str, Any]) -> float:
+    # Claude may echo the line as "L12" or "12"; unknown positions sort last
+    digits = re.sub(r'\D', '', str(transaction.get("line", "")))
+    return int(digits) if digits else float("inf")
+
+def _in_document_order(transactions):
+    ordered = sorted(transactions, key=_line_number)
+    return [{key: value for key, value in t.items() if key not in ("line", "type")} for t in ordered]
@@ -0,0 +1,124 @@
+"""
+Persistent cache for bank statement extraction results
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import logging
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(tempfile.gettempdir(), "bank_statement_cache.sqlite3"))
+CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))  # 7 days
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 200MB
+
+class ExtractionCache:
+    """SQLite-backed cache with TTL and total-size (LRU) eviction"""
+
+    def __init__(self, table: str = "statement_results", path: str = CACHE_PATH,
+                 ttl_seconds: int = CACHE_TTL_SECONDS, max_bytes: int = CACHE_MAX_BYTES):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid cache table name: {table}")
+        self.table = table
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_accessed ON {table} (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per operation keeps the cache safe to use from worker threads
+        return sqlite3.connect(self.path, timeout=5)
+
+    @staticmethod
+    def make_key(text: str, model: str, prompt_version: str) -> str:
+        """Content-addressed key for extracted text under a given model and prompt"""
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt_version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for key, or None if missing or expired"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    f"SELECT value FROM {self.table} WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl_seconds)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Extraction cache read failed: {str(e)}")
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store value under key and evict expired or least recently used entries"""
+        now = time.time()
+        try:
+            payload = json.dumps(value)
+            with self._connect() as conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), now, now)
+                )
+                self._evict(conn, now)
+        except Exception as e:
+            logger.warning(f"Extraction cache write failed: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(f"DELETE FROM {self.table} WHERE created_at <= ?", (now - self.ttl_seconds,))
+
+        total_size = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until the cache fits again
+        evicted = []
+        for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed_at ASC").fetchall():
+            if total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+        conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted)
+        logger.info(f"Extraction cache ({self.table}) evicted {len(evicted)} entries to stay under {self.max_bytes} bytes")
+
+_extraction_cache = None
+_chunk_cache = None
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Return the process-wide extraction cache, or None when caching is disabled"""
+    global _extraction_cache
+    if not CACHE_ENABLED:
+        return None
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache()
+    return _extraction_cache
+
+def get_chunk_cache() -> Optional[ExtractionCache]:
+    """Return the process-wide per-chunk Claude result cache, or None when caching is disabled"""
+    global _chunk_cache
+    if not CACHE_ENABLED:
+        return None
+    if _chunk_cache is None:
+        _chunk_cache = ExtractionCache(table="chunk_results")
+    return _chunk_cache
@@ -0,0 +1,179 @@
+"""
+Background job queue for statement processing
+
+Uploads submitted in job mode are queued and run by a bounded pool of
+in-process worker tasks, so the HTTP request returns immediately and the
+client polls GET /api/jobs/{id} for progress and the final result.
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+
+from app.services.statement_pipeline import PIPELINE_STAGES
+from app.services.progress import ProgressChannel, STAGE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+
+JobRunner = Callable[[Callable[..., None]], Awaitable[Tuple[int, Dict[str, Any]]]]
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+    pass
+
+class JobManager:
+    """
+    In-process job registry with a fixed pool of asyncio worker tasks
+
+    Each job records its status (queued, running, completed, failed), the
+    progress of every pipeline stage and, once finished, the HTTP status code
+    and response content. Its "events" channel keeps the full progress log
+    for SSE subscribers. Finished jobs are evicted after ttl_seconds.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_max: int = JOB_QUEUE_MAX, ttl_seconds: int = JOB_RESULT_TTL_SECONDS):
+        self.workers = max(1, workers)
+        self.queue_max = queue_max
+        self.ttl_seconds = ttl_seconds
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks = []
+
+    def _ensure_workers(self):
+        # Workers are started lazily so they bind to the running event loop
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_max)
+        self.tasks = [task for task in self.tasks if not task.done()]
+        while len(self.tasks) < self.workers:
+            self.tasks.append(asyncio.create_task(self._worker(len(self.tasks))))
+
+    def submit(self, runner: JobRunner, owner: Optional[str] = None, filename: Optional[str] = None, cleanup: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """
+        Queue runner(progress) for background execution and return the job
+
+        cleanup is called after the job finishes, whether it succeeded or not.
+        Raises JobQueueFullError when the queue is at capacity.
+        """
+        self.evict_expired()
+        self._ensure_workers()
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "owner": owner,
+            "filename": filename,
+            "stages": {stage: {"status": "pending"} for stage in PIPELINE_STAGES},
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "status_code": None,
+            "result": None
+        }
+        job["events"] = ProgressChannel(on_event=lambda event: self._apply_event(job, event))
+
+        try:
+            self.queue.put_nowait((job["id"], runner, cleanup))
+        except asyncio.QueueFull:
+            raise JobQueueFullError(f"Job queue is full ({self.queue_max} jobs waiting)")
+
+        self.jobs[job["id"]] = job
+        logger.info(f"Queued job {job['id']} for {filename} ({self.queue.qsize()} waiting)")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self.evict_expired()
+        return self.jobs.get(job_id)
+
+    def evict_expired(self):
+        """Drop finished jobs older than the result TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+        if expired:
+            logger.info(f"Evicted {len(expired)} expired jobs")
+
+    @staticmethod
+    def _apply_event(job: Dict[str, Any], event: Dict[str, Any]):
+        # Lifecycle statuses change the stage state; intermediate events only add details
+        if event["stage"] not in job["stages"]:
+            return
+        entry = job["stages"][event["stage"]]
+        details = {key: value for key, value in event.items() if key not in ("stage", "status", "time", "transactions")}
+        entry.update(details)
+        entry["updated_at"] = event["time"]
+        if event["status"] in STAGE_STATUSES:
+            entry["status"] = event["status"]
+
+    async def _worker(self, number: int):
+        while True:
+            job_id, runner, cleanup = await self.queue.get()
+            job = self.jobs.get(job_id)
+            try:
+                if job is None:
+                    continue
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                logger.info(f"Worker {number} started job {job_id}")
+
+                try:
+                    status_code, content = await runner(job["events"])
+                except Exception as e:
+                    logger.error(f"Job {job_id} failed: {str(e)}")
+                    status_code, content = 500, {
+                        "error": f"Processing failed: {str(e)}",
+                        "error_type": "job_error"
+                    }
+
+                job["status_code"] = status_code
+                job["result"] = content
+                job["status"] = "completed" if status_code < 400 else "failed"
+                job["finished_at"] = time.time()
+                logger.info(f"Job {job_id} {job['status']} in {job['finished_at'] - job['started_at']:.2f}s")
+                
+                job["events"].publish({
+                    "stage": "result",
+                    "status": job["status"],
+                    "time": job["finished_at"],
+                    "status_code": status_code,
+                    "result": content
+                })
+                job["events"].close()
+            finally:
+                if cleanup:
+                    try:
+                        cleanup()
+                    except Exception as e:
+                        logger.warning(f"Job {job_id} cleanup failed: {e}")
+                self.queue.task_done()
+
+    async def shutdown(self):
+        """Cancel the worker tasks"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+
+    @staticmethod
+    def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Job fields returned to clients"""
+        return {key: value for key, value in job.items() if key not in ("owner", "events")}
+
+_job_manager = None
+
+def get_job_manager() -> JobManager:
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
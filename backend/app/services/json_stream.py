@@ -0,0 +1,101 @@
+"""
+Incremental JSON parsing for streamed Claude extraction responses
+"""
+import json
+import logging
+from typing import List, Tuple, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+class TransactionStreamParser:
+    """
+    Incremental parser that emits each transaction object as soon as it closes
+
+    Feed it text fragments as they arrive; it tracks the JSON structure
+    (strings, escapes, object keys and nesting) and returns every completed
+    object found directly inside "transactions" -> "income" / "expenses".
+    Text before the opening brace (such as a markdown code fence) is ignored.
+    """
+
+    TRANSACTION_LISTS = ("income", "expenses")
+
+    def __init__(self):
+        self.buffer = []         # Characters of the transaction object currently being read
+        self.stack = []          # Open containers as [type, key, expecting_key]
+        self.in_string = False
+        self.escape = False
+        self.string_chars = []
+        self.last_key = None
+        self.capture_depth = None  # Stack depth at which the current transaction object opened
+        self.capture_kind = None
+
+    def feed(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Consume a text fragment and return (kind, transaction) pairs completed by it"""
+        completed = []
+
+        for char in text:
+            if self.capture_depth is not None:
+                self.buffer.append(char)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.stack and self.stack[-1][0] == "object" and self.stack[-1][2]:
+                        self.last_key = "".join(self.string_chars)
+                else:
+                    self.string_chars.append(char)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_chars = []
+            elif char in '{[':
+                key = self.last_key if self.stack and self.stack[-1][0] == "object" else None
+                if char == '{' and self._in_transaction_list():
+                    self.capture_depth = len(self.stack)
+                    self.capture_kind = self.stack[-1][1]
+                    self.buffer = ['{']
+                self.stack.append(["object" if char == '{' else "array", key, char == '{'])
+                self.last_key = None
+            elif char in '}]':
+                if self.stack:
+                    self.stack.pop()
+                if char == '}' and self.capture_depth is not None and len(self.stack) == self.capture_depth:
+                    completed.extend(self._emit())
+            elif char == ':':
+                if self.stack and self.stack[-1][0] == "object":
+                    self.stack[-1][2] = False
+            elif char == ',':
+                if self.stack and self.stack[-1][0] == "object":
+                    self.stack[-1][2] = True
+
+        return completed
+
+    def flush(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Objects are emitted as they close, so nothing is left at end of stream"""
+        return []
+
+    def _in_transaction_list(self) -> bool:
+        # Path: root object -> "transactions" object -> "income"/"expenses" array
+        return (
+            len(self.stack) == 3
+            and self.stack[0][0] == "object"
+            and self.stack[1][0] == "object" and self.stack[1][1] == "transactions"
+            and self.stack[2][0] == "array" and self.stack[2][1] in self.TRANSACTION_LISTS
+        )
+
+    def _emit(self) -> List[Tuple[str, Dict[str, Any]]]:
+        text = "".join(self.buffer)
+        kind = self.capture_kind
+        self.buffer = []
+        self.capture_depth = None
+        self.capture_kind = None
+        try:
+            return [(kind, json.loads(text))]
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed streamed transaction: {str(e)}")
+            return []
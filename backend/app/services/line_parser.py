@@ -0,0 +1,184 @@
+"""
+Local line-level parser for preprocessed bank statement text
+
+Classifies each statement row as either a confidently parsed transaction or
+an ambiguous line that still needs Claude. A row is confident when its
+direction is explicit (CR/DR marker, signed amount, separate debit and
+credit columns) or when it reconciles with the previous running balance.
+"""
+import re
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+DATE = (
+    r'\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}'   # DD/MM/YYYY
+    r'|\d{1,2}\s+[A-Za-z]{3}\s+\d{2,4}'      # DD MMM YYYY
+    r'|\d{2}[A-Za-z]{3}\d{4}'                # DDMMMYYYY
+    r'|\d{4}-\d{2}-\d{2}'                    # YYYY-MM-DD
+)
+AMOUNT_TOKEN = r'-?[\d,]*\d\.\d{2}(?:\s*(?:CR|DR|Cr|Dr))?'
+
+ROW_PATTERN = re.compile(rf'^(?P<date>{DATE})\s+(?P<description>.*?)(?P<amounts>(?:\s+{AMOUNT_TOKEN}){{1,3}})\s*$')
+AMOUNT_TOKEN_PATTERN = re.compile(r'(-?)([\d,]*\d\.\d{2})(?:\s*(CR|DR|Cr|Dr))?')
+DATE_START_PATTERN = re.compile(rf'^(?:{DATE})\b')
+AMOUNT_PATTERN = re.compile(r'[\d,]+\.\d{2}')
+OPENING_BALANCE_PATTERN = re.compile(r'(?:opening\s+balance|balance\s+b/f|brought\s+forward)\D*?([\d,]+\.\d{2})', re.IGNORECASE)
+
+NUMERIC_DATE = re.compile(r'^(\d{1,2})[/\-\.](\d{1,2})[/\-\.](\d{2,4})$')
+SPACED_DATE = re.compile(r'^(\d{1,2})\s+([A-Za-z]{3})\s+(\d{2,4})$')
+COMPACT_DATE = re.compile(r'^(\d{2})([A-Za-z]{3})(\d{4})$')
+ISO_DATE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+
+def normalize_date(value: str) -> Optional[str]:
+    """Convert a statement date to the DDMMMYYYY format Claude is asked for"""
+    value = value.strip()
+
+    def year(text: str) -> str:
+        return f"20{text}" if len(text) == 2 else text
+
+    match = NUMERIC_DATE.match(value)
+    if match:
+        day, month, yr = match.groups()
+        if not 1 <= int(month) <= 12:
+            return None
+        return f"{int(day):02d}{MONTHS[int(month) - 1]}{year(yr)}"
+
+    match = SPACED_DATE.match(value) or COMPACT_DATE.match(value)
+    if match:
+        day, month, yr = match.groups()
+        if month.upper() not in MONTHS:
+            return None
+        return f"{int(day):02d}{month.upper()}{year(yr)}"
+
+    match = ISO_DATE.match(value)
+    if match:
+        yr, month, day = match.groups()
+        if not 1 <= int(month) <= 12:
+            return None
+        return f"{day}{MONTHS[int(month) - 1]}{yr}"
+
+    return None
+
+def _parse_amounts(amounts_text: str) -> List[Tuple[float, Optional[str]]]:
+    """Parse the trailing amount columns into (signed value, CR/DR marker) pairs"""
+    amounts = []
+    for sign, value, marker in AMOUNT_TOKEN_PATTERN.findall(amounts_text):
+        number = float(value.replace(',', ''))
+        amounts.append((-number if sign else number, marker.upper() if marker else None))
+    return amounts
+
+def _classify_row(amounts: List[Tuple[float, Optional[str]]], previous_balance: Optional[float]) -> Tuple[Optional[str], Optional[float], Optional[float]]:
+    """
+    Decide the direction of a row from its amount columns
+
+    Returns (kind, amount, balance) where kind is "income", "expenses" or
+    None when the direction can't be determined locally.
+    """
+    balance = None
+    if len(amounts) >= 2:
+        value, marker = amounts[-1]
+        balance = -abs(value) if marker == "DR" else value
+
+    if len(amounts) == 3:
+        # Separate debit and credit columns followed by the balance
+        (debit, _), (credit, _) = amounts[0], amounts[1]
+        if debit and not credit:
+            return "expenses", abs(debit), balance
+        if credit and not debit:
+            return "income", abs(credit), balance
+        return None, None, balance
+
+    value, marker = amounts[0]
+    amount = abs(value)
+    if amount == 0:
+        return None, None, balance
+    if marker == "CR":
+        return "income", amount, balance
+    if marker == "DR" or value < 0:
+        return "expenses", amount, balance
+
+    if balance is not None and previous_balance is not None:
+        if abs(round(previous_balance + amount, 2) - balance) < 0.005:
+            return "income", amount, balance
+        if abs(round(previous_balance - amount, 2) - balance) < 0.005:
+            return "expenses", amount, balance
+
+    return None, None, balance
+
+def parse_statement_lines(processed_text: str, max_header_lines: int = 60) -> Dict[str, Any]:
+    """
+    Split preprocessed statement text into locally parsed transactions and
+    ambiguous lines
+
+    Returns a dict with:
+      - "header": lines before the first dated row (account details live here)
+      - "parsed": transactions with their "type" and starting "line" number
+      - "ambiguous": (line number, text) pairs for Claude to interpret
+      - "final_balance": last running balance printed on a row, or None
+      - "row_count": number of dated rows found
+    """
+    lines = processed_text.split('\n')
+    header = []
+    parsed = []
+    ambiguous = []
+    previous_balance = None
+    final_balance = None
+    row_count = 0
+
+    # Group each dated row with the undated lines that follow it
+    groups = []
+    for number, line in enumerate(lines):
+        if DATE_START_PATTERN.match(line):
+            groups.append([(number, line)])
+        elif groups:
+            groups[-1].append((number, line))
+        elif len(header) < max_header_lines:
+            header.append(line)
+
+    # Seed the running balance so the first row can reconcile too
+    opening = OPENING_BALANCE_PATTERN.search('\n'.join(header))
+    if opening:
+        previous_balance = float(opening.group(1).replace(',', ''))
+
+    for group in groups:
+        number, line = group[0]
+        row_count += 1
+        row = ROW_PATTERN.match(line)
+
+        kind, amount, balance = (None, None, None)
+        if row:
+            kind, amount, balance = _classify_row(_parse_amounts(row.group("amounts")), previous_balance)
+        if balance is not None:
+            previous_balance = balance
+            final_balance = balance
+
+        date = normalize_date(row.group("date")) if row else None
+        description = row.group("description").strip() if row else ""
+
+        # Multi-line descriptions and odd formats go to Claude with their context
+        if kind is None or date is None or not description or len(group) > 1:
+            ambiguous.extend(group)
+            continue
+
+        parsed.append({
+            "type": kind,
+            "line": number,
+            "date": date,
+            "description": description,
+            "amount": amount,
+            "reference": ""
+        })
+
+    logger.info(f"Line parser: {len(parsed)} of {row_count} rows parsed locally, {len(ambiguous)} ambiguous lines")
+
+    return {
+        "header": header,
+        "parsed": parsed,
+        "ambiguous": ambiguous,
+        "final_balance": final_balance,
+        "row_count": row_count
+    }
@@ -0,0 +1,181 @@
+"""
+Offline extraction through the Anthropic Message Batches API
+
+Packs every chunk of many statements into batch submissions, polls until
+they end and maps the results back through the usual chunk merge. Batches
+can take up to 24 hours but are billed at half the standard price, which
+suits overnight reprocessing where latency doesn't matter.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, Any, List, Tuple
+
+import httpx
+
+from app.services.chunker import split_text_into_chunks
+from app.services.extraction_cache import get_chunk_cache, ExtractionCache
+from app.services.claude import (
+    ANTHROPIC_BASE_URL,
+    CLAUDE_MODEL,
+    EXTRACTION_PROMPT_VERSION,
+    build_extraction_request,
+    get_async_client,
+    is_service_failure,
+    parse_extraction_text,
+    output_truncated_error,
+    is_output_truncated,
+    extract_with_bisection,
+    extract_transactions_async,
+    cost_from_usage,
+    merge_chunk_results,
+    strip_api_cost,
+    with_chunk_cache_stats
+)
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_BATCHES_URL = f"{ANTHROPIC_BASE_URL}/v1/messages/batches"
+MESSAGE_BATCH_MAX_REQUESTS = int(os.getenv("MESSAGE_BATCH_MAX_REQUESTS", "10000"))  # Requests per submission
+MESSAGE_BATCH_POLL_SECONDS = float(os.getenv("MESSAGE_BATCH_POLL_SECONDS", "60"))
+MESSAGE_BATCH_MAX_WAIT_SECONDS = float(os.getenv("MESSAGE_BATCH_MAX_WAIT_SECONDS", "86400"))
+
+BATCH_REQUEST_TIMEOUT = httpx.Timeout(connect=30.0, read=120.0, write=120.0, pool=30.0)
+
+async def submit_message_batch(headers: Dict[str, str], requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Create a message batch; returns the batch object
+
+    Not retried: after a timeout the batch may have been created anyway,
+    and a second submission would be billed again.
+    """
+    client = get_async_client()
+    response = await client.post(MESSAGE_BATCHES_URL, headers=headers, json={"requests": requests}, timeout=BATCH_REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f"Message batch submission failed ({response.status_code}): {response.text[:500]}")
+    return response.json()
+
+async def wait_for_message_batch(headers: Dict[str, str], batch_id: str) -> Dict[str, Any]:
+    """Poll a message batch until its processing has ended; returns the final batch object"""
+    client = get_async_client()
+    waited = 0.0
+
+    while True:
+        try:
+            response = await client.get(f"{MESSAGE_BATCHES_URL}/{batch_id}", headers=headers, timeout=BATCH_REQUEST_TIMEOUT)
+            response.raise_for_status()
+            batch = response.json()
+        except httpx.TransportError as e:
+            # Status checks are safe to repeat; try again at the next poll
+            logger.warning(f"Polling message batch {batch_id} failed: {str(e)}")
+            batch = {"processing_status": "unknown"}
+        except httpx.HTTPStatusError as e:
+            if not (e.response.status_code == 429 or is_service_failure(e.response.status_code)):
+                raise
+            logger.warning(f"Polling message batch {batch_id} returned {e.response.status_code}")
+            batch = {"processing_status": "unknown"}
+
+        if batch.get("processing_status") == "ended":
+            logger.info(f"Message batch {batch_id} ended: {batch.get('request_counts')}")
+            return batch
+
+        if waited >= MESSAGE_BATCH_MAX_WAIT_SECONDS:
+            raise TimeoutError(f"Message batch {batch_id} still {batch.get('processing_status')} after {waited:.0f} seconds")
+
+        logger.info(f"Message batch {batch_id} is {batch.get('processing_status')}: {batch.get('request_counts')}")
+        await asyncio.sleep(MESSAGE_BATCH_POLL_SECONDS)
+        waited += MESSAGE_BATCH_POLL_SECONDS
+
+async def fetch_message_batch_results(headers: Dict[str, str], batch: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Download an ended batch's JSONL results, keyed by custom_id"""
+    client = get_async_client()
+    results_url = batch.get("results_url") or f"{MESSAGE_BATCHES_URL}/{batch['id']}/results"
+    response = await client.get(results_url, headers=headers, timeout=BATCH_REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    results = {}
+    for line in response.text.splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            results[entry["custom_id"]] = entry["result"]
+    return results
+
+def parse_batch_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn one batch result entry into an extraction result (batch-priced)"""
+    if result.get("type") != "succeeded":
+        error = result.get("error", {}).get("error", {}).get("message") or result.get("type", "unknown")
+        return {"error": f"Batch request {result.get('type')}: {error}"}
+
+    message = result["message"]
+    raw_text = message["content"][0]["text"]
+    cost_data = cost_from_usage(message.get("usage", {}), batch=True)
+    if message.get("stop_reason") == "max_tokens":
+        logger.warning(f"Batch response hit max_tokens after {len(raw_text)} characters; output is incomplete")
+        return output_truncated_error(cost_data)
+    return parse_extraction_text(raw_text, cost_data)
+
+async def extract_statements_batch(statements: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Extract transactions from many statements via the Message Batches API
+
+    statements maps an identifier to statement text; the returned dict maps
+    the same identifiers to results shaped like those of
+    extract_transactions_chunked_async. Chunks found in the chunk cache are
+    not resubmitted.
+    """
+    cache = get_chunk_cache()
+    chunk_results: Dict[str, List[Any]] = {}
+    pending: List[Tuple[str, int, Dict[str, Any], str, Dict[str, Any]]] = []  # (statement id, chunk index, chunk, cache key, request)
+    headers = None
+
+    for n, (statement_id, text) in enumerate(statements.items()):
+        chunks = split_text_into_chunks(text)
+        chunk_results[statement_id] = [None] * len(chunks)
+
+        for i, chunk in enumerate(chunks):
+            headers, data, processed_text = build_extraction_request(chunk["text"], chunk["max_tokens"])
+            cache_key = ExtractionCache.make_key(processed_text, CLAUDE_MODEL, EXTRACTION_PROMPT_VERSION)
+            cached = await asyncio.to_thread(cache.get, cache_key) if cache else None
+            if cached is not None:
+                chunk_results[statement_id][i] = with_chunk_cache_stats(cached, hit=True)
+                continue
+            # custom_id only allows [a-zA-Z0-9_-], so statement ids are mapped by position
+            pending.append((statement_id, i, chunk, cache_key, {"custom_id": f"s{n}-c{i}", "params": data}))
+
+    logger.info(f"Submitting {len(pending)} chunks from {len(statements)} statements as message batches")
+
+    for start in range(0, len(pending), MESSAGE_BATCH_MAX_REQUESTS):
+        group = pending[start:start + MESSAGE_BATCH_MAX_REQUESTS]
+        try:
+            batch = await submit_message_batch(headers, [request for _, _, _, _, request in group])
+            logger.info(f"Created message batch {batch['id']} with {len(group)} requests")
+            batch = await wait_for_message_batch(headers, batch["id"])
+            results = await fetch_message_batch_results(headers, batch)
+        except Exception as e:
+            logger.error(f"Message batch failed: {str(e)}")
+            results = {}
+            for _, _, _, _, request in group:
+                results[request["custom_id"]] = {"type": "errored", "error": {"error": {"message": str(e)}}}
+
+        for statement_id, i, chunk, cache_key, request in group:
+            result = parse_batch_result(results.get(request["custom_id"], {"type": "missing"}))
+            if is_output_truncated(result):
+                # Waiting for another batch would take hours; the halves go through the regular API
+                result = await extract_with_bisection(chunk["text"], chunk["max_tokens"], extract_transactions_async, result=result)
+            # A bisected chunk whose halves partly failed is incomplete and not cached
+            if cache and "error" not in result and not result.get("failed_chunks"):
+                await asyncio.to_thread(cache.set, cache_key, strip_api_cost(result))
+            chunk_results[statement_id][i] = with_chunk_cache_stats(result, hit=False)
+
+    extracted = {}
+    for statement_id, results in chunk_results.items():
+        if len(results) == 1:
+            extracted[statement_id] = results[0]
+        elif all("error" in result for result in results):
+            extracted[statement_id] = results[0]
+        else:
+            # Pricing is "mixed" when truncated chunks were re-extracted at standard rates
+            extracted[statement_id] = merge_chunk_results(results)
+
+    return extracted
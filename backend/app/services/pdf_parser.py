@@ -1,81 +1,348 @@
+import os
 import fitz
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 
 logger = logging.getLogger(__name__)
 
-def pdf_to_text(filepath, password=None):
+# Documents with at least this many pages are parsed by a pool of processes
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "10"))  # Page range handed to one worker at a time
+
+def open_pdf(source, password=None):
     """
-    Enhanced PDF text extraction with better handling of bank statement formats
+    Open a PDF from a file path or from its bytes (without touching disk;
+    a memoryview, e.g. of a spooled upload, is not copied) and authenticate
+    it if it is password protected
     """
-    doc = fitz.open(filepath)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
     
     # Handle password protection
     if doc.needs_pass:
         if not password:
+            doc.close()
             raise ValueError("PDF is password protected but no password provided")
         if not doc.authenticate(password):
+            doc.close()
             raise ValueError("Wrong password provided for PDF")
     
-    full_text = ""
+    return doc
+
+def pdf_to_text(source, password=None, progress=None):
+    """
+    Enhanced PDF text extraction with better handling of bank statement formats
     
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        
-        # Extract text using different methods to catch more content
-        try:
-            # Method 1: Standard text extraction
-            text1 = page.get_text()
-            
-            # Method 2: Text extraction with layout preservation
-            text2 = page.get_text("text", sort=True)
-            
-            # Method 3: Extract text blocks with position info
-            blocks = page.get_text("dict")
-            block_text = ""
-            
-            for block in blocks["blocks"]:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        line_text = ""
-                        for span in line["spans"]:
-                            line_text += span["text"]
-                        if line_text.strip():
-                            block_text += line_text + "\n"
-            
-            # Choose the most comprehensive text
-            page_text = ""
-            if len(text2) > len(text1) and len(text2) > len(block_text):
-                page_text = text2
-            elif len(block_text) > len(text1):
-                page_text = block_text
-            else:
-                page_text = text1
-            
-            # Clean up the text
-            page_text = clean_extracted_text(page_text)
-            
-            full_text += f"\n--- PAGE {page_num + 1} ---\n"
-            full_text += page_text + "\n"
-            
-            logger.info(f"Page {page_num + 1}: Extracted {len(page_text)} characters")
-            
-        except Exception as e:
-            logger.error(f"Error extracting text from page {page_num + 1}: {e}")
-            # Fallback to basic extraction
-            try:
-                basic_text = page.get_text()
-                full_text += f"\n--- PAGE {page_num + 1} (FALLBACK) ---\n"
-                full_text += basic_text + "\n"
-            except Exception as e2:
-                logger.error(f"Fallback extraction also failed for page {page_num + 1}: {e2}")
+    source is a file path, the PDF's bytes or an already open (and
+    authenticated) fitz.Document, which is left open for the caller.
+    Returns every page's text after a "--- PAGE N ---" marker; see
+    iter_pdf_pages for page-by-page extraction.
     
-    doc.close()
+    progress, if given, is called as progress("pdf_parsing", "page_parsed", ...)
+    after each page.
+    """
+    full_text = "".join(format_page(page_number, text) for page_number, text in iter_pdf_pages(source, password, progress))
     
     logger.info(f"Total extracted text length: {len(full_text)} characters")
     logger.info(f"First 500 characters: {full_text[:500]}")
     
     return full_text
 
+def format_page(page_number, text):
+    """A page's text preceded by its marker, as it appears in pdf_to_text's output"""
+    return f"\n--- PAGE {page_number} ---\n{text}\n"
+
+def iter_pdf_pages(source, password=None, progress=None):
+    """
+    Yield (page_number, cleaned_text) for every page, in page order, as soon
+    as the page has been extracted, so consumers can start on early pages
+    while later ones are still being parsed
+    
+    source is as for pdf_to_text. Documents of PDF_PARALLEL_MIN_PAGES pages
+    or more are split into page ranges parsed in a process pool; the pages
+    are the same either way.
+    """
+    owned = not isinstance(source, fitz.Document)
+    doc = open_pdf(source, password) if owned else source
+    page_count = len(doc)
+    next_page = 0
+    
+    try:
+        if page_count >= PDF_PARALLEL_MIN_PAGES and PDF_PARSE_WORKERS > 1:
+            try:
+                for page_text in iter_pages_parallel(doc, password, progress):
+                    next_page += 1
+                    yield next_page, page_text
+            except BrokenProcessPool as e:
+                logger.warning(f"Parallel PDF parsing failed ({e}), parsing the remaining pages in-process")
+        
+        for page_num in range(next_page, page_count):
+            yield page_num + 1, extract_page(doc, page_num, progress)
+    finally:
+        if owned:
+            doc.close()
+
+def extract_page(doc, page_num, progress=None):
+    """
+    Cleaned text of one page (0-based page_num)
+    """
+    page = doc.load_page(page_num)
+    
+    # Reading order is kept unless the layout-sorted text recovers more
+    # (e.g. table rows that the PDF stores column by column)
+    try:
+        plain_text, sorted_text = extract_page_texts(page)
+        page_text = sorted_text if len(sorted_text) > len(plain_text) else plain_text
+        
+        # Clean up the text
+        page_text = clean_extracted_text(page_text)
+        
+        logger.info(f"Page {page_num + 1}: Extracted {len(page_text)} characters")
+        
+        if progress is not None:
+            progress("pdf_parsing", "page_parsed", page=page_num + 1, pages=len(doc), characters=len(page_text))
+        
+        return page_text
+        
+    except Exception as e:
+        logger.error(f"Error extracting text from page {page_num + 1}: {e}")
+        # Fallback to basic extraction
+        try:
+            return page.get_text()
+        except Exception as e2:
+            logger.error(f"Fallback extraction also failed for page {page_num + 1}: {e2}")
+            return ""
+
+def extract_page_range(source, password, start, end):
+    """
+    Process pool task: return the texts of pages [start, end) of the
+    document at source, a file path or the name and size of a shared memory
+    block holding the PDF's bytes
+    """
+    doc = worker_document(source, password)
+    return [extract_page(doc, page_num) for page_num in range(start, end)]
+
+# Document this pool worker opened last: (source, password, doc, shared memory block, view of its bytes)
+_worker_document = None
+
+def worker_document(source, password):
+    """
+    Open source in a pool worker, once per document: the worker's later
+    tasks for the same source reuse it. Shared memory is mapped, not copied,
+    and stays mapped until the worker is handed a different document.
+    """
+    global _worker_document
+    if _worker_document is not None and _worker_document[:2] == (source, password):
+        return _worker_document[2]
+    release_worker_document()
+    
+    block = view = None
+    try:
+        if isinstance(source, tuple):
+            name, size = source
+            block = shared_memory.SharedMemory(name=name)
+            view = block.buf[:size]
+            doc = open_pdf(view, password)
+        else:
+            doc = open_pdf(source, password)
+    except Exception:
+        if view is not None:
+            view.release()
+        if block is not None:
+            block.close()
+        raise
+    
+    _worker_document = (source, password, doc, block, view)
+    return doc
+
+def release_worker_document():
+    """Close the worker's cached document and unmap its shared memory"""
+    global _worker_document
+    if _worker_document is None:
+        return
+    _, _, doc, block, view = _worker_document
+    _worker_document = None
+    doc.close()
+    if view is not None:
+        # The block can only be closed once no view of its buffer is exported
+        view.release()
+        block.close()
+
+_process_pool = None
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn: forking a process that runs threads and an event loop isn't safe
+        _process_pool = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+def iter_pages_parallel(doc, password, progress=None):
+    """
+    Page texts of the whole document, parsed in page ranges across the
+    process pool and yielded in page order as soon as each next page is in
+
+    Documents opened from memory reach the workers through one shared
+    memory block that each worker maps and opens once (see
+    worker_document) rather than a copy per task.
+    """
+    global _process_pool
+    page_count = len(doc)
+    logger.info(f"Parsing {page_count} pages with {PDF_PARSE_WORKERS} processes")
+    
+    block = None
+    if doc.name:
+        source = doc.name
+    else:
+        block = shared_memory.SharedMemory(create=True, size=len(doc.stream))
+        block.buf[:len(doc.stream)] = doc.stream
+        source = (block.name, len(doc.stream))
+    
+    pool = get_process_pool()
+    futures = {}
+    pages = {}  # Finished pages waiting for their predecessors
+    next_page = 0
+    try:
+        futures = {
+            pool.submit(extract_page_range, source, password, start, min(start + PDF_PAGES_PER_TASK, page_count)): start
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        }
+        
+        for future in as_completed(futures):
+            start = futures[future]
+            for offset, page_text in enumerate(future.result()):
+                pages[start + offset] = page_text
+                if progress is not None:
+                    progress("pdf_parsing", "page_parsed", page=start + offset + 1, pages=page_count, characters=len(page_text))
+            while next_page in pages:
+                yield pages.pop(next_page)
+                next_page += 1
+    except BrokenProcessPool:
+        # A crashed worker breaks the whole pool; the next document gets a new one
+        pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+        raise
+    finally:
+        # Consumers may stop early; ranges not started yet are dropped
+        for future in futures:
+            future.cancel()
+        if block:
+            block.close()
+            block.unlink()
+
+def extract_page_texts(page, tolerance=3):
+    """
+    Plain and layout-sorted text of a page from a single text extraction
+
+    MuPDF analyses the page once into a TextPage; the plain text and its
+    words are read from it, and the sorted text is rebuilt from the words.
+    The result matches page.get_text("text", sort=True), whose own
+    implementation builds a second TextPage and a Rect object per word.
+    """
+    textpage = page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+    plain_text = textpage.extractText()
+    words = textpage.extractWORDS()
+    return plain_text, sorted_text_from_words(words, tolerance)
+
+def _is_empty(rect):
+    return rect[0] >= rect[2] or rect[1] >= rect[3]
+
+def _include(rect, other):
+    """Extend rect (a mutable [x0, y0, x1, y1]) to include other, like Rect.include_rect"""
+    if _is_empty(other):
+        return
+    if _is_empty(rect):
+        rect[:] = other[:4]
+        return
+    rect[0] = min(rect[0], other[0])
+    rect[1] = min(rect[1], other[1])
+    rect[2] = max(rect[2], other[2])
+    rect[3] = max(rect[3], other[3])
+
+def sorted_text_from_words(words, tolerance=3):
+    """
+    Text in reading sequence from word tuples (x0, y0, x1, y1, text, ...),
+    simulating the horizontal and vertical layout with spaces and blank lines
+
+    Follows PyMuPDF's get_sorted_text step by step, with plain floats
+    instead of Rect objects, so the output is identical.
+    """
+    if not words:
+        return ""
+
+    # Words line-wise, forgiving small vertical deviations
+    words = sorted(words, key=lambda w: (w[3], w[0]))
+    ordered = []
+    line = [words[0]]
+    lrect = list(words[0][:4])
+    for w in words[1:]:
+        if abs(w[1] - lrect[1]) <= tolerance or abs(w[3] - lrect[3]) <= tolerance:
+            line.append(w)
+            _include(lrect, w)
+        else:
+            line.sort(key=lambda w: w[0])
+            ordered.extend(line)
+            line = [w]
+            lrect = list(w[:4])
+    line.sort(key=lambda w: w[0])
+    ordered.extend(line)
+
+    words = [(w[:4], w[4]) for w in ordered]
+    totalbox = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+    for rect, _ in words:
+        _include(totalbox, rect)
+
+    def line_text(line):
+        # Distance from the previous word becomes a number of spaces
+        line.sort(key=lambda w: w[0][0])
+        text = ""
+        x1 = totalbox[0]
+        for rect, word in line:
+            width = max(0, rect[2] - rect[0])
+            dist = max(
+                int(round((rect[0] - x1) / width * len(word))),
+                0 if (x1 == totalbox[0] or rect[0] <= x1) else 1,
+            )
+            text += " " * dist + word
+            x1 = rect[2]
+        return text
+
+    lines = []
+    line = [words[0]]
+    lrect = list(words[0][0])
+    for rect, word in words[1:]:
+        if abs(lrect[1] - rect[1]) <= tolerance or abs(lrect[3] - rect[3]) <= tolerance:
+            line.append((rect, word))
+            _include(lrect, rect)
+        else:
+            lines.append((lrect, line_text(line)))
+            line = [(rect, word)]
+            lrect = list(rect)
+    lines.append((lrect, line_text(line)))
+
+    # Lines top to bottom, vertical gaps as (at most 5) blank lines
+    lines.sort(key=lambda l: l[0][3])
+    text = lines[0][1]
+    y1 = lines[0][0][3]
+    for lrect, ltext in lines[1:]:
+        height = max(0, lrect[3] - lrect[1])
+        distance = min(int(round((lrect[1] - y1) / height)), 5)
+        text += "\n" * (distance + 1) + ltext
+        y1 = lrect[3]
+    return text
+
 def clean_extracted_text(text):
     """
     Clean and normalize extracted text for better processing
@@ -0,0 +1,127 @@
+"""
+Progress events for statement processing, streamed to clients as SSE
+
+Pipeline stages report progress through a plain callback,
+progress(stage, status, **details). The callback may be invoked from worker
+threads (PDF parsing and validation run via asyncio.to_thread), so
+ProgressChannel hands every event to its event loop thread-safely.
+"""
+import json
+import time
+import asyncio
+import threading
+from typing import Dict, Any, List, AsyncIterator, Optional, Callable, Tuple
+
+# Statuses that change a stage's state; anything else is an intermediate
+# event (page_parsed, chunk_started, ...) that only adds details
+STAGE_STATUSES = {"pending", "running", "completed", "failed", "skipped"}
+
+SSE_KEEPALIVE_SECONDS = 15
+
+# Stop proxies from buffering or caching event streams
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+class ProgressChannel:
+    """
+    Ordered, replayable log of progress events that any number of
+    subscribers can stream from while processing is underway
+    """
+
+    def __init__(self, on_event: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.loop = asyncio.get_running_loop()
+        self.on_event = on_event  # Called on the loop thread for every event
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def __call__(self, stage: str, status: str, **details):
+        event = {"stage": stage, "status": status, "time": time.time(), **details}
+        self.loop.call_soon_threadsafe(self._append, event)
+
+    def publish(self, event: Dict[str, Any]):
+        """Append a ready-made event (e.g. the final result) from the loop thread"""
+        # Scheduled rather than appended directly so it lands after any
+        # progress events that are still queued
+        self.loop.call_soon(self._append, dict({"time": time.time()}, **event))
+
+    def close(self):
+        """Mark the log complete; call from the loop thread after the last event"""
+        self.loop.call_soon(self._close)
+
+    def _append(self, event: Dict[str, Any]):
+        self.events.append(event)
+        if self.on_event:
+            self.on_event(event)
+        self._changed.set()
+
+    def _close(self):
+        self.closed = True
+        self._changed.set()
+
+    async def stream(self, start: int = 0, keepalive: Optional[float] = SSE_KEEPALIVE_SECONDS) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield events from index start onwards until the channel is closed
+
+        Yields None when nothing happened for keepalive seconds, so SSE
+        responses can send a comment to keep idle connections open.
+        """
+        position = start
+        while True:
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            if self.closed:
+                return
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+class ProgressFanout:
+    """
+    Progress callback that forwards every event to all subscribed callbacks
+
+    Subscribers that join late first get the events published so far, in
+    order. The fanout is truthy only while it has subscribers, so extraction
+    streams Claude's output only when someone is listening.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[str, str, Dict[str, Any]]] = []
+        self.subscribers: List[Callable[..., None]] = []
+        # Events arrive from worker threads; dispatching under the lock keeps every subscriber's order
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, status: str, **details):
+        with self._lock:
+            self.events.append((stage, status, details))
+            for callback in self.subscribers:
+                callback(stage, status, **details)
+
+    def __bool__(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, callback: Callable[..., None]):
+        """Replay the events so far to callback, then forward new ones"""
+        with self._lock:
+            for stage, status, details in self.events:
+                callback(stage, status, **details)
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[..., None]):
+        with self._lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+def format_sse(event: Optional[Dict[str, Any]]) -> str:
+    """Encode an event as a server-sent event; None becomes a keepalive comment"""
+    if event is None:
+        return ": keepalive\n\n"
+    event_type = "result" if event.get("stage") == "result" else "progress"
+    return f"event: {event_type}\ndata: {json.dumps(event, default=str)}\n\n"
+
+async def sse_events(channel: ProgressChannel) -> AsyncIterator[str]:
+    """Server-sent event stream of a channel, from its first event"""
+    async for event in channel.stream():
+        yield format_sse(event)
@@ -0,0 +1,177 @@
+"""
+Process-wide (and cross-worker) rate limiting for Claude API calls
+
+Token buckets for requests, input tokens and output tokens per minute live in
+a small SQLite database, so every uvicorn worker on the host draws from the
+same budget. Calls wait for capacity instead of failing, and a server
+retry-after hint pauses all callers until it has passed.
+"""
+import os
+import math
+import time
+import random
+import sqlite3
+import asyncio
+import tempfile
+import logging
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# Off by default: the limits below must match the API key's rate limit tier
+# (the defaults are tier 1), or they throttle calls the account could make
+RATE_LIMIT_ENABLED = os.getenv("CLAUDE_RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_PATH = os.getenv("CLAUDE_RATE_LIMIT_PATH", os.path.join(tempfile.gettempdir(), "bank_statement_rate_limit.sqlite3"))
+RATE_LIMIT_RPM = int(os.getenv("CLAUDE_RATE_LIMIT_RPM", "50"))
+RATE_LIMIT_INPUT_TPM = int(os.getenv("CLAUDE_RATE_LIMIT_INPUT_TPM", "40000"))
+RATE_LIMIT_OUTPUT_TPM = int(os.getenv("CLAUDE_RATE_LIMIT_OUTPUT_TPM", "8000"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("CLAUDE_RATE_LIMIT_MAX_WAIT_SECONDS", "300"))  # Longest a call queues before trying anyway
+
+PAUSE_KEY = "retry_after_until"
+
+class RateLimiter:
+    """
+    Token buckets shared through SQLite
+
+    Each bucket holds at most one minute of budget and refills continuously.
+    A call reserves one request plus its estimated input and output tokens;
+    the estimate is corrected with the real usage once the response arrives.
+    """
+
+    def __init__(self, limits: Dict[str, int], path: str = RATE_LIMIT_PATH):
+        self.limits = {name: limit for name, limit in limits.items() if limit > 0}
+        self.path = path
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_state ("
+                "key TEXT PRIMARY KEY, value REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None so BEGIN IMMEDIATE controls the transaction
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _levels(self, conn: sqlite3.Connection, now: float) -> Dict[str, float]:
+        """Current bucket levels, refilled up to now"""
+        stored = {key: (value, updated_at) for key, value, updated_at in conn.execute("SELECT key, value, updated_at FROM rate_limit_state")}
+        levels = {}
+        for name, limit in self.limits.items():
+            level, updated_at = stored.get(name, (limit, now))
+            levels[name] = min(limit, level + (now - updated_at) * limit / 60.0)
+        return levels
+
+    def _save(self, conn: sqlite3.Connection, levels: Dict[str, float], now: float) -> None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO rate_limit_state (key, value, updated_at) VALUES (?, ?, ?)",
+            [(name, level, now) for name, level in levels.items()]
+        )
+
+    def try_acquire(self, costs: Dict[str, float]) -> float:
+        """
+        Reserve costs if every bucket has room; returns 0 on success or the
+        number of seconds to wait before trying again
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value FROM rate_limit_state WHERE key = ?", (PAUSE_KEY,)).fetchone()
+                if row and row[0] > now:
+                    conn.execute("COMMIT")
+                    return row[0] - now
+
+                levels = self._levels(conn, now)
+                wait = 0.0
+                for name, level in levels.items():
+                    # A single call larger than the bucket only needs a full bucket
+                    cost = min(costs.get(name, 0), self.limits[name])
+                    if cost > level:
+                        wait = max(wait, (cost - level) * 60.0 / self.limits[name])
+
+                if wait == 0:
+                    for name in levels:
+                        levels[name] -= min(costs.get(name, 0), self.limits[name])
+                self._save(conn, levels, now)
+                conn.execute("COMMIT")
+                return wait
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def adjust(self, deltas: Dict[str, float]) -> None:
+        """Return (positive) or take (negative) budget once real usage is known"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = self._levels(conn, now)
+            for name, delta in deltas.items():
+                if name in levels:
+                    levels[name] = min(self.limits[name], levels[name] + delta)
+            self._save(conn, levels, now)
+            conn.execute("COMMIT")
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller (in all workers) back for seconds, e.g. after a 429 retry-after"""
+        until = time.time() + seconds
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO rate_limit_state (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value), updated_at = excluded.updated_at",
+                (PAUSE_KEY, until, time.time())
+            )
+        logger.warning(f"Claude calls paused for {seconds:.1f}s (server retry hint)")
+
+    async def acquire(self, costs: Dict[str, float], max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS) -> float:
+        """
+        Wait until costs fit in the buckets and reserve them; returns the
+        seconds spent waiting. After max_wait the call proceeds regardless and
+        relies on the API's own 429 handling.
+        """
+        waited = 0.0
+        while True:
+            try:
+                wait = await asyncio.to_thread(self.try_acquire, costs)
+            except Exception as e:
+                logger.warning(f"Rate limiter unavailable, proceeding without it: {str(e)}")
+                return waited
+            if wait == 0:
+                if waited:
+                    logger.info(f"Rate limiter queued call for {waited:.1f}s")
+                return waited
+            if waited >= max_wait:
+                logger.warning(f"Rate limiter wait exceeded {max_wait:.0f}s, sending call anyway")
+                return waited
+            # Jitter keeps queued callers from all retrying in the same instant
+            delay = min(wait, max_wait - waited) + random.uniform(0, 0.25)
+            await asyncio.sleep(delay)
+            waited += delay
+
+def request_costs(input_tokens: float, output_tokens: float) -> Dict[str, float]:
+    """Bucket costs of one call"""
+    return {"requests": 1, "input_tokens": input_tokens, "output_tokens": output_tokens}
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Seconds from a retry-after header (numeric form), or None"""
+    value = headers.get("retry-after")
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if math.isfinite(seconds) and seconds >= 0 else None
+
+_rate_limiter = None
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Return the process-wide rate limiter, or None when rate limiting is disabled"""
+    global _rate_limiter
+    if not RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter({
+            "requests": RATE_LIMIT_RPM,
+            "input_tokens": RATE_LIMIT_INPUT_TPM,
+            "output_tokens": RATE_LIMIT_OUTPUT_TPM
+        })
+    return _rate_limiter
@@ -0,0 +1,81 @@
+"""
+In-flight request coalescing ("single flight")
+
+Concurrent callers asking for the same key share one running task instead
+of each starting their own; the entry is dropped as soon as the task
+finishes, so later calls start fresh (the extraction cache covers those).
+Every caller can listen to the shared task's progress events.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, Callable, Awaitable, Tuple, Optional
+
+from app.services.progress import ProgressFanout
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """Deduplicates concurrent async calls by key"""
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.progress: Dict[str, ProgressFanout] = {}
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[ProgressFanout], Awaitable[Any]],
+        progress: Optional[Callable[..., None]] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Await factory(fanout) or the identical call already in flight
+
+        factory reports progress to the fanout, which forwards it to the
+        progress callback of every caller waiting on the task (replaying
+        earlier events to callers that join late). Returns (result, shared)
+        where shared is True if this caller joined another caller's task.
+        The task is shielded, so one caller going away doesn't cancel it for
+        the others.
+        """
+        task = self.inflight.get(key)
+        shared = task is not None
+
+        if task is None:
+            fanout = ProgressFanout()
+            task = asyncio.ensure_future(factory(fanout))
+            self.inflight[key] = task
+            self.progress[key] = fanout
+            task.add_done_callback(lambda _: self._finish(key))
+        else:
+            logger.info(f"Joining in-flight request {key[:12]}... ({len(self.inflight)} in flight)")
+
+        fanout = self.progress[key]
+        if progress:
+            fanout.subscribe(progress)
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            if progress:
+                fanout.unsubscribe(progress)
+
+    def _finish(self, key: str):
+        self.inflight.pop(key, None)
+        self.progress.pop(key, None)
+
+def upload_fingerprint(content: bytes, filename: Optional[str], password: Optional[str]) -> str:
+    """Key for an upload: identical bytes, filename and password give an identical response"""
+    digest = hashlib.sha256()
+    digest.update(content)
+    for part in (filename or "", password or ""):
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+_upload_single_flight = None
+
+def get_upload_single_flight() -> SingleFlight:
+    global _upload_single_flight
+    if _upload_single_flight is None:
+        _upload_single_flight = SingleFlight()
+    return _upload_single_flight
@@ -0,0 +1,361 @@
+"""
+End-to-end processing of an uploaded bank statement PDF
+
+Shared by the synchronous upload endpoint and the background job workers:
+parse -> validate -> (cache) -> extract -> validate data -> CSV export.
+"""
+import copy
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Tuple, Callable, Optional, AsyncIterator
+
+from app.services.pdf_parser import iter_pdf_pages, format_page, open_pdf
+from app.services.validators import validate_bank_statement_pdf
+from app.services.claude import CLAUDE_MODEL, EXTRACTION_PROMPT_VERSION
+from app.services.extraction import extract_statement, extract_statement_early, can_dispatch_early
+from app.services.statement_templates import TEMPLATE_HEADER_CHARS
+from app.services.extraction_cache import get_extraction_cache, ExtractionCache
+from app.services.csv_export import CSVExportService
+from app.services.single_flight import get_upload_single_flight, upload_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages reported to progress callbacks, in order
+PIPELINE_STAGES = ["pdf_parsing", "validation", "extraction", "csv_export"]
+
+ProgressCallback = Callable[..., None]
+
+def _no_progress(stage: str, status: str, **details) -> None:
+    pass
+
+async def parse_statement_pages(
+    doc,
+    password: Optional[str],
+    progress: ProgressCallback,
+    listener: Optional[ProgressCallback] = None
+) -> Tuple[str, Optional[asyncio.Task]]:
+    """
+    Parse every page of doc in a worker thread; returns the full text (as
+    pdf_to_text would) and, if can_dispatch_early accepts the statement
+    header (decided once TEMPLATE_HEADER_CHARS characters are parsed), the
+    extract_statement_early task that has been chunking and extracting the
+    pages while the rest of the document was parsed
+
+    listener is the caller's own progress callback, or None; only that is
+    passed to the extraction, which streams Claude's output when there is
+    someone to report it to. The task is cancelled if parsing fails;
+    otherwise the caller must await or cancel it.
+    """
+    loop = asyncio.get_running_loop()
+    parsed: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def parse():
+        # Pages (then None, or the exception that ended parsing) are handed to the event loop as they come
+        try:
+            for page in iter_pdf_pages(doc, password, progress):
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(parsed.put_nowait, page)
+            loop.call_soon_threadsafe(parsed.put_nowait, None)
+        except Exception as e:
+            loop.call_soon_threadsafe(parsed.put_nowait, e)
+
+    async def pages_for(queue: asyncio.Queue) -> AsyncIterator[Tuple[int, str]]:
+        while (page := await queue.get()) is not None:
+            yield page
+
+    parser = loop.run_in_executor(None, parse)
+    parts = []
+    header_pages = []  # Pages parsed before early dispatch was decided
+    early_pages = None
+    early_extraction = None
+    try:
+        while (page := await parsed.get()) is not None:
+            if isinstance(page, Exception):
+                raise page
+            parts.append(format_page(*page))
+
+            if early_pages is not None:
+                early_pages.put_nowait(page)
+            elif header_pages is not None:
+                header_pages.append(page)
+                header = "".join(parts)
+                # Decide on the same window templates match, once it is complete
+                if len(header) >= TEMPLATE_HEADER_CHARS:
+                    if can_dispatch_early(header):
+                        logger.info("Dispatching extraction chunks while the remaining pages are parsed")
+                        progress("extraction", "running", early_dispatch=True)
+                        early_pages = asyncio.Queue()
+                        for header_page in header_pages:
+                            early_pages.put_nowait(header_page)
+                        early_extraction = asyncio.create_task(extract_statement_early(pages_for(early_pages), listener))
+                        # Cancelled speculation may have failed first; its error is not needed
+                        early_extraction.add_done_callback(lambda task: task.cancelled() or task.exception())
+                    header_pages = None
+
+        if early_pages is not None:
+            early_pages.put_nowait(None)
+        await parser
+    except BaseException:
+        stop.set()
+        if early_extraction:
+            early_extraction.cancel()
+        raise
+
+    return "".join(parts), early_extraction
+
+async def process_statement_bytes(
+    content: bytes,
+    filename: str,
+    password: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None
+) -> Tuple[int, Dict[str, Any]]:
+    """
+    Run the full statement pipeline on uploaded PDF bytes
+
+    The document is opened once, from memory, and shared by the parser and
+    the validator; nothing is written to disk.
+
+    progress(stage, status, **details) is called as each stage starts
+    ("running") and ends ("completed", "failed" or "skipped"), and is passed
+    down to the parser, validator and extractor for intermediate events
+    (page_parsed, analyzed, chunk_started, chunk_finished). It may be called
+    from worker threads.
+
+    Returns (HTTP status code, response content).
+    """
+    # Extraction only gets a callback when someone listens (a ProgressFanout
+    # is falsy without subscribers), so uploads without one take the
+    # buffered (non-streamed) Claude calls
+    listener = progress
+    if progress is None:
+        progress = _no_progress
+
+    # Step 1: Extract text from PDF
+    progress("pdf_parsing", "running")
+    doc = None
+    try:
+        doc = await asyncio.to_thread(open_pdf, content, password)
+        text, early_extraction = await parse_statement_pages(doc, password, progress, listener)
+        logger.info(f"PDF parsing successful. Extracted text length: {len(text)} characters")
+        logger.info(f"First 200 characters of extracted text: {text[:200]}...")
+        progress("pdf_parsing", "completed", text_length=len(text))
+    except Exception as e:
+        logger.error(f"PDF parsing failed: {str(e)}")
+        progress("pdf_parsing", "failed", error=str(e))
+        if doc is not None:
+            doc.close()
+        return 400, {
+            "error": f"PDF parsing failed: {str(e)}",
+            "error_type": "pdf_parsing_error",
+            "suggestions": [
+                "Ensure the PDF is not corrupted",
+                "Check if the correct password was provided for protected PDFs",
+                "Try downloading the statement again from your bank"
+            ]
+        }
+
+    # Step 2: Validate that this is a bank statement
+    confidence = 1.0
+    progress("validation", "running")
+    try:
+        validation_result = await asyncio.to_thread(validate_bank_statement_pdf, doc, filename, text, progress)
+
+        if not validation_result["is_valid"]:
+            logger.warning(f"Bank statement validation failed: {validation_result['error']}")
+            if early_extraction:
+                early_extraction.cancel()
+            progress("validation", "failed", error=validation_result["error"])
+            return 400, {
+                "error": validation_result["error"],
+                "error_type": "invalid_bank_statement",
+                "confidence": validation_result.get("confidence", 0),
+                "analysis": validation_result.get("analysis", {}),
+                "suggestions": validation_result.get("suggestions", [])
+            }
+
+        confidence = validation_result.get("confidence", 1.0)
+        logger.info(f"Bank statement validation passed with confidence: {confidence}")
+        progress("validation", "completed", confidence=confidence)
+
+    except Exception as e:
+        logger.warning(f"Validation service error: {str(e)} - proceeding with extraction")
+        progress("validation", "skipped", error=str(e))
+    finally:
+        # Later stages only need the text
+        doc.close()
+
+    # Step 3: Serve repeated uploads from the extraction cache
+    cache = get_extraction_cache()
+    cache_key = ExtractionCache.make_key(text, CLAUDE_MODEL, EXTRACTION_PROMPT_VERSION)
+    if cache:
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached:
+            logger.info(f"Extraction cache hit for key {cache_key[:12]}...")
+            if early_extraction:
+                early_extraction.cancel()
+            cached["metadata"]["confidence"] = confidence
+            cached["metadata"]["cache"] = "hit"
+            progress("extraction", "completed", cache="hit")
+            progress("csv_export", "completed", cache="hit")
+            return 200, cached
+
+    # Step 4: Extract transactions (known layouts locally, otherwise Claude AI)
+    progress("extraction", "running")
+    try:
+        logger.info("Starting transaction extraction...")
+        data = await extract_statement(text, listener, early_extraction)
+
+        # Check if the extraction returned an error
+        if isinstance(data, dict) and "error" in data:
+            logger.error(f"Transaction extraction returned error: {data['error']}")
+            progress("extraction", "failed", error=data["error"])
+            return 500, {
+                "error": f"AI analysis failed: {data['error']}",
+                "error_type": "ai_analysis_error",
+                "suggestions": [
+                    "The document may contain unusual formatting",
+                    "Try a different bank statement format",
+                    "Contact support if the issue persists"
+                ]
+            }
+
+        if not (isinstance(data, dict) and "transactions" in data):
+            progress("extraction", "completed")
+            return 200, {"extracted": data}
+
+        # Log summary of extracted data
+        income_count = len(data["transactions"].get("income", []))
+        expense_count = len(data["transactions"].get("expenses", []))
+        logger.info(f"Transaction extraction successful! Found {income_count} income and {expense_count} expense transactions")
+        progress("extraction", "completed", transactions=income_count + expense_count)
+
+        # Validate data structure
+        validated_data = validate_extraction_data(data)
+
+        # Step 5: Generate CSV exports
+        progress("csv_export", "running")
+        try:
+            csv_service = CSVExportService()
+            csv_data = csv_service.export_all_data(validated_data)
+            logger.info("CSV export generation successful")
+            progress("csv_export", "completed")
+        except Exception as e:
+            logger.warning(f"CSV export failed: {str(e)} - continuing without CSV data")
+            csv_data = {}
+            progress("csv_export", "failed", error=str(e))
+
+        response_content = {
+            "success": True,
+            "extracted": validated_data,
+            "csv_exports": csv_data,
+            "metadata": {
+                "total_transactions": income_count + expense_count,
+                "income_transactions": income_count,
+                "expense_transactions": expense_count,
+                "processing_time": "Complete",
+                "confidence": confidence,
+                "cache": "miss",
+                "chunk_cache": data.get("chunk_cache", {}),
+                "extraction_path": data.get("extraction_path", "claude"),
+                "hybrid": data.get("hybrid"),
+                "compaction": data.get("compaction"),
+                "failed_chunks": data.get("failed_chunks", 0)
+            }
+        }
+
+        if data.get("failed_chunks"):
+            # Part of the statement is missing; retrying the upload should extract it again
+            logger.warning(f"{data['failed_chunks']} chunks failed; returning a partial result without caching it")
+            response_content["metadata"]["partial"] = True
+            response_content["metadata"]["chunk_errors"] = data.get("chunk_errors", [])
+        elif cache:
+            await asyncio.to_thread(cache.set, cache_key, response_content)
+
+        return 200, response_content
+
+    except Exception as e:
+        logger.error(f"Transaction extraction exception: {str(e)}")
+        progress("extraction", "failed", error=str(e))
+        return 500, {
+            "error": f"AI analysis failed: {str(e)}",
+            "error_type": "ai_processing_error",
+            "suggestions": [
+                "The document may be too complex for automatic processing",
+                "Ensure the PDF contains clear, readable text",
+                "Try uploading a simpler bank statement format"
+            ]
+        }
+
+async def process_statement_upload(
+    content: bytes,
+    filename: str,
+    password: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None
+) -> Tuple[int, Dict[str, Any]]:
+    """
+    process_statement_bytes with in-flight coalescing: identical uploads
+    (same bytes, filename and password) arriving while one is being
+    processed wait for that run instead of starting their own. Each caller
+    gets its own copy of the response; joined ones are marked "coalesced".
+    Every caller's progress callback receives the run's events, starting
+    with the ones published before it joined.
+    """
+    key = upload_fingerprint(content, filename, password)
+    (status_code, response), shared = await get_upload_single_flight().run(
+        key, lambda fanout: process_statement_bytes(content, filename, password, fanout), progress
+    )
+    
+    if not shared:
+        return status_code, response
+    
+    response = copy.deepcopy(response)
+    if isinstance(response.get("metadata"), dict):
+        response["metadata"]["coalesced"] = True
+    return status_code, response
+
+def validate_extraction_data(data):
+    """
+    Validate and ensure the extracted data has the correct structure
+    """
+    validated = {
+        "account_details": {
+            "name": data.get("account_details", {}).get("name", "Unknown"),
+            "account_number": data.get("account_details", {}).get("account_number", "Unknown"),
+            "currency": data.get("account_details", {}).get("currency", "LKR"),
+            "statement_date": data.get("account_details", {}).get("statement_date", "Unknown")
+        },
+        "final_balance": float(data.get("final_balance", 0)),
+        "transactions": {
+            "income": [],
+            "expenses": []
+        }
+    }
+    
+    # Validate income transactions
+    for transaction in data.get("transactions", {}).get("income", []):
+        if validate_transaction(transaction):
+            validated["transactions"]["income"].append(transaction)
+    
+    # Validate expense transactions
+    for transaction in data.get("transactions", {}).get("expenses", []):
+        if validate_transaction(transaction):
+            validated["transactions"]["expenses"].append(transaction)
+    
+    return validated
+
+def validate_transaction(transaction):
+    """
+    Validate individual transaction structure
+    """
+    return (
+        isinstance(transaction, dict) and
+        "date" in transaction and
+        "description" in transaction and
+        "amount" in transaction and
+        isinstance(transaction["amount"], (int, float)) and
+        transaction["amount"] > 0
+    )
+
@@ -0,0 +1,176 @@
+"""
+Rule-based parsers for known bank statement layouts
+
+Statements from banks with a fixed layout can be parsed locally into the
+same structure Claude returns, in milliseconds and at no cost. Each
+template recognises its statement header and reconciles every row against
+the running balance; if that check fails the caller falls back to Claude.
+"""
+import re
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+AMOUNT = r'[\d,]+\.\d{2}'
+
+# Templates recognize a statement from its header, within this many leading characters
+TEMPLATE_HEADER_CHARS = 3000
+
+def parse_amount(value: str) -> float:
+    """Convert a printed amount such as '1,234.50' to a float"""
+    return float(value.replace(',', ''))
+
+class StatementTemplate:
+    """Base class for a known statement layout"""
+
+    name = "base"
+
+    def matches(self, text: str) -> bool:
+        """Return True if the statement header identifies this layout"""
+        raise NotImplementedError
+
+    def parse(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Parse the statement into the extraction result structure, or return
+        None if the rows don't reconcile with the statement balances
+        """
+        raise NotImplementedError
+
+TEMPLATE_REGISTRY: List[StatementTemplate] = []
+
+def register_template(template_class):
+    """Class decorator that adds a template to the registry"""
+    TEMPLATE_REGISTRY.append(template_class())
+    return template_class
+
+@register_template
+class CommercialBankTemplate(StatementTemplate):
+    """
+    Commercial Bank of Ceylon account statements
+
+    Rows read "DDMMMYYYY [DDMMMYYYY] description amount balance"; the
+    statement has no separate debit/credit marker in extracted text, so the
+    direction of each row comes from the change in running balance.
+    """
+
+    name = "commercial_bank"
+
+    header_pattern = re.compile(r'COMMERCIAL\s+BANK', re.IGNORECASE)
+    account_number_pattern = re.compile(r'\b(\d{4}-\d{8}-\d{3})\b')
+    name_pattern = re.compile(r'^((?:MR|MRS|MS|MISS|DR|REV)\.?\s+[A-Z][A-Z .]+)$', re.MULTILINE)
+    currency_pattern = re.compile(r'\b(SRI LANKA RUPEES|LKR|US DOLLARS|USD)\b', re.IGNORECASE)
+    statement_date_pattern = re.compile(r'STATEMENT\s+DATE\s*:?\s*(\d{2}/\d{2}/\d{4})', re.IGNORECASE)
+    opening_pattern = re.compile(rf'(?:BALANCE\s+B/F|OPENING\s+BALANCE|BROUGHT\s+FORWARD)\D*?({AMOUNT})', re.IGNORECASE)
+    closing_pattern = re.compile(rf'(?:BALANCE\s+C/F|CLOSING\s+BALANCE|CARRIED\s+FORWARD)\D*?({AMOUNT})', re.IGNORECASE)
+    row_pattern = re.compile(
+        rf'^(\d{{2}}[A-Z]{{3}}\d{{4}})\s+(?:\d{{2}}[A-Z]{{3}}\d{{4}}\s+)?(.*?)\s*({AMOUNT})\s+({AMOUNT})(?:\s*(CR|DR))?$'
+    )
+    page_marker_pattern = re.compile(r'^--- PAGE \d+')
+    # Page furniture that can follow the last row on a page; never part of a description
+    footer_pattern = re.compile(
+        r'\bPAGE\s+\d+\s*(?:OF|/)\s*\d+|COMPUTER\s+GENERATED|END\s+OF\s+STATEMENT|\bCONTINUED\b|'
+        r'^(?:TXN\s+)?DATE\s+(?:VALUE\s+DATE\s+)?(?:DESCRIPTION|PARTICULARS|DETAILS)\b',
+        re.IGNORECASE
+    )
+    max_continuation_lines = 2  # Description lines allowed directly under a row
+
+    def matches(self, text: str) -> bool:
+        header = text[:TEMPLATE_HEADER_CHARS]
+        return bool(self.header_pattern.search(header) and self.account_number_pattern.search(header))
+
+    def parse(self, text: str) -> Optional[Dict[str, Any]]:
+        opening = self.opening_pattern.search(text)
+        if not opening:
+            logger.info(f"{self.name}: no opening balance found, cannot reconcile rows")
+            return None
+
+        balance = parse_amount(opening.group(1))
+        income = []
+        expenses = []
+        last = None  # Transaction on the row directly above, for multi-line descriptions
+        continuation_lines = 0
+
+        for line in text.split('\n'):
+            line = line.strip()
+            if not line or self.page_marker_pattern.match(line):
+                last = None
+                continue
+
+            row = self.row_pattern.match(line)
+            if not row:
+                # Continuation of the description of the row directly above
+                if (last is not None and continuation_lines < self.max_continuation_lines
+                        and not re.search(AMOUNT, line) and not self.footer_pattern.search(line)):
+                    last["description"] = f"{last['description']} {line}".strip()
+                    continuation_lines += 1
+                else:
+                    last = None
+                continue
+
+            date, description, amount_text, balance_text, _ = row.groups()
+            amount = parse_amount(amount_text)
+            new_balance = parse_amount(balance_text)
+            transaction = {"date": date, "description": description.strip(), "amount": amount, "reference": ""}
+
+            if abs(round(balance + amount, 2) - new_balance) < 0.005:
+                income.append(transaction)
+            elif abs(round(balance - amount, 2) - new_balance) < 0.005:
+                expenses.append(transaction)
+            else:
+                logger.info(f"{self.name}: row on {date} does not reconcile ({balance} -> {new_balance} with {amount})")
+                return None
+
+            balance = new_balance
+            last = transaction
+            continuation_lines = 0
+
+        if not income and not expenses:
+            return None
+
+        closing = self.closing_pattern.search(text)
+        if closing and abs(parse_amount(closing.group(1)) - balance) >= 0.005:
+            logger.info(f"{self.name}: closing balance {closing.group(1)} does not match running balance {balance}")
+            return None
+
+        return {
+            "account_details": self._account_details(text),
+            "final_balance": round(balance, 2),
+            "transactions": {
+                "income": income,
+                "expenses": expenses
+            }
+        }
+
+    def _account_details(self, text: str) -> Dict[str, str]:
+        def first(pattern: re.Pattern) -> str:
+            match = pattern.search(text)
+            return match.group(1).strip() if match else "Unknown"
+
+        currency = self.currency_pattern.search(text)
+        return {
+            "name": first(self.name_pattern),
+            "account_number": first(self.account_number_pattern),
+            "currency": currency.group(1).upper() if currency else "Unknown",
+            "statement_date": first(self.statement_date_pattern)
+        }
+
+def extract_with_templates(text: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Try each registered template whose header matches
+
+    Returns (template name, result) for the first template that parses and
+    reconciles the statement, or (None, None) if Claude is needed.
+    """
+    for template in TEMPLATE_REGISTRY:
+        try:
+            if not template.matches(text):
+                continue
+            logger.info(f"Statement matches template '{template.name}', parsing locally")
+            result = template.parse(text)
+            if result is not None:
+                return template.name, result
+            logger.info(f"Template '{template.name}' failed its balance check, falling back")
+        except Exception as e:
+            logger.warning(f"Template '{template.name}' raised an error: {str(e)}")
+    return None, None
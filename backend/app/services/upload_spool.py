@@ -0,0 +1,130 @@
+"""
+Bounded-memory ingestion of uploaded statements
+
+Request bodies on the upload routes are counted as they arrive and refused
+with 413 as soon as they pass the limit, whether or not the client sent a
+Content-Length, before the multipart parser has buffered them. Within
+that limit, Starlette's parser spools each file itself: in memory up to
+1MB, beyond that in an unlinked temporary file. Accepted files are
+memory-mapped straight from that spool file after checking their magic
+bytes and size, so a request neither copies the upload again nor holds it
+in Python memory; the mapping is handed to PyMuPDF without a copy.
+"""
+import os
+import io
+import mmap
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))  # Per file
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024  # Multipart boundaries, headers and small form fields
+
+PDF_MAGIC = b"%PDF-"
+ZIP_MAGIC = b"PK\x03\x04"
+PDF_HEADER_SEARCH_BYTES = 1024  # Readers accept a PDF header anywhere in the first 1KB
+
+class UploadRejectedError(Exception):
+    """Raised when an uploaded file is refused before processing"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+def has_pdf_header(data: bytes) -> bool:
+    return PDF_MAGIC in data[:PDF_HEADER_SEARCH_BYTES]
+
+def has_zip_header(data: bytes) -> bool:
+    return bytes(data[:len(ZIP_MAGIC)]) == ZIP_MAGIC
+
+def map_spooled_file(file) -> Optional[memoryview]:
+    """
+    Read-only mapping of an upload's spool file, or None while the
+    SpooledTemporaryFile still holds it in memory (asking for its fileno()
+    would write it to disk)
+    """
+    if not getattr(file, "_rolled", True):
+        return None
+    try:
+        fileno = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    if os.fstat(fileno).st_size == 0:
+        return memoryview(b"")
+    # The mapping stays valid after Starlette closes the (already unlinked) file
+    return memoryview(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ))
+
+async def spool_upload(upload: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES, allow_zip: bool = False) -> memoryview:
+    """
+    Check an uploaded PDF (or, with allow_zip, ZIP archive) and return a
+    read-only view of its contents
+
+    The magic bytes are checked first, then the size. Files the parser
+    spooled to disk are memory-mapped from their spool file; smaller ones
+    (at most 1MB) are read from memory.
+    """
+    first = await upload.read(PDF_HEADER_SEARCH_BYTES)
+    if not (has_pdf_header(first) or (allow_zip and has_zip_header(first))):
+        expected = "a PDF or ZIP file" if allow_zip else "a PDF file"
+        raise UploadRejectedError(f"{upload.filename} is not {expected}.", 400)
+
+    await upload.seek(0)
+    view = await asyncio.to_thread(map_spooled_file, upload.file)
+    if view is None:
+        view = memoryview(await upload.read())
+
+    if len(view) > max_bytes:
+        raise UploadRejectedError(
+            f"{upload.filename} is too large. Maximum allowed size is {max_bytes // (1024 * 1024)}MB.", 413
+        )
+
+    logger.info(f"Spooled {upload.filename}: {len(view)} bytes")
+    return view
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware refusing request bodies larger than max_bytes on the
+    given paths, before the multipart parser has buffered them
+
+    Bodies announced larger than the limit are refused immediately; bodies
+    without a Content-Length (chunked uploads) are counted as they are
+    received and refused as soon as they pass it.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits  # path -> max body bytes
+
+    async def __call__(self, scope, receive, send):
+        max_bytes: Optional[int] = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Upload too large. Maximum allowed request size is {max_bytes // (1024 * 1024)}MB."
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            logger.warning(f"Refused {scope['path']} upload of {int(content_length)} bytes (Content-Length)")
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    logger.warning(f"Refused {scope['path']} upload after {received} bytes")
+                    # Raised inside request parsing, so it is answered like any HTTPException
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
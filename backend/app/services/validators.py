@@ -3,7 +3,7 @@ Bank statement validation utilities for improved accuracy and security
 """
 import re
 import mimetypes
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Callable, Union
 import fitz  # PyMuPDF
 import logging
 
@@ -41,9 +41,12 @@ class BankStatementValidator:
             r'\d{4}-\d{2}-\d{2}',                # YYYY-MM-DD
         ]
 
-    def validate_file_type(self, file_path: str, filename: str) -> Tuple[bool, str]:
+    def validate_file_type(self, source: Union[str, fitz.Document], filename: str) -> Tuple[bool, str]:
         """
         Validate that the uploaded file is actually a PDF
+
+        source is the file path or the already opened document, which is
+        checked without opening the file again.
         """
         try:
             # Check MIME type
@@ -53,10 +56,14 @@ class BankStatementValidator:
             
             # Try to open with PyMuPDF to verify it's a valid PDF
             try:
-                doc = fitz.open(file_path)
-                if len(doc) == 0:
-                    return False, "PDF file appears to be empty"
-                doc.close()
+                if isinstance(source, fitz.Document):
+                    if source.is_closed or len(source) == 0:
+                        return False, "PDF file appears to be empty"
+                else:
+                    doc = fitz.open(source)
+                    if len(doc) == 0:
+                        return False, "PDF file appears to be empty"
+                    doc.close()
             except Exception as e:
                 return False, f"Invalid PDF file: {str(e)}"
             
@@ -166,17 +173,22 @@ class BankStatementValidator:
         
         return suggestions[:5]  # Limit to 5 most relevant suggestions
 
-def validate_bank_statement_pdf(file_path: str, filename: str, extracted_text: str) -> Dict[str, Any]:
+def validate_bank_statement_pdf(source: Union[str, fitz.Document], filename: str, extracted_text: str, progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
     """
     Main validation function to check if uploaded PDF is a valid bank statement
     
+    source is the PDF's file path or its open fitz.Document.
+    
+    progress, if given, receives the content analysis confidence as
+    progress("validation", "analyzed", ...).
+    
     Returns:
         Dict containing validation results and suggestions
     """
     validator = BankStatementValidator()
     
     # Step 1: Validate file type
-    is_valid_pdf, pdf_message = validator.validate_file_type(file_path, filename)
+    is_valid_pdf, pdf_message = validator.validate_file_type(source, filename)
     if not is_valid_pdf:
         return {
             "is_valid": False,
@@ -187,6 +199,9 @@ def validate_bank_statement_pdf(file_path: str, filename: str, extracted_text: s
     # Step 2: Analyze content
     content_analysis = validator.analyze_pdf_content(extracted_text)
     
+    if progress is not None:
+        progress("validation", "analyzed", confidence=content_analysis["confidence"], is_bank_statement=content_analysis["is_bank_statement"])
+    
     if not content_analysis["is_bank_statement"]:
         return {
             "is_valid": False,
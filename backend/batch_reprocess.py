@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Overnight reprocessing of bank statements through the Message Batches API
+
+Extracts every PDF given (or found in the given directories) in one batch
+submission at half the standard API price, and writes one JSON result per
+statement. Batches can take hours; the script polls until they finish.
+
+    python batch_reprocess.py statements/ --output reprocessed/
+
+Against the local mock (see mock_anthropic_api.py):
+    ANTHROPIC_BASE_URL=http://localhost:8081 MESSAGE_BATCH_POLL_SECONDS=1 python batch_reprocess.py statements/
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from app.services.pdf_parser import pdf_to_text
+from app.services.message_batches import extract_statements_batch
+from app.services.statement_pipeline import validate_extraction_data
+from app.services.claude import close_async_client
+
+def find_statements(paths):
+    """PDF files named directly or found (recursively) in directories"""
+    statements = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            statements.extend(sorted(path.rglob("*.pdf")))
+        elif path.suffix.lower() == ".pdf":
+            statements.append(path)
+    return statements
+
+async def reprocess(pdf_paths, output_dir, password=None):
+    texts = {}
+    for pdf_path in pdf_paths:
+        try:
+            texts[str(pdf_path)] = await asyncio.to_thread(pdf_to_text, str(pdf_path), password)
+            print(f"📄 Parsed {pdf_path}")
+        except Exception as e:
+            print(f"❌ Could not parse {pdf_path}: {e}")
+
+    print(f"\n📦 Submitting {len(texts)} statements as a message batch...")
+    try:
+        results = await extract_statements_batch(texts)
+    finally:
+        await close_async_client()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    total_cost = 0.0
+    failures = 0
+
+    for pdf_path, result in results.items():
+        if "error" in result:
+            failures += 1
+            print(f"❌ {pdf_path}: {result['error']}")
+            continue
+
+        extracted = validate_extraction_data(result)
+        output_path = output_dir / f"{Path(pdf_path).stem}.json"
+        output_path.write_text(json.dumps({"extracted": extracted, "api_cost": result.get("api_cost", {})}, indent=2))
+
+        cost = result.get("api_cost", {}).get("total_cost_usd", 0)
+        total_cost += cost
+        count = len(extracted["transactions"]["income"]) + len(extracted["transactions"]["expenses"])
+        print(f"✅ {pdf_path}: {count} transactions, ${cost:.4f} → {output_path}")
+
+    print(f"\n💰 Total batch cost: ${total_cost:.4f} ({failures} failed)")
+    return failures == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess bank statements with the Message Batches API")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDFs")
+    parser.add_argument("--output", default="reprocessed", help="Directory for the JSON results")
+    parser.add_argument("--password", help="Password for protected PDFs")
+    args = parser.parse_args()
+
+    pdf_paths = find_statements(args.paths)
+    if not pdf_paths:
+        print("❌ No PDF statements found")
+        sys.exit(1)
+
+    ok = asyncio.run(reprocess(pdf_paths, Path(args.output), args.password))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
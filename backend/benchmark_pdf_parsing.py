@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark PDF text extraction: the single-pass pdf_to_text against the
+previous three-pass extraction (get_text(), get_text(sort=True) and a
+get_text("dict") walk per page)
+
+Reports the time per page of each and checks that both produce identical
+text. Without arguments a synthetic corpus of statement-like PDFs is
+generated; pass PDF files or directories to benchmark real statements.
+
+    python benchmark_pdf_parsing.py
+    python benchmark_pdf_parsing.py statements/ --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fitz
+
+from app.services.pdf_parser import pdf_to_text, clean_extracted_text
+
+def legacy_pdf_to_text(filepath, password=None):
+    """The three-pass extraction pdf_to_text used before (reference output)"""
+    doc = fitz.open(filepath)
+    if doc.needs_pass:
+        doc.authenticate(password or "")
+
+    full_text = ""
+    for page_num in range(len(doc)):
+        page = doc.load_page(page_num)
+        text1 = page.get_text()
+        text2 = page.get_text("text", sort=True)
+        block_text = ""
+        for block in page.get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                line_text = "".join(span["text"] for span in line["spans"])
+                if line_text.strip():
+                    block_text += line_text + "\n"
+
+        if len(text2) > len(text1) and len(text2) > len(block_text):
+            page_text = text2
+        elif len(block_text) > len(text1):
+            page_text = block_text
+        else:
+            page_text = text1
+
+        full_text += f"\n--- PAGE {page_num + 1} ---\n"
+        full_text += clean_extracted_text(page_text) + "\n"
+
+    doc.close()
+    return full_text
+
+def generate_corpus(directory, statements=6, pages=8):
+    """Statement-like PDFs in a few layouts: column tables, wrapped descriptions, headers and footers"""
+    paths = []
+    for n in range(statements):
+        doc = fitz.open()
+        for p in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 50), "SAMPLE BANK PLC          Statement of Account", fontsize=11)
+            page.insert_text((72, 66), f"Account 1234-{n:08d}-001    Page {p + 1} of {pages}", fontsize=9)
+            page.insert_text((72, 90), "Date        Description                      Debit        Credit      Balance", fontsize=8)
+            y = 104
+            for row in range(45):
+                amount = (n + 1) * (row + 1) * 123.45
+                page.insert_text((72, y), f"{row % 28 + 1:02d}/{p % 12 + 1:02d}/2024", fontsize=8)
+                page.insert_text((130, y), f"POS PURCHASE MERCHANT {row} REF{n}{p}{row}", fontsize=8)
+                if n % 2 == 0:
+                    page.insert_text((300, y), f"{amount:,.2f}", fontsize=8)
+                else:
+                    page.insert_text((370, y), f"{amount:,.2f}", fontsize=8)
+                page.insert_text((440, y), f"{amount * 7:,.2f}", fontsize=8)
+                if n % 3 == 2 and row % 5 == 0:
+                    y += 11
+                    page.insert_text((130, y), "continued description line", fontsize=8)
+                y += 14
+            page.insert_text((72, 800), "This is a computer generated statement and requires no signature.", fontsize=7)
+        path = os.path.join(directory, f"sample_{n + 1}.pdf")
+        doc.save(path)
+        doc.close()
+        paths.append(Path(path))
+    return paths
+
+def find_pdfs(paths):
+    pdfs = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            pdfs.extend(sorted(path.rglob("*.pdf")))
+        elif path.suffix.lower() == ".pdf":
+            pdfs.append(path)
+    return pdfs
+
+def best_time(function, filepath, password, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        text = function(str(filepath), password)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, text
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single-pass vs three-pass PDF text extraction")
+    parser.add_argument("paths", nargs="*", help="PDF files or directories (default: generated sample corpus)")
+    parser.add_argument("--password", help="Password for protected PDFs")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per file; the fastest is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        pdfs = find_pdfs(args.paths) if args.paths else generate_corpus(corpus_dir)
+        if not pdfs:
+            print("❌ No PDF files found")
+            sys.exit(1)
+
+        total_pages = 0
+        total_legacy = 0.0
+        total_single = 0.0
+        mismatches = 0
+
+        print(f"{'file':<32} {'pages':>5} {'3-pass ms/page':>15} {'1-pass ms/page':>15} {'speedup':>8}  output")
+        for pdf in pdfs:
+            with fitz.open(str(pdf)) as doc:
+                pages = max(1, len(doc))
+            legacy_time, legacy_text = best_time(legacy_pdf_to_text, pdf, args.password, args.repeat)
+            single_time, single_text = best_time(pdf_to_text, pdf, args.password, args.repeat)
+            identical = legacy_text == single_text
+            mismatches += 0 if identical else 1
+
+            total_pages += pages
+            total_legacy += legacy_time
+            total_single += single_time
+            print(f"{pdf.name[:32]:<32} {pages:>5} {legacy_time / pages * 1000:>15.2f} {single_time / pages * 1000:>15.2f} "
+                  f"{legacy_time / single_time:>7.2f}x  {'identical' if identical else 'DIFFERENT'}")
+
+        print(f"\n📊 {total_pages} pages: {total_legacy / total_pages * 1000:.2f} ms/page → "
+              f"{total_single / total_pages * 1000:.2f} ms/page ({total_legacy / total_single:.2f}x faster)")
+        print("✅ Output identical for every file" if mismatches == 0 else f"❌ Output differs for {mismatches} files")
+        sys.exit(0 if mismatches == 0 else 1)
+
+if __name__ == "__main__":
+    main()
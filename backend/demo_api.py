@@ -26,27 +26,41 @@ def analyze_bank_statement(pdf_path, password=None):
     """
     url = f"{API_BASE_URL}/upload/"
     
-    # Prepare files and data
+    # Prepare files and data; mode=stream reports progress as server-sent events
     files = {'file': open(pdf_path, 'rb')}
-    data = {}
+    data = {'mode': 'stream'}
     if password:
         data['password'] = password
     
     try:
         print(f"📄 Analyzing: {pdf_path}")
-        response = requests.post(url, files=files, data=data, timeout=120)
+        # No overall deadline: the server sends events (or keepalives) every
+        # few seconds, so only a stalled connection times out
+        response = requests.post(url, files=files, data=data, stream=True, timeout=(10, 60))
         response.raise_for_status()
         
-        result = response.json()
-        if 'error' in result:
-            print(f"❌ Analysis failed: {result['error']}")
+        status_code, result = None, None
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            event = json.loads(line[5:])
+            if event['stage'] == 'result':
+                status_code, result = event['status_code'], event['result']
+            else:
+                print_progress_event(event)
+        
+        if result is None:
+            print("❌ Connection closed before the analysis finished")
+            return None
+        if status_code >= 400 or 'error' in result:
+            print(f"❌ Analysis failed: {result.get('error')}")
             return None
             
         print("✅ Analysis completed successfully!")
         return result['extracted']
         
     except requests.exceptions.Timeout:
-        print("❌ Request timed out (>2 minutes)")
+        print("❌ Server stopped responding (no progress for 60 seconds)")
         return None
     except requests.exceptions.RequestException as e:
         print(f"❌ Request failed: {e}")
@@ -54,6 +68,28 @@ def analyze_bank_statement(pdf_path, password=None):
     finally:
         files['file'].close()
 
+def print_progress_event(event):
+    """Print a one-line summary of a processing progress event"""
+    stage, status = event['stage'], event['status']
+    if status == 'page_parsed':
+        print(f"   📑 Parsed page {event['page']}/{event['pages']}")
+    elif status == 'analyzed':
+        print(f"   🔎 Bank statement confidence: {event['confidence']*100:.1f}%")
+    elif status == 'chunks_counted':
+        print(f"   🤖 Statement split into {event['chunks']} chunks")
+    elif status == 'chunk_started':
+        print(f"   🤖 Chunk {event['chunk']}/{event.get('chunks') or '?'} started")
+    elif status == 'transaction_extracted':
+        for kind, transactions in event['transactions'].items():
+            for t in transactions:
+                print(f"   💸 {t.get('date')} {t.get('description')} {t.get('amount')} ({'income' if kind == 'income' else 'expense'})")
+    elif status == 'chunk_finished':
+        print(f"   🤖 Chunk {event['chunk']}/{event.get('chunks') or '?'} finished "
+              f"({event.get('input_tokens', 0)} in / {event.get('output_tokens', 0)} out tokens, "
+              f"{event.get('transactions_so_far', 0)} transactions so far)")
+    elif status in ('completed', 'failed'):
+        print(f"   {'✓' if status == 'completed' else '✗'} {stage} {status}")
+
 def generate_pdf_report(analysis_data, output_path=None):
     """
     Generate a PDF report from analysis data
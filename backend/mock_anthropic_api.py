@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Anthropic Messages API, for exercising the backend
+without network access or API spend.
+
+Run it and point the backend at it:
+    uvicorn mock_anthropic_api:app --port 8081
+    ANTHROPIC_BASE_URL=http://localhost:8081 uvicorn app.main:app --port 8000
+
+The mock emulates prompt caching: the first request carrying a given
+cache_control system prefix reports cache_creation_input_tokens, later ones
+report cache_read_input_tokens. As with Sonnet, prefixes shorter than
+MOCK_CACHE_MIN_TOKENS (1024) are not cached and are billed as input_tokens.
+Requests with "stream": true get the response as server-sent events in
+small text deltas.
+
+The Message Batches endpoints are emulated too: a batch reports
+"in_progress" for its first MOCK_BATCH_POLLS status checks, then "ended",
+and its results are built like regular messages.
+
+Output longer than the request's max_tokens (at the mock's 4 characters per
+token) is cut off with stop_reason "max_tokens", like a real truncated
+response.
+"""
+
+import hashlib
+import json
+import os
+import re
+import uuid
+
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+
+app = FastAPI(title="Mock Anthropic API")
+
+# Hashes of system prompt prefixes that have been "cached"
+prompt_cache = set()
+MOCK_CACHE_MIN_TOKENS = int(os.getenv("MOCK_CACHE_MIN_TOKENS", "1024"))  # Shortest cacheable prefix
+
+# Message batches by id: {"requests": [...], "polls": n}
+message_batches = {}
+MOCK_BATCH_POLLS = int(os.getenv("MOCK_BATCH_POLLS", "1"))
+
+ROW_PATTERN = re.compile(r'^(?:L\d+:\s*)?(\d{2}[A-Z]{3}\d{4}|\d{1,2}/\d{1,2}/\d{4})\s+(.*?)\s+([\d,]+\.\d{2})')
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def fake_extraction(statement_text):
+    """Treat every dated line with an amount as an expense"""
+    expenses = []
+    for line in statement_text.split('\n'):
+        match = ROW_PATTERN.match(line.strip())
+        if match:
+            expenses.append({
+                "date": match.group(1),
+                "description": match.group(2),
+                "amount": float(match.group(3).replace(',', '')),
+                "reference": ""
+            })
+    return {
+        "account_details": {"name": "MOCK ACCOUNT", "account_number": "0000", "currency": "LKR", "statement_date": "Mock"},
+        "final_balance": 0.0,
+        "transactions": {"income": [], "expenses": expenses}
+    }
+
+def fake_rows(extraction):
+    """The same extraction in the compact row format"""
+    details = extraction["account_details"]
+    lines = [
+        f"ACCOUNT|{details['name']}|{details['account_number']}|{details['currency']}|{details['statement_date']}",
+        f"BALANCE|{extraction['final_balance']:.2f}"
+    ]
+    for kind, code in (("income", "I"), ("expenses", "E")):
+        for t in extraction["transactions"][kind]:
+            lines.append(f"{code}|{t['date']}|{t['description']}|{t['amount']:.2f}|{t['reference']}")
+    return "\n".join(lines)
+
+def message_text(content):
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+def build_message(body):
+    """Build a Messages API response (and its usage block) for a request body"""
+    user_text = "".join(message_text(m["content"]) for m in body.get("messages", []))
+
+    system_blocks = body.get("system", []) if isinstance(body.get("system"), list) else []
+    system_tokens = sum(estimate_tokens(block.get("text", "")) for block in system_blocks)
+
+    # The cached prefix runs up to the last cache_control block, if long enough
+    prefix_tokens = 0
+    cacheable_tokens = 0
+    prefix = hashlib.sha256()
+    for block in system_blocks:
+        prefix_tokens += estimate_tokens(block.get("text", ""))
+        prefix.update(block.get("text", "").encode("utf-8"))
+        if block.get("cache_control") and prefix_tokens >= MOCK_CACHE_MIN_TOKENS:
+            cacheable_tokens = prefix_tokens
+            key = prefix.hexdigest()
+
+    cache_creation = 0
+    cache_read = 0
+    if cacheable_tokens:
+        if key in prompt_cache:
+            cache_read = cacheable_tokens
+        else:
+            prompt_cache.add(key)
+            cache_creation = cacheable_tokens
+
+    extraction = fake_extraction(user_text)
+    if any("ROW OUTPUT FORMAT" in block.get("text", "") for block in system_blocks):
+        output = fake_rows(extraction)
+    else:
+        output = json.dumps(extraction)
+
+    stop_reason = "end_turn"
+    max_chars = body.get("max_tokens", 4096) * 4
+    if len(output) > max_chars:
+        output = output[:max_chars]
+        stop_reason = "max_tokens"
+
+    return {
+        "id": "msg_mock",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model"),
+        "content": [{"type": "text", "text": output}],
+        "stop_reason": stop_reason,
+        "usage": {
+            "input_tokens": estimate_tokens(user_text) + system_tokens - cacheable_tokens,
+            "output_tokens": estimate_tokens(output),
+            "cache_creation_input_tokens": cache_creation,
+            "cache_read_input_tokens": cache_read
+        }
+    }
+
+def sse(event_type, payload):
+    return f"event: {event_type}\ndata: {json.dumps(dict(payload, type=event_type))}\n\n"
+
+def stream_message(message, delta_size=40):
+    """Server-sent events for a message, mirroring the Messages streaming format"""
+    text = message["content"][0]["text"]
+    usage = message["usage"]
+    start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))
+
+    yield sse("message_start", {"message": start})
+    yield sse("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+    for i in range(0, len(text), delta_size):
+        yield sse("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": text[i:i + delta_size]}})
+    yield sse("content_block_stop", {"index": 0})
+    yield sse("message_delta", {"delta": {"stop_reason": message["stop_reason"]}, "usage": {"output_tokens": usage["output_tokens"]}})
+    yield sse("message_stop", {})
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    body = await request.json()
+    message = build_message(body)
+    if body.get("stream"):
+        return StreamingResponse(stream_message(message), media_type="text/event-stream")
+    return message
+
+def batch_object(batch_id, request):
+    batch = message_batches[batch_id]
+    ended = batch["polls"] > MOCK_BATCH_POLLS
+    count = len(batch["requests"])
+    base_url = str(request.base_url).rstrip("/")
+    return {
+        "id": batch_id,
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {
+            "processing": 0 if ended else count,
+            "succeeded": count if ended else 0,
+            "errored": 0,
+            "canceled": 0,
+            "expired": 0
+        },
+        "results_url": f"{base_url}/v1/messages/batches/{batch_id}/results" if ended else None
+    }
+
+@app.post("/v1/messages/batches")
+async def create_message_batch(request: Request):
+    body = await request.json()
+    batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+    message_batches[batch_id] = {"requests": body["requests"], "polls": 0}
+    return batch_object(batch_id, request)
+
+@app.get("/v1/messages/batches/{batch_id}")
+async def get_message_batch(batch_id: str, request: Request):
+    if batch_id not in message_batches:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    message_batches[batch_id]["polls"] += 1
+    return batch_object(batch_id, request)
+
+@app.get("/v1/messages/batches/{batch_id}/results")
+async def get_message_batch_results(batch_id: str):
+    if batch_id not in message_batches:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    lines = [
+        json.dumps({"custom_id": entry["custom_id"], "result": {"type": "succeeded", "message": build_message(entry["params"])}})
+        for entry in message_batches[batch_id]["requests"]
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="application/x-jsonl")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for merging batch results into one timeline (app/services/batch.py)
+
+Run with pytest or directly: python test_batch_timeline.py
+"""
+
+from app.services.batch import merge_statement_timeline
+
+def transaction(date, description, amount):
+    return {"date": date, "description": description, "amount": amount}
+
+def statement(filename, income=(), expenses=(), status_code=200):
+    return {
+        "filename": filename,
+        "status_code": status_code,
+        "result": {"extracted": {"transactions": {"income": list(income), "expenses": list(expenses)}}}
+    }
+
+def test_overlap_between_statements_removed():
+    """A transaction repeated in the next statement's overlap is kept once"""
+    boundary = transaction("30/06/2024", "CARD PURCHASE", 2500.0)
+    merged = merge_statement_timeline([
+        statement("june.pdf", expenses=[transaction("10/06/2024", "ATM", 5000.0), boundary]),
+        statement("july.pdf", expenses=[dict(boundary, description=" card purchase "), transaction("05/07/2024", "ATM", 5000.0)]),
+    ])
+    assert [t["date"] for t in merged["transactions"]["expenses"]] == ["10/06/2024", "30/06/2024", "05/07/2024"]
+    assert merged["duplicates_removed"] == 1
+    assert merged["timeline"][1]["source"] == "june.pdf"
+    print("✅ Overlapping transactions are de-duplicated")
+
+def test_repeats_within_a_statement_kept():
+    """Identical transactions on one statement are real and all survive"""
+    coffee = transaction("12/06/2024", "COFFEE SHOP", 450.0)
+    merged = merge_statement_timeline([
+        statement("june.pdf", expenses=[coffee, coffee]),
+        statement("june-copy.pdf", expenses=[coffee]),
+        statement("june-again.pdf", expenses=[coffee, coffee, coffee]),
+    ])
+    assert len(merged["transactions"]["expenses"]) == 3
+    assert merged["duplicates_removed"] == 3
+    print("✅ Repeats within a statement are kept")
+
+def test_income_and_expenses_kept_apart():
+    """The same date, description and amount may be both income and an expense"""
+    transfer = transaction("15/06/2024", "TRANSFER", 1000.0)
+    merged = merge_statement_timeline([statement("june.pdf", income=[transfer], expenses=[transfer])])
+    assert len(merged["timeline"]) == 2
+    assert sorted(t["type"] for t in merged["timeline"]) == ["expenses", "income"]
+    print("✅ Income and expenses are de-duplicated separately")
+
+def test_timeline_sorted_by_date():
+    """Statements may arrive in any order; unparseable dates go last"""
+    merged = merge_statement_timeline([
+        statement("july.pdf", income=[transaction("01/07/2024", "SALARY", 50000.0)]),
+        statement("june.pdf", expenses=[transaction("sometime", "FEE", 10.0), transaction("02JUN2024", "RENT", 20000.0)]),
+    ])
+    assert [t["description"] for t in merged["timeline"]] == ["RENT", "SALARY", "FEE"]
+    print("✅ Timeline is in date order")
+
+def test_failed_statements_skipped():
+    """Files that failed to process contribute nothing"""
+    failed = {"filename": "broken.pdf", "status_code": 400, "result": {"error": "PDF parsing failed"}}
+    merged = merge_statement_timeline([failed, statement("june.pdf", income=[transaction("01/06/2024", "SALARY", 1.0)])])
+    assert len(merged["timeline"]) == 1
+    assert merged["duplicates_removed"] == 0
+    print("✅ Failed statements are skipped")
+
+if __name__ == "__main__":
+    test_overlap_between_statements_removed()
+    test_repeats_within_a_statement_kept()
+    test_income_and_expenses_kept_apart()
+    test_timeline_sorted_by_date()
+    test_failed_statements_skipped()
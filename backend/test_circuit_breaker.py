@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the Claude API circuit breaker (app/services/claude.py)
+
+Run with pytest or directly: python test_circuit_breaker.py
+"""
+
+from app.services.claude import CircuitBreaker, CircuitOpenError
+
+def make_breaker(**overrides):
+    """Breaker that judges after 4 calls and fails fast for 30 seconds"""
+    settings = dict(window_seconds=60, min_calls=4, error_rate=0.5, slow_call_seconds=10,
+                    slow_call_rate=0.8, open_seconds=30, half_open_probes=1)
+    settings.update(overrides)
+    return CircuitBreaker(**settings)
+
+def open_breaker(breaker):
+    """Fail enough calls to open the breaker"""
+    for _ in range(breaker.min_calls):
+        breaker.before_call()
+        breaker.record(True, 1.0)
+    assert breaker.state == "open"
+
+def expire_open_period(breaker):
+    """Pretend the fast-fail period has passed"""
+    breaker.opened_at -= breaker.open_seconds
+
+def test_opens_on_error_rate():
+    """The breaker only judges a full sample, then opens at the error rate"""
+    breaker = make_breaker()
+    for failed in (True, True, False):
+        assert breaker.before_call() is False
+        breaker.record(failed, 1.0)
+    assert breaker.state == "closed"
+
+    breaker.before_call()
+    breaker.record(False, 1.0)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 1
+
+    try:
+        breaker.before_call()
+        assert False, "an open breaker must fail fast"
+    except CircuitOpenError as e:
+        assert 0 < e.retry_after <= 30
+    print("✅ Breaker opens once the error rate is crossed")
+
+def test_opens_on_slow_calls():
+    """Successful but slow calls open the breaker too"""
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.before_call()
+        breaker.record(False, 12.0)
+    assert breaker.state == "open"
+    print("✅ Breaker opens on slow calls")
+
+def test_half_open_probe_closes():
+    """After the open period one probe is admitted; its success closes the breaker"""
+    breaker = make_breaker()
+    open_breaker(breaker)
+    expire_open_period(breaker)
+
+    assert breaker.before_call() is True
+    assert breaker.state == "half_open"
+    try:
+        breaker.before_call()
+        assert False, "only half_open_probes calls may probe at once"
+    except CircuitOpenError:
+        pass
+
+    breaker.record(False, 1.0, probe=True)
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+    print("✅ Successful probe closes the breaker")
+
+def test_half_open_probe_failure_reopens():
+    """A failed probe opens the breaker for another full period"""
+    breaker = make_breaker()
+    open_breaker(breaker)
+    expire_open_period(breaker)
+
+    probe = breaker.before_call()
+    breaker.record(True, 1.0, probe)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+    print("✅ Failed probe reopens the breaker")
+
+def test_released_probe_frees_its_slot():
+    """A probe that ends without a verdict (e.g. a 429) lets the next call probe"""
+    breaker = make_breaker()
+    open_breaker(breaker)
+    expire_open_period(breaker)
+
+    probe = breaker.before_call()
+    breaker.release(probe)
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+    print("✅ Released probe slot is reused")
+
+if __name__ == "__main__":
+    test_opens_on_error_rate()
+    test_opens_on_slow_calls()
+    test_half_open_probe_closes()
+    test_half_open_probe_failure_reopens()
+    test_released_probe_frees_its_slot()
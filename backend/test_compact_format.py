@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for the compact row output format (app/services/compact_format.py)
+
+Run with pytest or directly: python test_compact_format.py
+"""
+
+from app.services.compact_format import parse_compact_rows, CompactRowStreamParser
+
+RESPONSE = "\n".join([
+    "```",
+    "ACCOUNT|A B PERERA|1234-56789012-345|LKR|01/06/2024 - 30/06/2024",
+    "BALANCE|-1,250.50",
+    "I|03/06/2024|SALARY ACME LTD|LKR 50,000.00|REF1",
+    "E|05/06/2024|ATM WITHDRAWAL|-5,000.00|",
+    "E|10/06/2024|CARD PURCHASE|2,500.00",
+    "not a row",
+    "```",
+])
+
+EXPECTED = [
+    ("income", {"date": "03/06/2024", "description": "SALARY ACME LTD", "amount": 50000.0, "reference": "REF1"}),
+    ("expenses", {"date": "05/06/2024", "description": "ATM WITHDRAWAL", "amount": 5000.0, "reference": ""}),
+    ("expenses", {"date": "10/06/2024", "description": "CARD PURCHASE", "amount": 2500.0, "reference": ""}),
+]
+
+def test_parse_compact_rows():
+    """Rows become the usual extraction structure with positive transaction amounts"""
+    result = parse_compact_rows(RESPONSE)
+    assert result["account_details"] == {
+        "name": "A B PERERA",
+        "account_number": "1234-56789012-345",
+        "currency": "LKR",
+        "statement_date": "01/06/2024 - 30/06/2024"
+    }
+    assert result["transactions"]["income"] == [t for kind, t in EXPECTED if kind == "income"]
+    assert result["transactions"]["expenses"] == [t for kind, t in EXPECTED if kind == "expenses"]
+    print("✅ Compact rows parsed into transactions")
+
+def test_balance_keeps_its_sign():
+    """An overdrawn final balance stays negative; only transaction amounts are made positive"""
+    assert parse_compact_rows(RESPONSE)["final_balance"] == -1250.5
+    assert parse_compact_rows("BALANCE|LKR 1,250.50")["final_balance"] == 1250.5
+    print("✅ BALANCE keeps its sign")
+
+def test_no_rows_returns_none():
+    assert parse_compact_rows("I could not find any transactions.") is None
+    print("✅ Text without rows is not a result")
+
+def test_stream_parser_at_any_split():
+    """Every split of the stream yields the same transactions as the full parse"""
+    for split in range(len(RESPONSE) + 1):
+        parser = CompactRowStreamParser()
+        emitted = parser.feed(RESPONSE[:split]) + parser.feed(RESPONSE[split:]) + parser.flush()
+        assert emitted == EXPECTED, f"split at {split}"
+    print("✅ Streamed rows parsed identically at every split point")
+
+def test_stream_parser_emits_complete_lines_only():
+    """A row is emitted once its newline arrives, or at flush for the last line"""
+    parser = CompactRowStreamParser()
+    assert parser.feed("E|05/06/2024|ATM WITHDRAWAL|5,0") == []
+    assert parser.feed("00.00|\nE|10/06/2024|CARD") == [EXPECTED[1]]
+    assert parser.feed(" PURCHASE|2,500.00") == []
+    assert parser.flush() == [EXPECTED[2]]
+    assert parser.flush() == []
+    print("✅ Rows are emitted when their line completes")
+
+if __name__ == "__main__":
+    test_parse_compact_rows()
+    test_balance_keeps_its_sign()
+    test_no_rows_returns_none()
+    test_stream_parser_at_any_split()
+    test_stream_parser_emits_complete_lines_only()
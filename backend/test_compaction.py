@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for statement text compaction (app/services/compaction.py)
+
+Run with pytest or directly: python test_compaction.py
+"""
+
+from app.services.compaction import compact_statement_text, StatementCompactor
+
+def make_statement(pages=4):
+    """Statement text with a header, a footer and repeated continuation lines on every page"""
+    parts = []
+    for page in range(1, pages + 1):
+        parts.append(f"\n--- PAGE {page} ---")
+        parts.append("SAMPLE BANK PLC Statement of Account")
+        parts.append("Date Description Debit Credit Balance")
+        parts.append(f"0{page}/03/2024 ATM 00{page} 2,000.00 48,000.00")
+        parts.append("ATM WITHDRAWAL")
+        parts.append(f"1{page}/03/2024 EMPLOYER LTD 50,000.00 98,000.00")
+        parts.append("SALARY CREDIT")
+        parts.append(f"2{page}/03/2024 SUPERMARKET 1,500.00 96,500.00")
+        parts.append("CARD PURCHASE")
+        parts.append(f"Page {page} of {pages}")
+    return "\n".join(parts) + "\n"
+
+def test_continuation_lines_are_kept():
+    """Description lines under a transaction repeat on every page but are not page furniture"""
+    compacted, stats = compact_statement_text(make_statement())
+
+    assert compacted.count("ATM WITHDRAWAL") == 4
+    assert compacted.count("SALARY CREDIT") == 4
+    assert compacted.count("CARD PURCHASE") == 4
+    print("✅ Continuation lines kept on every page")
+
+def test_furniture_is_removed_once():
+    """Headers before the first row and footers after the last are furniture; their first occurrence is kept"""
+    compacted, stats = compact_statement_text(make_statement())
+
+    assert compacted.count("SAMPLE BANK PLC Statement of Account") == 1
+    assert compacted.count("Date Description Debit Credit Balance") == 1
+    assert compacted.count(" of 4") == 1
+    assert stats["repeated_lines_removed"] == 9
+    assert compacted.count("--- PAGE") == 4
+    print("✅ Page headers and footers removed after their first occurrence")
+
+def test_streaming_matches_whole_text():
+    """Feeding the text in pieces gives the same result as compacting it at once"""
+    text = make_statement(6)
+    expected, expected_stats = compact_statement_text(text)
+
+    compactor = StatementCompactor()
+    pieces = [compactor.feed(text[i:i + 37]) for i in range(0, len(text), 37)]
+    assert "".join(pieces) + compactor.finish() == expected
+    assert compactor.stats == expected_stats
+    print("✅ Incremental compaction matches whole-text compaction")
+
+if __name__ == "__main__":
+    test_continuation_lines_are_kept()
+    test_furniture_is_removed_once()
+    test_streaming_matches_whole_text()
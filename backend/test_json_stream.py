@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental parsing of streamed JSON extraction output (app/services/json_stream.py)
+
+Run with pytest or directly: python test_json_stream.py
+"""
+
+import json
+
+from app.services.json_stream import TransactionStreamParser
+
+RESPONSE = {
+    "account_details": {"name": "A {B} PERERA", "account_number": "123", "currency": "LKR", "statement_date": "06/2024"},
+    "final_balance": 52500.0,
+    "transactions": {
+        "income": [
+            {"date": "03/06/2024", "description": "SALARY \"JUNE\" {ACME}", "amount": 50000.0, "reference": ""}
+        ],
+        "expenses": [
+            {"date": "05/06/2024", "description": "ATM [COLOMBO]\\WITHDRAWAL", "amount": 5000.0, "reference": "R1"},
+            {"date": "10/06/2024", "description": "CARD, PURCHASE: SUPERMARKET", "amount": 2500.0, "reference": ""}
+        ]
+    }
+}
+
+def expected_transactions():
+    return [(kind, t) for kind in ("income", "expenses") for t in RESPONSE["transactions"][kind]]
+
+def parse_in_pieces(text, pieces):
+    """Feed text split at the given offsets and collect everything emitted"""
+    parser = TransactionStreamParser()
+    emitted = []
+    start = 0
+    for end in list(pieces) + [len(text)]:
+        emitted.extend(parser.feed(text[start:end]))
+        start = end
+    return emitted + parser.flush()
+
+def test_transactions_emitted_at_any_split():
+    """Every split of the response yields the same transactions, in order"""
+    text = "```json\n" + json.dumps(RESPONSE, indent=2) + "\n```"
+    for split in range(len(text) + 1):
+        assert parse_in_pieces(text, [split]) == expected_transactions(), f"split at {split}"
+    print("✅ Transactions parsed identically at every split point")
+
+def test_single_character_fragments():
+    """A stream delivered one character at a time still parses"""
+    text = json.dumps(RESPONSE)
+    assert parse_in_pieces(text, range(1, len(text))) == expected_transactions()
+    print("✅ Character-by-character stream parsed")
+
+def test_transactions_emitted_as_they_close():
+    """Each transaction is returned by the feed that closes its object"""
+    text = json.dumps(RESPONSE)
+    first_close = text.index('"reference": ""}') + len('"reference": ""')
+    parser = TransactionStreamParser()
+    assert parser.feed(text[:first_close]) == []
+    assert parser.feed(text[first_close:first_close + 1]) == expected_transactions()[:1]
+    print("✅ Transactions are emitted as soon as they close")
+
+def test_objects_outside_transaction_lists_ignored():
+    """account_details and nested lists elsewhere are not mistaken for transactions"""
+    text = json.dumps({"account_details": {"income": [{"date": "x"}]}, "transactions": {"income": [], "expenses": []}})
+    assert parse_in_pieces(text, []) == []
+    print("✅ Objects outside the transaction lists are ignored")
+
+def test_malformed_transaction_skipped():
+    """A transaction object that isn't valid JSON is dropped, later ones still parse"""
+    text = '{"transactions": {"expenses": [{"date": "01/06/2024", "amount": 1.0,}, {"date": "02/06/2024", "amount": 2.0}]}}'
+    assert parse_in_pieces(text, []) == [("expenses", {"date": "02/06/2024", "amount": 2.0})]
+    print("✅ Malformed transactions are skipped")
+
+if __name__ == "__main__":
+    test_transactions_emitted_at_any_split()
+    test_single_character_fragments()
+    test_transactions_emitted_as_they_close()
+    test_objects_outside_transaction_lists_ignored()
+    test_malformed_transaction_skipped()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for in-flight request coalescing (app/services/single_flight.py)
+
+Run with pytest or directly: python test_single_flight.py
+"""
+
+import asyncio
+
+from app.services.single_flight import SingleFlight, upload_fingerprint
+
+def recorder(events):
+    return lambda stage, status, **details: events.append((stage, status, details))
+
+def test_concurrent_calls_share_one_run():
+    """Callers with the same key await one task; later calls start fresh"""
+    async def scenario():
+        flight = SingleFlight()
+        runs = []
+
+        async def work(fanout):
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return len(runs)
+
+        results = await asyncio.gather(*(flight.run("key", work) for _ in range(3)))
+        assert results == [(1, False), (1, True), (1, True)]
+        assert await flight.run("key", work) == (2, False)
+        assert flight.inflight == {} and flight.progress == {}
+
+    asyncio.run(scenario())
+    print("✅ Concurrent identical calls are coalesced")
+
+def test_progress_reaches_every_caller():
+    """Callers joining late get the earlier events replayed, then the live ones"""
+    async def scenario():
+        flight = SingleFlight()
+        first, second = [], []
+        joined = asyncio.Event()
+
+        async def work(fanout):
+            fanout("pdf_parsing", "running")
+            await joined.wait()
+            fanout("pdf_parsing", "completed", pages=2)
+            return "done"
+
+        leader = asyncio.ensure_future(flight.run("key", work, recorder(first)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.run("key", work, recorder(second)))
+        await asyncio.sleep(0)
+        joined.set()
+        assert await leader == ("done", False)
+        assert await follower == ("done", True)
+
+        expected = [("pdf_parsing", "running", {}), ("pdf_parsing", "completed", {"pages": 2})]
+        assert first == expected
+        assert second == expected
+
+    asyncio.run(scenario())
+    print("✅ Progress events are forwarded to every caller")
+
+def test_fanout_is_falsy_without_listeners():
+    """Work started without a listener sees a falsy fanout until someone subscribes"""
+    async def scenario():
+        flight = SingleFlight()
+        seen = []
+        subscribed = asyncio.Event()
+
+        async def work(fanout):
+            seen.append(bool(fanout))
+            await subscribed.wait()
+            seen.append(bool(fanout))
+
+        leader = asyncio.ensure_future(flight.run("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.run("key", work, recorder([])))
+        await asyncio.sleep(0)
+        subscribed.set()
+        await asyncio.gather(leader, follower)
+        assert seen == [False, True]
+
+    asyncio.run(scenario())
+    print("✅ Fanout is truthy only while someone listens")
+
+def test_upload_fingerprint():
+    """Bytes, filename and password all distinguish uploads"""
+    key = upload_fingerprint(b"%PDF-1.7", "a.pdf", None)
+    assert key == upload_fingerprint(b"%PDF-1.7", "a.pdf", "")
+    assert key != upload_fingerprint(b"%PDF-1.7", "b.pdf", None)
+    assert key != upload_fingerprint(b"%PDF-1.7", "a.pdf", "secret")
+    assert key != upload_fingerprint(b"%PDF-1.6", "a.pdf", None)
+    print("✅ Upload fingerprints distinguish uploads")
+
+if __name__ == "__main__":
+    test_concurrent_calls_share_one_run()
+    test_progress_reaches_every_caller()
+    test_fanout_is_falsy_without_listeners()
+    test_upload_fingerprint()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for rule-based statement templates (app/services/statement_templates.py)
+
+Run with pytest or directly: python test_statement_templates.py
+"""
+
+from app.services.statement_templates import extract_with_templates
+
+def make_statement(currency_line="Currency : SRI LANKA RUPEES"):
+    """Two-page Commercial Bank statement with multi-line descriptions and page footers"""
+    return "\n".join([
+        "--- PAGE 1 ---",
+        "COMMERCIAL BANK OF CEYLON PLC",
+        "Account Number : 1234-56789012-345",
+        "MR A B PERERA",
+        currency_line,
+        "Statement Date : 30/06/2024",
+        "Date Value Date Description Amount Balance",
+        "BALANCE B/F 10,000.00",
+        "03JUN2024 03JUN2024 SALARY 50,000.00 60,000.00",
+        "ACME LTD JUNE",
+        "05JUN2024 ATM WITHDRAWAL 5,000.00 55,000.00",
+        "This is a computer generated statement",
+        "Page 1 of 2",
+        "--- PAGE 2 ---",
+        "Date Value Date Description Amount Balance",
+        "10JUN2024 10JUN2024 CARD PURCHASE 2,500.00 52,500.00",
+        "SUPERMARKET",
+        "COLOMBO 03",
+        "EXTRA LINE",
+        "Page 2 of 2",
+        "BALANCE C/F 52,500.00",
+    ]) + "\n"
+
+def test_continuation_lines_stop_at_footers():
+    """Lines directly under a row extend its description; footers and later lines don't"""
+    name, result = extract_with_templates(make_statement())
+    assert name == "commercial_bank"
+
+    income = result["transactions"]["income"]
+    expenses = result["transactions"]["expenses"]
+    assert [t["description"] for t in income] == ["SALARY ACME LTD JUNE"]
+    assert [t["description"] for t in expenses] == ["ATM WITHDRAWAL", "CARD PURCHASE SUPERMARKET COLOMBO 03"]
+    assert result["final_balance"] == 52500.0
+    print("✅ Footers are kept out of transaction descriptions")
+
+def test_unknown_currency_is_not_uppercased():
+    """A missing currency is reported as "Unknown", like the other account details"""
+    name, result = extract_with_templates(make_statement(currency_line=""))
+    assert result["account_details"]["currency"] == "Unknown"
+
+    name, result = extract_with_templates(make_statement(currency_line="Currency : lkr"))
+    assert result["account_details"]["currency"] == "LKR"
+    print("✅ Currency fallback stays \"Unknown\"")
+
+if __name__ == "__main__":
+    test_continuation_lines_stop_at_footers()
+    test_unknown_currency_is_not_uppercased()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for upload ingestion and the upload size limit (app/services/upload_spool.py)
+
+Run with pytest or directly: python test_upload_spool.py
+"""
+
+import mmap
+
+from fastapi import FastAPI, UploadFile, File
+from fastapi.testclient import TestClient
+
+from app.services.upload_spool import spool_upload, UploadRejectedError, UploadSizeLimitMiddleware
+
+MAX_BYTES = 3 * 1024 * 1024
+REQUEST_LIMIT = 64 * 1024
+
+def make_client():
+    app = FastAPI()
+
+    @app.post("/spool")
+    async def spool(file: UploadFile = File(...)):
+        try:
+            view = await spool_upload(file, max_bytes=MAX_BYTES, allow_zip=file.filename.endswith(".zip"))
+        except UploadRejectedError as e:
+            return {"rejected": e.status_code}
+        return {"size": len(view), "mapped": isinstance(view.obj, mmap.mmap), "head": bytes(view[:5]).decode("latin-1")}
+
+    @app.post("/limited")
+    async def limited(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadSizeLimitMiddleware, limits={"/limited": REQUEST_LIMIT})
+    return TestClient(app)
+
+def upload(client, path, filename, content):
+    return client.post(path, files={"file": (filename, content)})
+
+def test_small_pdf_read_from_memory():
+    """Files Starlette kept in memory are returned as they are"""
+    response = upload(make_client(), "/spool", "a.pdf", b"%PDF-1.7" + b"x" * 1000).json()
+    assert response == {"size": 1008, "mapped": False, "head": "%PDF-"}
+    print("✅ Small uploads are read from memory")
+
+def test_large_pdf_mapped_from_spool_file():
+    """Files spooled to disk are memory-mapped instead of read"""
+    response = upload(make_client(), "/spool", "a.pdf", b"%PDF-1.7" + b"x" * 2_000_000).json()
+    assert response == {"size": 2_000_008, "mapped": True, "head": "%PDF-"}
+    print("✅ Large uploads are memory-mapped")
+
+def test_rejections():
+    """Wrong magic bytes give 400, files over the limit 413"""
+    client = make_client()
+    assert upload(client, "/spool", "a.pdf", b"hello" * 1000).json() == {"rejected": 400}
+    assert upload(client, "/spool", "a.pdf", b"PK\x03\x04" + b"x" * 100).json() == {"rejected": 400}
+    assert upload(client, "/spool", "a.zip", b"PK\x03\x04" + b"x" * 100).json()["size"] == 104
+    assert upload(client, "/spool", "a.pdf", b"%PDF-1.7" + b"x" * MAX_BYTES).json() == {"rejected": 413}
+    print("✅ Non-PDFs and oversized files are rejected")
+
+def test_middleware_refuses_large_bodies():
+    """Requests over the path's limit get 413, with or without a Content-Length"""
+    client = make_client()
+    assert upload(client, "/limited", "a.pdf", b"x" * 1000).json() == {"size": 1000}
+    assert upload(client, "/limited", "a.pdf", b"x" * (REQUEST_LIMIT + 1)).status_code == 413
+
+    def chunks():
+        for _ in range(20):
+            yield b"x" * 8192
+
+    response = client.post("/limited", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    print("✅ Oversized request bodies are refused")
+
+def test_middleware_ignores_other_paths():
+    """Only the configured paths are limited"""
+    response = upload(make_client(), "/spool", "a.pdf", b"%PDF-1.7" + b"x" * (REQUEST_LIMIT * 2)).json()
+    assert response["size"] == REQUEST_LIMIT * 2 + 8
+    print("✅ Other paths are not limited")
+
+if __name__ == "__main__":
+    test_small_pdf_read_from_memory()
+    test_large_pdf_mapped_from_spool_file()
+    test_rejections()
+    test_middleware_refuses_large_bodies()
+    test_middleware_ignores_other_paths()